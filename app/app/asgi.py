@@ -2,6 +2,8 @@
 ASGI config for app project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Requests to /api/recipe/events are served by the change stream of recipe.events,
+which needs an ASGI server such as uvicorn or daphne.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
@@ -13,4 +15,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once get_asgi_application() has loaded the apps
+from recipe.events import EVENTS_PATH, EventStream  # noqa: E402
+
+events = EventStream()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == EVENTS_PATH:
+        await events(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
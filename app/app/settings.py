@@ -39,20 +39,22 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
-    'rest_framework.authtoken',
     'core',
     'user',
     'recipe',
 ]
 
 MIDDLEWARE = [
+    'core.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.replicas.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'app.urls'
@@ -89,6 +91,83 @@ DATABASES = {
     }
 }
 
+# Read replicas, given as a comma separated list of hosts in DB_REPLICA_HOSTS.
+# Safe requests read from them, see core.replicas.
+
+DATABASE_REPLICAS = []
+for index, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))):
+    alias = f'replica_{index}'
+    DATABASES[alias] = dict(DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['core.replicas.ReplicaRouter']
+
+# Seconds a client reads from primary after its own writes, pins are kept in
+# the REPLICA_PIN_CACHE cache which must be shared by all processes
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 5))
+REPLICA_PIN_CACHE = os.environ.get('REPLICA_PIN_CACHE', 'replica_pins')
+# Seconds a failing replica is skipped before being tried again
+REPLICA_RETRY_SECONDS = int(os.environ.get('REPLICA_RETRY_SECONDS', 30))
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+# default is per-process and bounded by MAX_ENTRIES, point it to a shared
+# backend when running several workers. replica_pins must be seen by every
+# process: with MEMCACHED_LOCATION (host:port, needs python-memcached) it lives
+# in memcached. Otherwise it falls back to a table of the primary database
+# (manage.py createcachetable). Every pin then runs a COUNT(*) of that table and
+# every safe request of a client reads it on the primary, so it is kept small
+# and a third of it is culled once full. idempotency is shared the same way,
+# a retry may reach another worker than the first request.
+# compression holds compressed bodies apart from default so large bodies never
+# push out small entries, see COMPRESSION_CACHE_MAX_SIZE for its size in bytes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    'replica_pins': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'core_replica_pin_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('REPLICA_PIN_CACHE_MAX_ENTRIES', 2000)),
+            'CULL_FREQUENCY': 3,
+        },
+    },
+    'idempotency': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'core_idempotency_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('IDEMPOTENCY_CACHE_MAX_ENTRIES', 20000)),
+            'CULL_FREQUENCY': 3,
+        },
+    },
+    'compression': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'compression',
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('COMPRESSION_CACHE_MAX_ENTRIES', 64)),
+        },
+    },
+}
+
+MEMCACHED_LOCATION = os.environ.get('MEMCACHED_LOCATION', '')
+if MEMCACHED_LOCATION:
+    CACHES['replica_pins'] = {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': MEMCACHED_LOCATION,
+        'KEY_PREFIX': 'replica_pins',
+    }
+    CACHES['idempotency'] = {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': MEMCACHED_LOCATION,
+        'KEY_PREFIX': 'idempotency',
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -127,9 +206,140 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.1/howto/static-files/
 
 STATIC_URL = '/static/'
-MEDIA = '/media/'
+MEDIA_URL = '/media/'
 
 STATIC_ROOT = '/vol/web/static'
 MEDIA_ROOT = '/vol/web/media'
 
+# Media files are served by core.media.serve_media. With MEDIA_ACCEL_REDIRECT set,
+# e.g. to /protected/, the body is sent by nginx from internal locations
+# <prefix>media/ (MEDIA_ROOT) and <prefix>thumbnails/ (THUMBNAIL_ROOT).
+MEDIA_ACCEL_REDIRECT = os.environ.get('MEDIA_ACCEL_REDIRECT', '')
+
+# Image thumbnails of the widths below are generated on first request, the least
+# recently used ones are removed once they take more than THUMBNAIL_CACHE_MAX_BYTES.
+THUMBNAIL_ROOT = os.environ.get('THUMBNAIL_ROOT', '/vol/web/thumbnails')
+THUMBNAIL_WIDTHS = (64, 128, 256, 512, 1024)
+THUMBNAIL_CACHE_MAX_BYTES = int(os.environ.get('THUMBNAIL_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
 AUTH_USER_MODEL = 'core.User'
+
+
+# Django REST framework
+# https://www.django-rest-framework.org/api-guide/settings/
+# Client IPs used by throttles are taken from X-Forwarded-For only behind
+# NUM_PROXIES trusted proxies, set it to 1 behind a single nginx. With 0 the
+# header is ignored, so clients cannot spoof their IP.
+
+REST_FRAMEWORK = {
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0)),
+    'DEFAULT_THROTTLE_RATES': {
+        'recipe_read': os.environ.get('RECIPE_READ_RATE', '600/minute'),
+        'recipe_write': os.environ.get('RECIPE_WRITE_RATE', '120/minute'),
+    },
+}
+
+
+# Token authentication
+# Tokens expire TOKEN_TTL seconds after they are issued. last_used is written
+# at most once per TOKEN_LAST_USED_INTERVAL seconds for each token.
+# Each device logging in gets its own token, an user keeps at most
+# TOKEN_MAX_PER_USER of them, the oldest ones are dropped first.
+
+TOKEN_TTL = int(os.environ.get('TOKEN_TTL', 60 * 60 * 24 * 7))
+TOKEN_LAST_USED_INTERVAL = int(os.environ.get('TOKEN_LAST_USED_INTERVAL', 60 * 5))
+TOKEN_MAX_PER_USER = int(os.environ.get('TOKEN_MAX_PER_USER', 10))
+
+
+# Idempotency keys
+# Responses of recipe writes are kept for IDEMPOTENCY_TTL seconds in the
+# IDEMPOTENCY_CACHE cache so retries carrying the same key are replayed. It must
+# be shared by all processes, local-memory caches are refused at startup.
+
+IDEMPOTENCY_CACHE = os.environ.get('IDEMPOTENCY_CACHE', 'idempotency')
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', 60 * 60 * 24))
+
+
+# Login throttling
+# Failed attempts allowed per email and per client IP within the window (seconds).
+# Set LOGIN_THROTTLE_CACHE to a cache alias to share attempts between processes.
+# Otherwise at most LOGIN_THROTTLE_MAX_KEYS emails and IPs are tracked per process.
+
+LOGIN_THROTTLE_ATTEMPTS = int(os.environ.get('LOGIN_THROTTLE_ATTEMPTS', 5))
+LOGIN_THROTTLE_WINDOW = int(os.environ.get('LOGIN_THROTTLE_WINDOW', 300))
+LOGIN_THROTTLE_CACHE = os.environ.get('LOGIN_THROTTLE_CACHE')
+LOGIN_THROTTLE_MAX_KEYS = int(os.environ.get('LOGIN_THROTTLE_MAX_KEYS', 100000))
+
+
+# Pantry matching
+# Per user ingredient bitsets are kept in process memory, updated from M2M signals
+# and rebuilt after PANTRY_INDEX_TTL seconds to pick up writes of other processes.
+# Only the PANTRY_INDEX_MAX_USERS most recently used users are kept.
+
+PANTRY_INDEX_TTL = int(os.environ.get('PANTRY_INDEX_TTL', 60 * 5))
+PANTRY_INDEX_MAX_USERS = int(os.environ.get('PANTRY_INDEX_MAX_USERS', 1000))
+
+
+# Similar recipes
+# Per user tag/ingredient incidence matrices, dropped when relations change in
+# this process and rebuilt after SIMILAR_INDEX_TTL seconds otherwise. Only the
+# SIMILAR_INDEX_MAX_USERS most recently used users are kept.
+
+SIMILAR_INDEX_TTL = int(os.environ.get('SIMILAR_INDEX_TTL', 60 * 5))
+SIMILAR_INDEX_MAX_USERS = int(os.environ.get('SIMILAR_INDEX_MAX_USERS', 200))
+
+
+# Batch requests
+# /api/batch runs up to BATCH_MAX_REQUESTS sub-requests under BATCH_URL_PREFIXES,
+# consecutive GETs of a concurrent batch run on BATCH_MAX_WORKERS threads.
+
+BATCH_MAX_REQUESTS = int(os.environ.get('BATCH_MAX_REQUESTS', 20))
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', 4))
+BATCH_URL_PREFIXES = ('/api/user/', '/api/recipe/')
+
+
+# Response compression
+# Bodies of compressible types above COMPRESSION_MIN_SIZE bytes are compressed
+# with zstd, brotli (when installed) or gzip, unless the response is marked
+# Cache-Control: no-transform. Compressed bodies of at most
+# COMPRESSION_CACHE_MAX_SIZE bytes are kept in the COMPRESSION_CACHE cache, so it
+# holds at most MAX_ENTRIES * COMPRESSION_CACHE_MAX_SIZE bytes (16 MB by default).
+# Set it to an empty string to always compress.
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 5))
+COMPRESSION_ZSTD_LEVEL = int(os.environ.get('COMPRESSION_ZSTD_LEVEL', 3))
+COMPRESSION_CACHE = os.environ.get('COMPRESSION_CACHE', 'compression')
+COMPRESSION_CACHE_TTL = int(os.environ.get('COMPRESSION_CACHE_TTL', 60 * 5))
+COMPRESSION_CACHE_MAX_SIZE = int(os.environ.get('COMPRESSION_CACHE_MAX_SIZE', 256 * 1024))
+
+
+# Request profiling
+# Off unless PROFILING_ENABLED is set. PROFILING_SAMPLE_RATE of requests (0 to 1)
+# and requests of staff users sending the PROFILING_HEADER header are profiled
+# with cProfile or a stack sampler (PROFILING_MODE) and tracemalloc. The last
+# PROFILING_BUFFER_SIZE profiles of each process are listed at /api/profiles.
+
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '') == '1'
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+PROFILING_HEADER = 'X-Profile'
+PROFILING_MODE = os.environ.get('PROFILING_MODE', 'sampling')
+PROFILING_INTERVAL = float(os.environ.get('PROFILING_INTERVAL', 0.005))
+PROFILING_STACK_DEPTH = int(os.environ.get('PROFILING_STACK_DEPTH', 40))
+PROFILING_TRACEMALLOC_FRAMES = int(os.environ.get('PROFILING_TRACEMALLOC_FRAMES', 1))
+PROFILING_TOP = int(os.environ.get('PROFILING_TOP', 20))
+PROFILING_BUFFER_SIZE = int(os.environ.get('PROFILING_BUFFER_SIZE', 50))
+
+
+# Change push
+# Changes of recipes, tags and ingredients are pushed as Server-Sent Events at
+# /api/recipe/events when served through app.asgi. LocalBackend only reaches
+# clients connected to the process making the change, use RedisBackend with
+# PUBSUB_REDIS_URL when running several processes.
+
+PUBSUB_BACKEND = os.environ.get('PUBSUB_BACKEND', 'core.pubsub.LocalBackend')
+PUBSUB_REDIS_URL = os.environ.get('PUBSUB_REDIS_URL', 'redis://localhost:6379/0')
+PUBSUB_REDIS_PREFIX = 'recipe:'
+PUBSUB_QUEUE_SIZE = int(os.environ.get('PUBSUB_QUEUE_SIZE', 100))
+EVENTS_HEARTBEAT = int(os.environ.get('EVENTS_HEARTBEAT', 15))
@@ -0,0 +1,48 @@
+"""
+Settings profile for API-only workers.
+
+Use it with DJANGO_SETTINGS_MODULE=app.settings_api. It drops the admin
+site, sessions, messages, static files and the browsable API. API views
+authenticate with tokens, so they need none of these, and workers boot
+faster without importing them.
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import INSTALLED_APPS, MIDDLEWARE, REST_FRAMEWORK, TEMPLATES
+
+API_UNUSED_APPS = (
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+)
+
+# Session, CSRF and messages only matter to cookie authenticated pages.
+# AuthenticationMiddleware needs sessions, DRF sets request.user itself.
+API_UNUSED_MIDDLEWARE = (
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+)
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in API_UNUSED_APPS]
+
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in API_UNUSED_MIDDLEWARE]
+
+TEMPLATES = [
+    dict(template, OPTIONS=dict(template['OPTIONS'], context_processors=[
+        processor for processor in template['OPTIONS']['context_processors']
+        if processor != 'django.contrib.messages.context_processors.messages'
+    ]))
+    for template in TEMPLATES
+]
+
+ROOT_URLCONF = 'app.urls_api'
+
+REST_FRAMEWORK = dict(
+    REST_FRAMEWORK,
+    DEFAULT_RENDERER_CLASSES=['rest_framework.renderers.JSONRenderer'],
+    DEFAULT_AUTHENTICATION_CLASSES=['core.authentication.ExpiringTokenAuthentication'],
+)
@@ -0,0 +1,29 @@
+"""
+Settings used by `manage.py test`
+
+- Passwords are hashed with MD5, hashing dominates the cost of creating users
+- Tests run on an in-memory SQLite database unless DB_HOST points to PostgreSQL.
+  Tests of PostgreSQL features (query plans, partitioning) are skipped on SQLite,
+  run them with `docker-compose run --rm app sh -c "python manage.py wait_for_db && python manage.py test"`
+- Uploaded files go to a temporary directory instead of /vol/web, created and
+  removed by the runner
+- The runner reports the slowest test modules
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+if not os.environ.get('DB_HOST'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:',
+        },
+    }
+    DATABASE_REPLICAS = []
+
+# MEDIA_ROOT and THUMBNAIL_ROOT are set by the runner for the whole run, test cases
+# writing files get their own directory, see TemporaryMediaMixin
+TEST_RUNNER = 'core.test_runner.TimedTestRunner'
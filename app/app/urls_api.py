@@ -0,0 +1,14 @@
+"""app URL Configuration for API-only workers, see app.settings_api"""
+import re
+
+from django.urls import path, re_path, include
+from django.conf import settings
+
+from core.media import serve_media
+
+urlpatterns = [
+    path('api/user/', include('user.urls')),
+    path('api/recipe/', include('recipe.urls')),
+    path('api/', include('core.urls')),
+    re_path(rf'^{re.escape(settings.MEDIA_URL.lstrip("/"))}(?P<path>.+)$', serve_media, name='media'),
+]
@@ -1,5 +1,8 @@
 from django.contrib import admin
 from django.contrib.auth import admin as authAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from core import models
 # Translation
 from django.utils.translation import gettext as _
@@ -28,7 +31,99 @@ class UserAdmin(authAdmin.UserAdmin):
 		}),
 	)
 
+# Unfiltered tables larger than this are counted from planner statistics
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+class EstimatedCountPaginator(Paginator):
+	"""Paginator using PostgreSQL row estimates instead of COUNT(*) on large unfiltered tables"""
+	@cached_property
+	def count(self):
+		queryset = self.object_list
+		connection = connections[queryset.db]
+		if connection.vendor == 'postgresql' and not queryset.query.where:
+			with connection.cursor() as cursor:
+				cursor.execute(
+					'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+					[queryset.model._meta.db_table]
+				)
+				row = cursor.fetchone()
+			if row and row[0] > ESTIMATED_COUNT_THRESHOLD:
+				return int(row[0])
+		return super().count
+
+class SoftDeleteAdmin(admin.ModelAdmin):
+	"""
+	Admin of soft deleted models
+	- Lists deleted rows too, so they can be restored
+	- Deleting and restoring are single UPDATE statements,
+	  rows are removed for good by the purge_deleted command
+	"""
+	raw_id_fields = ('user',)
+	list_select_related = ('user',)
+	list_per_page = 50
+	ordering = ('-id',)
+	show_full_result_count = False
+	paginator = EstimatedCountPaginator
+	actions = ('soft_delete_selected', 'restore_selected')
+
+	def get_queryset(self, request):
+		queryset = self.model.all_objects.get_queryset()
+		ordering = self.get_ordering(request)
+		if ordering:
+			queryset = queryset.order_by(*ordering)
+		return queryset
+
+	def get_actions(self, request):
+		"""Drop delete_selected, it collects and deletes related rows one model at a time"""
+		actions = super().get_actions(request)
+		actions.pop('delete_selected', None)
+		return actions
+
+	def is_deleted(self, obj):
+		return obj.deleted_at is not None
+	is_deleted.short_description = _('Deleted')
+	is_deleted.boolean = True
+
+	def soft_delete_selected(self, request, queryset):
+		count = queryset.filter(deleted_at__isnull=True).soft_delete()
+		self.message_user(request, _('%(count)d rows deleted') % {'count': count})
+	soft_delete_selected.short_description = _('Delete selected rows')
+
+	def restore_selected(self, request, queryset):
+		count = queryset.filter(deleted_at__isnull=False).restore()
+		self.message_user(request, _('%(count)d rows restored') % {'count': count})
+	restore_selected.short_description = _('Restore selected rows')
+
+class RecipeTagInline(admin.TabularInline):
+	model = models.RecipeTag
+	fields = ('tag', 'position')
+	autocomplete_fields = ('tag',)
+	extra = 0
+
+class RecipeIngredientInline(admin.TabularInline):
+	model = models.RecipeIngredient
+	fields = ('ingredient', 'position')
+	autocomplete_fields = ('ingredient',)
+	extra = 0
+
+class RecipeAdmin(SoftDeleteAdmin):
+	list_display = ('id', 'title', 'user', 'price', 'time_minute', 'is_deleted')
+	# Prefix searches are served by the upper(title) pattern index of migration 0013
+	search_fields = ('^title',)
+	fields = ('user', 'title', 'price', 'time_minute', 'link', 'image', 'deleted_at')
+	# Tags and ingredients go through custom through models, so they are
+	# edited as inlines with autocomplete instead of M2M selects
+	inlines = (RecipeTagInline, RecipeIngredientInline)
+
+class TagAdmin(SoftDeleteAdmin):
+	list_display = ('id', 'name', 'user', 'is_deleted')
+	search_fields = ('^name',)
+
+class IngredientAdmin(SoftDeleteAdmin):
+	list_display = ('id', 'name', 'user', 'is_deleted')
+	search_fields = ('^name',)
+
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Recipe)
-admin.site.register(models.Tag)
-admin.site.register(models.Ingredient)
\ No newline at end of file
+admin.site.register(models.Recipe, RecipeAdmin)
+admin.site.register(models.Tag, TagAdmin)
+admin.site.register(models.Ingredient, IngredientAdmin)
\ No newline at end of file
@@ -0,0 +1,38 @@
+import datetime
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import authentication, exceptions
+
+from core.models import ExpiringToken
+
+class ExpiringTokenAuthentication(authentication.TokenAuthentication):
+	"""
+	Token authentication that rejects expired tokens
+	last_used is only written once per TOKEN_LAST_USED_INTERVAL,
+	so most authenticated requests do not write to the token table
+	"""
+	model = ExpiringToken
+
+	def authenticate_credentials(self, key):
+		try:
+			token = self.model.objects.select_related('user').get(key=key)
+		except self.model.DoesNotExist:
+			raise exceptions.AuthenticationFailed('Invalid token.')
+
+		if not token.user.is_active:
+			raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+		if token.is_expired():
+			raise exceptions.AuthenticationFailed('Token has expired.')
+
+		self.touch(token)
+		return (token.user, token)
+
+	def touch(self, token):
+		"""Record token usage if the last recorded one is old enough"""
+		now = timezone.now()
+		interval = datetime.timedelta(seconds=settings.TOKEN_LAST_USED_INTERVAL)
+		if token.last_used is None or token.last_used <= now - interval:
+			self.model.objects.filter(key=token.key).update(last_used=now)
+			token.last_used = now
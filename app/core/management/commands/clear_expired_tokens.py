@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from core.models import ExpiringToken
+
+class Command(BaseCommand):
+	help = 'Delete expired authentication tokens in batches'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=1000)
+
+	def handle(self, *args, **options):
+		batch_size = options['batch_size']
+		total = 0
+		while True:
+			keys = list(ExpiringToken.objects.expired().values_list('key', flat=True)[:batch_size])
+			if not keys:
+				break
+			deleted, _ = ExpiringToken.objects.filter(key__in=keys).delete()
+			total += deleted
+		self.stdout.write(self.style.SUCCESS(f'Deleted {total} expired tokens'))
@@ -0,0 +1,130 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from core.models import Recipe, RecipeTag, RecipeIngredient
+
+# Relation tables go first, their foreign keys to core_recipe are moved to
+# (recipe_id, user_id) once core_recipe itself is partitioned
+PARTITIONED_MODELS = (
+	(RecipeTag, ('user_id', 'recipe_id', 'tag_id')),
+	(RecipeIngredient, ('user_id', 'recipe_id', 'ingredient_id')),
+	(Recipe, None),
+)
+
+class Command(BaseCommand):
+	help = (
+		'Convert core_recipe and its tag/ingredient tables to Postgres tables '
+		'hash partitioned by user_id. Optional, run it during a maintenance window.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--partitions', type=int, default=16)
+		parser.add_argument('--dry-run', action='store_true', help='Print the SQL instead of running it')
+
+	def is_partitioned(self, cursor, table):
+		cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass", [table])
+		return cursor.fetchone() is not None
+
+	def get_indexes(self, cursor, table):
+		"""Return definitions of plain indexes, unique ones cannot be kept without user_id"""
+		cursor.execute(
+			"SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexdef NOT LIKE 'CREATE UNIQUE%%'",
+			[table]
+		)
+		return [row[0] for row in cursor.fetchall()]
+
+	def get_foreign_keys(self, cursor, table):
+		"""Return (name, definition) of foreign keys from a table"""
+		cursor.execute(
+			"SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE contype = 'f' AND conrelid = %s::regclass",
+			[table]
+		)
+		return cursor.fetchall()
+
+	def get_referencing_keys(self, cursor, table):
+		"""
+		Return (table, name, column) of foreign keys from other tables to a table
+		They must reference (id, user_id) once it is partitioned, so their table needs user_id
+		"""
+		cursor.execute(
+			"SELECT c.conrelid::regclass::text, c.conname, a.attname, EXISTS ("
+			"  SELECT 1 FROM pg_attribute u"
+			"  WHERE u.attrelid = c.conrelid AND u.attname = 'user_id' AND NOT u.attisdropped"
+			") FROM pg_constraint c "
+			"JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1] "
+			"WHERE c.contype = 'f' AND c.confrelid = %s::regclass AND c.conrelid <> c.confrelid",
+			[table]
+		)
+		keys = []
+		for source, name, column, has_user_id in cursor.fetchall():
+			if not has_user_id:
+				raise CommandError(f'{source}.{column} references {table} but {source} has no user_id')
+			keys.append((source, name, column))
+		return keys
+
+	def get_statements(self, cursor, table, unique_columns, partitions):
+		old_table = f'{table}_unpartitioned'
+		cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+		sequence = cursor.fetchone()[0]
+		referencing_keys = self.get_referencing_keys(cursor, table)
+		statements = [
+			f'ALTER TABLE {source} DROP CONSTRAINT {name}'
+			for source, name, _ in referencing_keys
+		]
+		statements += [
+			f'ALTER TABLE {table} RENAME TO {old_table}',
+			f'CREATE TABLE {table} (LIKE {old_table} INCLUDING DEFAULTS) PARTITION BY HASH (user_id)',
+		]
+		statements += [
+			f'CREATE TABLE {table}_p{remainder} PARTITION OF {table} '
+			f'FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})'
+			for remainder in range(partitions)
+		]
+		# Unique constraints of a partitioned table must contain the partition key
+		statements.append(f'ALTER TABLE {table} ADD PRIMARY KEY (id, user_id)')
+		if unique_columns:
+			statements.append(f'ALTER TABLE {table} ADD UNIQUE ({", ".join(unique_columns)})')
+		statements += [
+			f'INSERT INTO {table} SELECT * FROM {old_table}',
+			f'ALTER SEQUENCE {sequence} OWNED BY {table}.id',
+			# Fails if anything still depends on the old table instead of dropping it silently
+			f'DROP TABLE {old_table}',
+		]
+		statements += self.get_indexes(cursor, table)
+		statements += [
+			f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition}'
+			for name, definition in self.get_foreign_keys(cursor, table)
+		]
+		statements += [
+			f'ALTER TABLE {source} ADD CONSTRAINT {name} FOREIGN KEY ({column}, user_id) '
+			f'REFERENCES {table} (id, user_id) DEFERRABLE INITIALLY DEFERRED'
+			for source, name, column in referencing_keys
+		]
+		statements.append(f'ANALYZE {table}')
+		return statements
+
+	def handle(self, *args, **options):
+		if connection.vendor != 'postgresql':
+			raise CommandError('Partitioning is only supported on PostgreSQL')
+		if connection.pg_version < 120000:
+			raise CommandError('Foreign keys to partitioned tables need PostgreSQL 12 or later')
+		if options['partitions'] < 2:
+			raise CommandError('Use at least 2 partitions')
+
+		with transaction.atomic(), connection.cursor() as cursor:
+			for model, unique_columns in PARTITIONED_MODELS:
+				table = model._meta.db_table
+				if self.is_partitioned(cursor, table):
+					self.stdout.write(f'{table} is already partitioned')
+					continue
+				statements = self.get_statements(cursor, table, unique_columns, options['partitions'])
+				for statement in statements:
+					if options['dry_run']:
+						self.stdout.write(f'{statement};')
+					else:
+						cursor.execute(statement)
+				self.stdout.write(self.style.SUCCESS(
+					f'{table} partitioned into {options["partitions"]} partitions by user_id'
+				))
+			if options['dry_run']:
+				transaction.set_rollback(True)
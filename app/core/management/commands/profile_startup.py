@@ -0,0 +1,70 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Boot a worker the way app/wsgi.py does and load every URL pattern
+STARTUP_SCRIPT = (
+	'from django.core.wsgi import get_wsgi_application\n'
+	'application = get_wsgi_application()\n'
+	'from django.urls import get_resolver\n'
+	'get_resolver().url_patterns\n'
+)
+# Modules that should only be imported when a request needs them
+DEFERRED_MODULES = ('PIL',)
+
+def parse_importtime(output):
+	"""
+	Parse `python -X importtime` output
+	Return the total import time and {top level module: cumulative time} in microseconds
+	"""
+	total = 0
+	top_level = {}
+	for line in output.splitlines():
+		if not line.startswith('import time:') or 'imported package' in line:
+			continue
+		self_time, cumulative, name = line[len('import time:'):].split('|')
+		total += int(self_time)
+		if not name.startswith('  '):
+			top_level[name.strip()] = int(cumulative)
+	return total, top_level
+
+class Command(BaseCommand):
+	help = 'Measure import time of a worker boot with python -X importtime'
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			'--profile-settings',
+			default=os.environ.get('DJANGO_SETTINGS_MODULE'),
+			help='Settings module of the booted worker, e.g. app.settings_api'
+		)
+		parser.add_argument('--top', type=int, default=15, help='Number of slowest imports to show')
+		parser.add_argument('--max-ms', type=float, help='Fail if total import time exceeds it')
+
+	def handle(self, *args, **options):
+		script = STARTUP_SCRIPT + (
+			'import sys\n'
+			f'print(",".join(name for name in {DEFERRED_MODULES!r} if name in sys.modules))\n'
+		)
+		env = dict(os.environ, DJANGO_SETTINGS_MODULE=options['profile_settings'])
+		result = subprocess.run(
+			[sys.executable, '-X', 'importtime', '-c', script],
+			cwd=settings.BASE_DIR, env=env, capture_output=True, text=True
+		)
+		if result.returncode:
+			raise CommandError(result.stderr.splitlines()[-1])
+
+		total, top_level = parse_importtime(result.stderr)
+		slowest = sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:options['top']]
+		self.stdout.write(f'Settings: {options["profile_settings"]}')
+		self.stdout.write(f'Total import time: {total / 1000:.1f} ms')
+		for name, cumulative in slowest:
+			self.stdout.write(f'{cumulative / 1000:10.1f} ms  {name}')
+
+		eagerly_imported = result.stdout.strip()
+		if eagerly_imported:
+			self.stdout.write(self.style.WARNING(f'Imported at startup: {eagerly_imported}'))
+		if options['max_ms'] is not None and total / 1000 > options['max_ms']:
+			raise CommandError(f'Import time {total / 1000:.1f} ms exceeds {options["max_ms"]} ms')
@@ -0,0 +1,84 @@
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import Recipe, Tag, Ingredient, RecipeTag, RecipeIngredient, ExpiringToken
+
+# Soft deleted models, with the M2M link rows which reference them
+PURGED_MODELS = (
+	(Recipe, (RecipeTag, RecipeIngredient), 'recipe_id'),
+	(Tag, (RecipeTag,), 'tag_id'),
+	(Ingredient, (RecipeIngredient,), 'ingredient_id'),
+)
+
+class Command(BaseCommand):
+	help = 'Remove soft deleted recipes, tags and ingredients in small batches'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--older-than-days', type=int, default=7)
+		parser.add_argument('--batch-size', type=int, default=500)
+		parser.add_argument(
+			'--user', type=int,
+			help='Remove every row of this user in batches, then the user itself',
+		)
+
+	def handle(self, *args, **options):
+		batch_size = options['batch_size']
+		if batch_size < 1:
+			raise CommandError('--batch-size must be positive')
+
+		user = None
+		if options['user'] is not None:
+			try:
+				user = get_user_model().objects.get(pk=options['user'])
+			except get_user_model().DoesNotExist:
+				raise CommandError(f'User {options["user"]} does not exist')
+
+		cutoff = timezone.now() - datetime.timedelta(days=options['older_than_days'])
+		for model, relations, column in PURGED_MODELS:
+			if user is not None:
+				queryset = model.all_objects.filter(user=user)
+			else:
+				queryset = model.all_objects.filter(deleted_at__lt=cutoff)
+			total = self.purge(queryset, relations, column, batch_size)
+			self.stdout.write(f'Purged {total} {model._meta.verbose_name_plural}')
+
+		if user is not None:
+			# Nothing large is left to cascade, so this is a short transaction
+			ExpiringToken.objects.filter(user=user).delete()
+			user.delete()
+			self.stdout.write(f'Deleted user {options["user"]}')
+
+		self.stdout.write(self.style.SUCCESS('Purge finished'))
+
+	def purge(self, queryset, relations, column, batch_size):
+		"""Delete rows of a queryset, each batch in its own short transaction"""
+		total = 0
+		while True:
+			ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+			if not ids:
+				return total
+			with transaction.atomic():
+				for relation in relations:
+					relation.objects.filter(**{f'{column}__in': ids}).delete()
+				rows = queryset.model.all_objects.filter(pk__in=ids)
+				if queryset.model is Recipe:
+					self.delete_images_on_commit(rows)
+				deleted, _ = rows.delete()
+				total += deleted
+			if len(ids) < batch_size:
+				return total
+
+	def delete_images_on_commit(self, recipes):
+		"""Remove image files once the rows referencing them are gone"""
+		storage = Recipe._meta.get_field('image').storage
+		names = [name for name in recipes.values_list('image', flat=True) if name]
+
+		def delete_files():
+			for name in names:
+				storage.delete(name)
+
+		transaction.on_commit(delete_files)
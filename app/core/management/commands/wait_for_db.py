@@ -1,16 +1,63 @@
+import random
 import time
-from django.db import connections
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
 from django.db.utils import OperationalError
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 class Command(BaseCommand):
+	help = 'Wait until the database accepts queries, optionally until migrations are applied'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+		parser.add_argument('--timeout', type=float, default=60, help='Seconds to wait before giving up')
+		parser.add_argument('--initial-delay', type=float, default=0.1, help='Seconds before the first retry')
+		parser.add_argument('--max-delay', type=float, default=5, help='Upper bound of the backoff')
+		parser.add_argument(
+			'--migrations', choices=('wait', 'apply'),
+			help='wait: until another process applied all migrations, apply: apply pending migrations',
+		)
+
+	def probe(self, alias):
+		"""Open a connection and run a query, raise OperationalError if the database is not ready"""
+		connection = connections[alias]
+		connection.ensure_connection()
+		with connection.cursor() as cursor:
+			cursor.execute('SELECT 1')
+
+	def has_pending_migrations(self, alias):
+		executor = MigrationExecutor(connections[alias])
+		return bool(executor.migration_plan(executor.loader.graph.leaf_nodes()))
+
 	def handle(self, *args, **options):
 		self.stdout.write('Waiting for database')
-		connection = None
-		while not connection:
+		alias = options['database']
+		deadline = time.monotonic() + options['timeout']
+		delay = options['initial_delay']
+		while True:
 			try:
-				connection = connections['default']
+				self.probe(alias)
+				if options['migrations'] != 'wait' or not self.has_pending_migrations(alias):
+					break
+				reason = 'Migrations pending'
 			except OperationalError:
-				self.stdout.write('Database unavailable, waiting 1 second')
-				time.sleep(1)
-		self.stdout.write(self.style.SUCCESS('Database available'))
\ No newline at end of file
+				# Drop the broken connection so the next probe opens a new one
+				connections[alias].close()
+				reason = 'Database unavailable'
+
+			remaining = deadline - time.monotonic()
+			if remaining <= 0:
+				raise CommandError(f'{reason} after {options["timeout"]} seconds')
+			# Exponential backoff with jitter so restarting containers do not retry in lockstep
+			sleep = min(delay / 2 + random.uniform(0, delay / 2), remaining)
+			self.stdout.write(f'{reason}, waiting {sleep:.2f} seconds')
+			time.sleep(sleep)
+			delay = min(delay * 2, options['max_delay'])
+		self.stdout.write(self.style.SUCCESS('Database available'))
+
+		if options['migrations'] == 'apply':
+			if self.has_pending_migrations(alias):
+				call_command('migrate', database=alias, stdout=self.stdout)
+			else:
+				self.stdout.write('No migrations to apply')
@@ -0,0 +1,232 @@
+import mimetypes
+import os
+import posixpath
+import re
+import tempfile
+import threading
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import require_safe
+
+# Uploaded file names are random and never rewritten, so they can be cached forever
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+RANGE_CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# Thumbnails written by this process between two walks of THUMBNAIL_ROOT
+THUMBNAIL_MEASURE_WRITES = 100
+THUMBNAIL_EVICT_RATIO = 0.9
+
+def get_media_path(root, path):
+	"""Return the absolute path of a file below root, 404 if it escapes root or does not exist"""
+	path = posixpath.normpath(path).lstrip('/')
+	try:
+		full_path = safe_join(root, path)
+	except SuspiciousFileOperation:
+		raise Http404('Not found')
+	if not os.path.isfile(full_path):
+		raise Http404('Not found')
+	return path, full_path
+
+def get_etag(stat, suffix=''):
+	return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}{suffix}"'
+
+def get_thumbnail(path, full_path, width):
+	"""
+	Return the path of a thumbnail of an image, generating it on first request
+	- Thumbnails live below THUMBNAIL_ROOT/<width>/
+	- Their mtime is bumped on every hit, the least recently used ones are
+	  evicted once the directory grows over THUMBNAIL_CACHE_MAX_BYTES
+	"""
+	thumbnail_path = os.path.join(settings.THUMBNAIL_ROOT, str(width), path)
+	try:
+		os.utime(thumbnail_path)
+		return thumbnail_path
+	except FileNotFoundError:
+		pass
+
+	# Pillow is only loaded by processes which actually generate thumbnails
+	from PIL import Image
+
+	os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+	with Image.open(full_path) as image:
+		image_format = image.format
+		if image.width > width:
+			image.thumbnail((width, image.height * width // image.width + 1))
+		# Written to a temporary file first so concurrent requests never read a partial image
+		descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(thumbnail_path))
+		try:
+			with os.fdopen(descriptor, 'wb') as file:
+				image.save(file, format=image_format)
+			# Readable by a front proxy serving it through X-Accel-Redirect
+			os.chmod(temporary_path, 0o644)
+			os.replace(temporary_path, thumbnail_path)
+		except BaseException:
+			os.remove(temporary_path)
+			raise
+	thumbnail_cache.added(thumbnail_path)
+	return thumbnail_path
+
+class ThumbnailCache:
+	"""
+	Size of THUMBNAIL_ROOT as tracked by this process
+	- Measured by walking the directory on the first write and every THUMBNAIL_MEASURE_WRITES
+	  writes, as other processes write thumbnails too
+	- In between, each thumbnail written adds its size, the directory is walked again
+	  only once the estimate goes over THUMBNAIL_CACHE_MAX_BYTES
+	"""
+	def __init__(self):
+		self.root = None
+		self.size = 0
+		self.writes = 0
+		self._lock = threading.Lock()
+
+	def added(self, thumbnail_path):
+		size = os.path.getsize(thumbnail_path)
+		with self._lock:
+			measure = self.root != settings.THUMBNAIL_ROOT or self.writes >= THUMBNAIL_MEASURE_WRITES
+			if not measure:
+				self.size += size
+				self.writes += 1
+				measure = self.size > settings.THUMBNAIL_CACHE_MAX_BYTES
+		if measure:
+			size = evict_thumbnails(keep=thumbnail_path)
+			with self._lock:
+				self.root = settings.THUMBNAIL_ROOT
+				self.size = size
+				self.writes = 0
+
+thumbnail_cache = ThumbnailCache()
+
+def evict_thumbnails(keep=None):
+	"""
+	Delete least recently used thumbnails once the cache is over its size limit
+	- Goes down to THUMBNAIL_EVICT_RATIO of the limit, so the next writes do not walk it again
+	- The thumbnail at `keep`, just written for a request, is never deleted
+	- Return the size left in the cache
+	"""
+	files = []
+	total = 0
+	for directory, _, names in os.walk(settings.THUMBNAIL_ROOT):
+		for name in names:
+			file_path = os.path.join(directory, name)
+			try:
+				stat = os.stat(file_path)
+			except FileNotFoundError:
+				continue
+			files.append((stat.st_mtime, stat.st_size, file_path))
+			total += stat.st_size
+	if total <= settings.THUMBNAIL_CACHE_MAX_BYTES:
+		return total
+	target = settings.THUMBNAIL_CACHE_MAX_BYTES * THUMBNAIL_EVICT_RATIO
+	for _, size, file_path in sorted(files):
+		if file_path == keep:
+			continue
+		try:
+			os.remove(file_path)
+		except FileNotFoundError:
+			pass
+		total -= size
+		if total <= target:
+			break
+	return total
+
+def parse_range(header, size):
+	"""Return (start, end) of a single byte range, None to send the whole file, raise ValueError if unsatisfiable"""
+	match = RANGE_RE.match(header or '')
+	if match is None:
+		# Missing, malformed or multiple ranges: the whole file is sent
+		return None
+	first, last = match.groups()
+	if not first and not last:
+		return None
+	if not first:
+		start, end = max(size - int(last), 0), size - 1
+	else:
+		start, end = int(first), min(int(last), size - 1) if last else size - 1
+	if start >= size or start > end:
+		raise ValueError('Range not satisfiable')
+	return start, end
+
+def iter_range(file, start, length):
+	with file:
+		file.seek(start)
+		while length > 0:
+			chunk = file.read(min(RANGE_CHUNK_SIZE, length))
+			if not chunk:
+				return
+			length -= len(chunk)
+			yield chunk
+
+@require_safe
+def serve_media(request, path):
+	"""
+	Serve an uploaded file, ?w=<width> serves a thumbnail of an image instead
+	- Sent as immutable with an ETag, If-None-Match is answered with 304
+	- With MEDIA_ACCEL_REDIRECT set the body is sent by the front proxy (X-Accel-Redirect)
+	- Otherwise full files go through FileResponse (zero-copy with wsgi.file_wrapper)
+	  and single byte ranges are answered with 206
+	"""
+	path, full_path = get_media_path(settings.MEDIA_ROOT, path)
+	stat = os.stat(full_path)
+	etag = get_etag(stat)
+	content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+
+	width = request.GET.get('w')
+	if width is not None:
+		if not content_type.startswith('image/') or width not in map(str, settings.THUMBNAIL_WIDTHS):
+			raise Http404('Not found')
+		etag = get_etag(stat, f'-w{width}')
+
+	# Weak comparison, CompressionMiddleware turns the ETag sent to clients into W/"..."
+	if_none_match = [
+		tag[2:] if tag.startswith('W/') else tag
+		for tag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+	]
+	if '*' in if_none_match or etag in if_none_match:
+		response = HttpResponseNotModified()
+		response['ETag'] = etag
+		response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+		return response
+
+	accel_path = f'media/{path}'
+	if width is not None:
+		try:
+			full_path = get_thumbnail(path, full_path, int(width))
+		except OSError:
+			# Not an image Pillow can read
+			raise Http404('Not found')
+		accel_path = f'thumbnails/{width}/{path}'
+
+	if settings.MEDIA_ACCEL_REDIRECT:
+		# The proxy maps <prefix>media/ to MEDIA_ROOT and <prefix>thumbnails/ to THUMBNAIL_ROOT
+		response = HttpResponse(content_type=content_type)
+		response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT + accel_path
+	else:
+		size = os.path.getsize(full_path)
+		try:
+			byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+		except ValueError:
+			response = HttpResponse(status=416)
+			response['Content-Range'] = f'bytes */{size}'
+			return response
+		if byte_range is None:
+			response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+		else:
+			start, end = byte_range
+			response = StreamingHttpResponse(
+				iter_range(open(full_path, 'rb'), start, end - start + 1),
+				status=206,
+				content_type=content_type,
+			)
+			response['Content-Range'] = f'bytes {start}-{end}/{size}'
+			response['Content-Length'] = str(end - start + 1)
+		response['Accept-Ranges'] = 'bytes'
+
+	response['ETag'] = etag
+	response['Last-Modified'] = http_date(stat.st_mtime)
+	response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+	return response
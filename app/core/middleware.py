@@ -0,0 +1,141 @@
+import gzip
+import hashlib
+import re
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+# Types worth compressing, images and archives are already compressed
+COMPRESSIBLE_TYPES = (
+	'application/json', 'application/x-ndjson', 'application/javascript',
+	'application/xml', 'image/svg+xml', 'text/',
+)
+
+def compress_gzip(content):
+	# mtime=0 keeps the output, and so the cache key of ETags, stable
+	return gzip.compress(content, compresslevel=settings.COMPRESSION_GZIP_LEVEL, mtime=0)
+
+def compress_brotli(content):
+	return brotli.compress(content, quality=settings.COMPRESSION_BROTLI_QUALITY)
+
+def compress_zstd(content):
+	return zstandard.ZstdCompressor(level=settings.COMPRESSION_ZSTD_LEVEL).compress(content)
+
+def get_compressors():
+	"""Return {encoding: compress function} available in this process, preferred first"""
+	compressors = {}
+	if zstandard is not None:
+		compressors['zstd'] = compress_zstd
+	if brotli is not None:
+		compressors['br'] = compress_brotli
+	compressors['gzip'] = compress_gzip
+	return compressors
+
+def parse_accept_encoding(header):
+	"""Return {encoding: q} of an Accept-Encoding header"""
+	accepted = {}
+	for part in header.split(','):
+		encoding, _, params = part.strip().partition(';')
+		if not encoding:
+			continue
+		q = 1.0
+		match = re.search(r'q=([0-9.]+)', params)
+		if match:
+			try:
+				q = float(match.group(1))
+			except ValueError:
+				q = 0.0
+		accepted[encoding.strip().lower()] = q
+	return accepted
+
+def negotiate_encoding(header, compressors):
+	"""Return the accepted encoding with the highest q, server preference breaking ties"""
+	accepted = parse_accept_encoding(header)
+	best, best_q = None, 0
+	for encoding in compressors:
+		q = accepted.get(encoding, accepted.get('*', 0))
+		if q > best_q:
+			best, best_q = encoding, q
+	return best
+
+class CompressionMiddleware:
+	"""
+	Compress responses with gzip, brotli or zstd depending on Accept-Encoding
+	- Only bodies of compressible types larger than COMPRESSION_MIN_SIZE are compressed,
+	  responses with Cache-Control: no-transform are left as they are
+	- brotli and zstd are used when their packages are installed
+	- Compressed bodies are cached by hash of the uncompressed body in COMPRESSION_CACHE,
+	  so repeated responses are not compressed again
+	- Streaming responses are compressed on the fly with gzip
+	"""
+	def __init__(self, get_response):
+		self.get_response = get_response
+		self.compressors = get_compressors()
+		self.cache = caches[settings.COMPRESSION_CACHE] if settings.COMPRESSION_CACHE else None
+
+	def __call__(self, request):
+		response = self.get_response(request)
+		if not self.should_compress(response):
+			return response
+
+		patch_vary_headers(response, ('Accept-Encoding',))
+		header = request.META.get('HTTP_ACCEPT_ENCODING', '')
+		if response.streaming:
+			if negotiate_encoding(header, {'gzip': compress_gzip}) is None:
+				return response
+			response.streaming_content = compress_sequence(response.streaming_content)
+			del response['Content-Length']
+			return self.set_encoding(response, 'gzip')
+
+		if len(response.content) < settings.COMPRESSION_MIN_SIZE:
+			return response
+		encoding = negotiate_encoding(header, self.compressors)
+		if encoding is None:
+			return response
+		compressed = self.compress(encoding, response.content)
+		if len(compressed) >= len(response.content):
+			return response
+		response.content = compressed
+		response['Content-Length'] = str(len(compressed))
+		return self.set_encoding(response, encoding)
+
+	def should_compress(self, response):
+		if response.has_header('Content-Encoding') or response.status_code < 200 or response.status_code == 206:
+			return False
+		# The sender asked intermediaries, this middleware included, to keep the body as it is
+		cache_control = response.get('Cache-Control', '')
+		if 'no-transform' in (directive.strip().lower() for directive in cache_control.split(',')):
+			return False
+		content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+		return content_type.startswith(COMPRESSIBLE_TYPES)
+
+	def set_encoding(self, response, encoding):
+		# The body differs from the uncompressed one, a strong ETag would not match it anymore
+		etag = response.get('ETag')
+		if etag and etag.startswith('"'):
+			response['ETag'] = 'W/' + etag
+		response['Content-Encoding'] = encoding
+		return response
+
+	def compress(self, encoding, content):
+		"""Compress a body, reusing the cached result of an identical one"""
+		if self.cache is None or len(content) > settings.COMPRESSION_CACHE_MAX_SIZE:
+			return self.compressors[encoding](content)
+		key = f'compressed:{encoding}:{hashlib.sha256(content).hexdigest()}'
+		compressed = self.cache.get(key)
+		if compressed is None:
+			compressed = self.compressors[encoding](content)
+			self.cache.set(key, compressed, settings.COMPRESSION_CACHE_TTL)
+		return compressed
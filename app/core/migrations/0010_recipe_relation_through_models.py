@@ -0,0 +1,85 @@
+# Generated by Django 3.1.14 on 2026-10-19 19:54
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_relation_owners(apps, schema_editor):
+    """Copy the owner of each recipe onto its tag/ingredient relations"""
+    Recipe = apps.get_model('core', 'Recipe')
+    owner = models.Subquery(
+        Recipe.objects.filter(pk=models.OuterRef('recipe_id')).values('user_id')[:1]
+    )
+    for model_name in ('RecipeTag', 'RecipeIngredient'):
+        apps.get_model('core', model_name).objects.update(user_id=owner)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_recipe_user_price_time_index'),
+    ]
+
+    operations = [
+        # Adopt the existing M2M tables as explicit through models, nothing changes in the database
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='RecipeTag',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.recipe')),
+                        ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.tag')),
+                    ],
+                    options={
+                        'db_table': 'core_recipe_tags',
+                        'unique_together': {('recipe', 'tag')},
+                    },
+                ),
+                migrations.CreateModel(
+                    name='RecipeIngredient',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.ingredient')),
+                        ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.recipe')),
+                    ],
+                    options={
+                        'db_table': 'core_recipe_ingredients',
+                        'unique_together': {('recipe', 'ingredient')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='recipe',
+                    name='ingredients',
+                    field=models.ManyToManyField(through='core.RecipeIngredient', to='core.Ingredient'),
+                ),
+                migrations.AlterField(
+                    model_name='recipe',
+                    name='tags',
+                    field=models.ManyToManyField(through='core.RecipeTag', to='core.Tag'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='recipetag',
+            name='user',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='recipeingredient',
+            name='user',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(set_relation_owners, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='recipetag',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='recipeingredient',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.1.14 on 2026-10-19 19:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_recipe_relation_through_models'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipeingredient',
+            name='position',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='recipetag',
+            name='position',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='recipeingredient',
+            index=models.Index(fields=['user', 'ingredient', 'recipe'], name='recipeingredient_user_ingr_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipetag',
+            index=models.Index(fields=['user', 'tag', 'recipe'], name='recipetag_user_tag_idx'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 3.1.14 on 2026-10-19 19:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_recipe_relation_position_user_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='ingredient',
+            name='ingredient_user_name_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='recipe',
+            name='recipe_user_price_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='recipe',
+            name='recipe_user_time_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='tag',
+            name='tag_user_name_idx',
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(condition=models.Q(deleted_at__isnull=True), fields=['user', 'name'], name='ingredient_user_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(condition=models.Q(_negated=True, deleted_at__isnull=True), fields=['deleted_at'], name='ingredient_deleted_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(deleted_at__isnull=True), fields=['user', 'price'], name='recipe_user_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(deleted_at__isnull=True), fields=['user', 'time_minute'], name='recipe_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(_negated=True, deleted_at__isnull=True), fields=['deleted_at'], name='recipe_deleted_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(condition=models.Q(deleted_at__isnull=True), fields=['user', 'name'], name='tag_user_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(condition=models.Q(_negated=True, deleted_at__isnull=True), fields=['deleted_at'], name='tag_deleted_at_idx'),
+        ),
+    ]
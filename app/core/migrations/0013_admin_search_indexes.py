@@ -0,0 +1,37 @@
+from django.db import migrations
+
+# (index, table, column) serving the admin '^field' searches, which Django runs as
+# UPPER(column::text) LIKE UPPER('term%') on PostgreSQL
+SEARCH_INDEXES = (
+    ('recipe_title_upper_idx', 'core_recipe', 'title'),
+    ('tag_name_upper_idx', 'core_tag', 'name'),
+    ('ingredient_name_upper_idx', 'core_ingredient', 'name'),
+)
+
+
+def create_search_indexes(apps, schema_editor):
+    """Expression indexes are not supported by Django 3.1 models, and only useful on PostgreSQL"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in SEARCH_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} (UPPER({column}::text) text_pattern_ops)'
+        )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in SEARCH_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_soft_delete'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
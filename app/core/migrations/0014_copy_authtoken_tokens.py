@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.utils import timezone
+
+
+def copy_authtoken_tokens(apps, schema_editor):
+    """
+    Copy tokens issued by rest_framework.authtoken so clients stay logged in.
+    They get a fresh TTL window, authtoken tokens never expired. The old
+    authtoken_token table is left in place.
+    """
+    connection = schema_editor.connection
+    if 'authtoken_token' not in connection.introspection.table_names():
+        return
+    ExpiringToken = apps.get_model('core', 'ExpiringToken')
+    existing = set(ExpiringToken.objects.values_list('key', flat=True))
+    quote_name = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT {quote_name("key")}, {quote_name("user_id")} FROM {quote_name("authtoken_token")}')
+        rows = cursor.fetchall()
+    now = timezone.now()
+    ExpiringToken.objects.bulk_create(
+        [ExpiringToken(key=key, user_id=user_id, created=now) for key, user_id in rows if key not in existing],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_authtoken_tokens, migrations.RunPython.noop),
+    ]
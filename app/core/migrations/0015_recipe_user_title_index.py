@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-19 20:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_copy_authtoken_tokens'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(deleted_at__isnull=True), fields=['user', 'title'], name='recipe_user_title_idx'),
+        ),
+    ]
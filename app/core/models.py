@@ -1,6 +1,11 @@
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from core.signals import positions_changed, soft_delete_changed
+import binascii
+import datetime
 import os
 import uuid
 
@@ -44,32 +49,230 @@ class User(AbstractBaseUser, PermissionsMixin):
 
 	USERNAME_FIELD = 'email'
 
-class Recipe(models.Model):
+class ExpiringTokenManager(models.Manager):
+	def rotate(self, user, replaced_key=None):
+		"""
+		Issue a new token to an user, other devices stay logged in
+		- The token being replaced, sent by the device logging in again, is deleted
+		- Expired tokens of the user are deleted
+		- Only the TOKEN_MAX_PER_USER newest tokens are kept
+		"""
+		with transaction.atomic():
+			stale = models.Q(created__lt=timezone.now() - get_token_ttl())
+			if replaced_key:
+				stale |= models.Q(key=replaced_key)
+			self.filter(stale, user=user).delete()
+			token = self.create(user=user)
+			kept = self.filter(user=user).order_by('-created', '-pk')[:settings.TOKEN_MAX_PER_USER]
+			self.filter(user=user).exclude(pk__in=list(kept.values_list('pk', flat=True))).delete()
+			return token
+
+	def expired(self):
+		"""Return tokens issued before the current TTL window"""
+		return self.filter(created__lt=timezone.now() - get_token_ttl())
+
+def get_token_ttl():
+	"""Return how long a token stays valid after it is issued"""
+	return datetime.timedelta(seconds=settings.TOKEN_TTL)
+
+class ExpiringToken(models.Model):
+	"""Authentication token that expires TOKEN_TTL seconds after it is issued"""
+	key = models.CharField(max_length=40, primary_key=True)
+	user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='auth_tokens', on_delete=models.CASCADE)
+	created = models.DateTimeField(auto_now_add=True)
+	last_used = models.DateTimeField(null=True)
+
+	objects = ExpiringTokenManager()
+
+	class Meta:
+		indexes = [
+			# Used to find expired tokens for cleanup
+			models.Index(fields=['created'], name='token_created_idx'),
+		]
+
+	def save(self, *args, **kwargs):
+		if not self.key:
+			self.key = self.generate_key()
+		return super().save(*args, **kwargs)
+
+	@staticmethod
+	def generate_key():
+		return binascii.hexlify(os.urandom(20)).decode()
+
+	@property
+	def expires_at(self):
+		return self.created + get_token_ttl()
+
+	def is_expired(self):
+		return self.expires_at <= timezone.now()
+
+	def __str__(self):
+		return self.key
+
+class SoftDeleteQuerySet(models.QuerySet):
+	def soft_delete(self):
+		"""Mark rows as deleted with a single UPDATE"""
+		return self._update_deleted_at(timezone.now())
+
+	def restore(self):
+		return self._update_deleted_at(None)
+
+	def _update_deleted_at(self, deleted_at):
+		"""
+		Update rows, then send soft_delete_changed with the users owning them
+		so per-user caches fed by post_save signals can be invalidated
+		"""
+		user_ids = set(self.order_by().values_list('user_id', flat=True).distinct())
+		count = self.update(deleted_at=deleted_at)
+		if count:
+			soft_delete_changed.send(sender=self.model, user_ids=user_ids, deleted=deleted_at is not None)
+		return count
+
+class SoftDeleteManager(models.Manager.from_queryset(SoftDeleteQuerySet)):
+	"""Default manager, hides soft deleted rows"""
+	def get_queryset(self):
+		return super().get_queryset().filter(deleted_at__isnull=True)
+
+class SoftDeleteModel(models.Model):
+	"""
+	Model whose rows are soft deleted, then purged in batches by the purge_deleted command
+	- objects only returns rows which are not deleted
+	- all_objects returns every row
+	"""
+	deleted_at = models.DateTimeField(null=True, blank=True)
+
+	objects = SoftDeleteManager()
+	all_objects = models.Manager.from_queryset(SoftDeleteQuerySet)()
+
+	class Meta:
+		abstract = True
+
+	def soft_delete(self):
+		self.deleted_at = timezone.now()
+		self.save(update_fields=['deleted_at'])
+
+# Partial indexes only cover rows which are not soft deleted
+NOT_DELETED = models.Q(deleted_at__isnull=True)
+
+class Recipe(SoftDeleteModel):
 	"""Recipe model"""
 	title = models.CharField(max_length=20)
 	user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
 	price = models.DecimalField(max_digits=6, decimal_places=2)
 	time_minute = models.IntegerField()
 	link = models.CharField(max_length=255, blank=True)
-	ingredients = models.ManyToManyField('Ingredient')
-	tags = models.ManyToManyField('Tag')
+	ingredients = models.ManyToManyField('Ingredient', through='RecipeIngredient')
+	tags = models.ManyToManyField('Tag', through='RecipeTag')
 	image = models.ImageField(null=True, upload_to=get_recipe_image_path)
 
+	class Meta:
+		indexes = [
+			# Range filters and sorting on title/price/time_minute are always scoped by user
+			models.Index(fields=['user', 'title'], name='recipe_user_title_idx', condition=NOT_DELETED),
+			models.Index(fields=['user', 'price'], name='recipe_user_price_idx', condition=NOT_DELETED),
+			models.Index(fields=['user', 'time_minute'], name='recipe_user_time_idx', condition=NOT_DELETED),
+			# Used by purge_deleted to find rows to remove
+			models.Index(fields=['deleted_at'], name='recipe_deleted_at_idx', condition=~NOT_DELETED),
+		]
+
+	def set_positions(self, field, ids):
+		"""Store the order of tags/ingredients of the recipe with a single UPDATE"""
+		relation = getattr(Recipe, field).through
+		related = getattr(Recipe, field).field.m2m_reverse_field_name()
+		if not ids:
+			return
+		count = relation.objects.filter(recipe=self).update(position=models.Case(
+			*[models.When(**{related: pk}, then=models.Value(index)) for index, pk in enumerate(ids)],
+			default=models.Value(0),
+		))
+		if count:
+			positions_changed.send(sender=Recipe, instance=self, field=field)
+
 	def __str__(self):
 		return self.title
 
-class Tag(models.Model):
+class Tag(SoftDeleteModel):
 	"""Tag model"""
 	name = models.CharField(max_length=40)
 	user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,)
 
+	class Meta:
+		indexes = [
+			models.Index(fields=['user', 'name'], name='tag_user_name_idx', condition=NOT_DELETED),
+			models.Index(fields=['deleted_at'], name='tag_deleted_at_idx', condition=~NOT_DELETED),
+		]
+
 	def __str__(self):
 		return self.name
 
-class Ingredient(models.Model):
+class Ingredient(SoftDeleteModel):
 	"""Ingredient model"""
 	name = models.CharField(max_length=40)
 	user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,)
 
+	class Meta:
+		indexes = [
+			models.Index(fields=['user', 'name'], name='ingredient_user_name_idx', condition=NOT_DELETED),
+			models.Index(fields=['deleted_at'], name='ingredient_deleted_at_idx', condition=~NOT_DELETED),
+		]
+
 	def __str__(self):
 		return self.name
+
+class RecipeRelationQuerySet(models.QuerySet):
+	def bulk_create(self, objs, *args, **kwargs):
+		"""Fill in the owner of relations created without one, e.g. by recipe.tags.add()"""
+		objs = list(objs)
+		recipe_ids = {obj.recipe_id for obj in objs if obj.user_id is None}
+		if recipe_ids:
+			owners = dict(
+				Recipe._base_manager.filter(pk__in=recipe_ids).values_list('id', 'user_id')
+			)
+			for obj in objs:
+				if obj.user_id is None:
+					obj.user_id = owners.get(obj.recipe_id)
+		return super().bulk_create(objs, *args, **kwargs)
+
+class RecipeRelation(models.Model):
+	"""
+	Base of the recipe M2M through models
+	Carries the owner of the recipe so per-user lookups and
+	partitioning by user_id do not need to join core_recipe
+	"""
+	recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
+	user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+', db_index=False)
+	# Order in which the client listed the tags/ingredients, ties are broken by id
+	position = models.PositiveIntegerField(default=0)
+
+	objects = RecipeRelationQuerySet.as_manager()
+
+	class Meta:
+		abstract = True
+
+	def save(self, *args, **kwargs):
+		if self.user_id is None:
+			self.user_id = Recipe._base_manager.values_list('user_id', flat=True).get(pk=self.recipe_id)
+		return super().save(*args, **kwargs)
+
+class RecipeTag(RecipeRelation):
+	"""Tag of a recipe"""
+	tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+
+	class Meta:
+		db_table = 'core_recipe_tags'
+		unique_together = ('recipe', 'tag')
+		indexes = [
+			# Covers "recipes of an user having these tags" as an index-only scan
+			models.Index(fields=['user', 'tag', 'recipe'], name='recipetag_user_tag_idx'),
+		]
+
+class RecipeIngredient(RecipeRelation):
+	"""Ingredient of a recipe"""
+	ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
+
+	class Meta:
+		db_table = 'core_recipe_ingredients'
+		unique_together = ('recipe', 'ingredient')
+		indexes = [
+			models.Index(fields=['user', 'ingredient', 'recipe'], name='recipeingredient_user_ingr_idx'),
+		]
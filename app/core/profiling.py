@@ -0,0 +1,200 @@
+import cProfile
+import itertools
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+
+from core.authentication import ExpiringTokenAuthentication
+
+_profile_ids = itertools.count(1)
+# tracemalloc and the sampler are process wide, so one request is profiled at a time
+_profiling = threading.Lock()
+
+class ProfileBuffer:
+	"""
+	Profiles of the latest sampled requests of this process, oldest dropped first
+	- Holds PROFILING_BUFFER_SIZE profiles, read when a profile is added
+	- Readers iterate over a copy, requests add profiles while the API lists them
+	"""
+	def __init__(self):
+		self._profiles = deque()
+		self._lock = threading.Lock()
+
+	def append(self, profile):
+		with self._lock:
+			self._profiles.append(profile)
+			while len(self._profiles) > settings.PROFILING_BUFFER_SIZE:
+				self._profiles.popleft()
+
+	def snapshot(self):
+		with self._lock:
+			return list(self._profiles)
+
+	def clear(self):
+		with self._lock:
+			self._profiles.clear()
+
+	def __iter__(self):
+		return iter(self.snapshot())
+
+	def __len__(self):
+		return len(self._profiles)
+
+profiles = ProfileBuffer()
+
+def format_frame(filename, line, function):
+	return f'{filename}:{line}({function})'
+
+class StackSampler(threading.Thread):
+	"""Statistical profiler, counts the stacks a thread is seen in every `interval` seconds"""
+	def __init__(self, thread_id, interval, depth):
+		super().__init__(daemon=True)
+		self.thread_id = thread_id
+		self.interval = interval
+		self.depth = depth
+		self.stacks = Counter()
+		self.samples = 0
+		self._stopped = threading.Event()
+
+	def run(self):
+		while not self._stopped.wait(self.interval):
+			frame = sys._current_frames().get(self.thread_id)
+			stack = []
+			while frame is not None and len(stack) < self.depth:
+				code = frame.f_code
+				stack.append(format_frame(code.co_filename, frame.f_lineno, code.co_name))
+				frame = frame.f_back
+			self.stacks[tuple(reversed(stack))] += 1
+			self.samples += 1
+
+	def stop(self):
+		self._stopped.set()
+		self.join()
+
+	def get_top(self, limit):
+		return [
+			{'stack': list(stack), 'samples': count, 'ratio': round(count / self.samples, 4)}
+			for stack, count in self.stacks.most_common(limit)
+		]
+
+def get_top_functions(profile, limit):
+	"""Return the functions of a cProfile run with the highest cumulative time"""
+	stats = pstats.Stats(profile).stats
+	rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+	return [
+		{
+			'function': format_frame(*function),
+			'calls': calls,
+			'total_time_ms': round(total_time * 1000, 3),
+			'cumulative_time_ms': round(cumulative_time * 1000, 3),
+		}
+		for function, (_, calls, total_time, cumulative_time, _) in rows
+	]
+
+def get_top_allocations(snapshot, limit):
+	"""Return the source lines holding the most memory allocated during the request"""
+	return [
+		{
+			'line': format_frame(stat.traceback[0].filename, stat.traceback[0].lineno, ''),
+			'size_kb': round(stat.size / 1024, 1),
+			'count': stat.count,
+		}
+		for stat in snapshot.statistics('lineno')[:limit]
+	]
+
+class ProfilingMiddleware:
+	"""
+	Profile a sample of requests, see PROFILING_* settings
+	- PROFILING_SAMPLE_RATE of requests are profiled, and requests of staff users
+	  sending the PROFILING_HEADER header
+	- Requests run under cProfile or a stack sampler, with tracemalloc
+	- Results are kept in a bounded ring buffer, read through /api/profiles
+	When disabled the middleware is removed, when not sampling it costs one random()
+	"""
+	def __init__(self, get_response):
+		if not settings.PROFILING_ENABLED:
+			raise MiddlewareNotUsed()
+		self.get_response = get_response
+		self.sample_rate = settings.PROFILING_SAMPLE_RATE
+		self.header = 'HTTP_' + settings.PROFILING_HEADER.upper().replace('-', '_')
+
+	def __call__(self, request):
+		if not self.should_profile(request) or not _profiling.acquire(blocking=False):
+			return self.get_response(request)
+		try:
+			return self.profile(request)
+		finally:
+			_profiling.release()
+
+	def should_profile(self, request):
+		if self.sample_rate and random.random() < self.sample_rate:
+			return True
+		if self.header not in request.META:
+			return False
+		return self.is_staff(request)
+
+	def is_staff(self, request):
+		"""Check the token of the request belongs to a staff user, this runs before any other middleware"""
+		try:
+			authenticated = ExpiringTokenAuthentication().authenticate(request)
+		except APIException:
+			return False
+		return authenticated is not None and authenticated[0].is_staff
+
+	def profile(self, request):
+		limit = settings.PROFILING_TOP
+		tracing = tracemalloc.is_tracing()
+		if tracing:
+			tracemalloc.reset_peak()
+		else:
+			tracemalloc.start(settings.PROFILING_TRACEMALLOC_FRAMES)
+		started_at = timezone.now()
+		started = time.perf_counter()
+
+		if settings.PROFILING_MODE == 'cprofile':
+			profiler = cProfile.Profile()
+			profiler.enable()
+			try:
+				response = self.get_response(request)
+			finally:
+				profiler.disable()
+		else:
+			profiler = StackSampler(threading.get_ident(), settings.PROFILING_INTERVAL, settings.PROFILING_STACK_DEPTH)
+			profiler.start()
+			try:
+				response = self.get_response(request)
+			finally:
+				profiler.stop()
+
+		duration = time.perf_counter() - started
+		snapshot = tracemalloc.take_snapshot()
+		_, peak = tracemalloc.get_traced_memory()
+		if not tracing:
+			tracemalloc.stop()
+
+		profile = {
+			'id': next(_profile_ids),
+			'method': request.method,
+			'path': request.path,
+			'status': response.status_code,
+			'started_at': started_at,
+			'duration_ms': round(duration * 1000, 3),
+			'mode': settings.PROFILING_MODE,
+			'peak_memory_kb': round(peak / 1024, 1),
+			'allocations': get_top_allocations(snapshot, limit),
+		}
+		if settings.PROFILING_MODE == 'cprofile':
+			profile['functions'] = get_top_functions(profiler, limit)
+		else:
+			profile['stacks'] = profiler.get_top(limit)
+		profiles.append(profile)
+		return response
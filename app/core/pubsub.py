@@ -0,0 +1,145 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+try:
+	import redis
+except ImportError:
+	redis = None
+
+logger = logging.getLogger(__name__)
+
+# Put in a subscription queue when its subscriber is too slow, see Subscription.put
+RESYNC = object()
+
+class Subscription:
+	"""Messages of a channel for one subscriber, read from the event loop it was created on"""
+	def __init__(self, broker, channel, loop, queue_size):
+		self.broker = broker
+		self.channel = channel
+		self.loop = loop
+		self.queue = asyncio.Queue()
+		self.queue_size = queue_size
+
+	def put(self, message):
+		"""Runs on the event loop, the queue is replaced by RESYNC once it overflows"""
+		if self.queue.qsize() >= self.queue_size:
+			while not self.queue.empty():
+				self.queue.get_nowait()
+			message = RESYNC
+		self.queue.put_nowait(message)
+
+	async def get(self):
+		return await self.queue.get()
+
+	def close(self):
+		self.broker.unsubscribe(self)
+
+class Broker:
+	"""
+	Fan out published messages to the subscriptions of this process
+	- publish() is called from any thread, e.g. request threads once a transaction commits
+	- Messages go through the backend, which calls deliver() in every process subscribed
+	- Subscriptions are async, messages are handed to their event loop thread safely
+	"""
+	def __init__(self, backend):
+		self.backend = backend
+		self._subscriptions = {}
+		self._lock = threading.Lock()
+
+	def publish(self, channel, message):
+		self.backend.publish(channel, message)
+
+	def subscribe(self, channel):
+		"""Subscribe to a channel, call from a coroutine"""
+		self.backend.start(self.deliver)
+		subscription = Subscription(self, channel, asyncio.get_running_loop(), settings.PUBSUB_QUEUE_SIZE)
+		with self._lock:
+			self._subscriptions.setdefault(channel, set()).add(subscription)
+		return subscription
+
+	def unsubscribe(self, subscription):
+		with self._lock:
+			subscriptions = self._subscriptions.get(subscription.channel)
+			if subscriptions is not None:
+				subscriptions.discard(subscription)
+				if not subscriptions:
+					del self._subscriptions[subscription.channel]
+
+	def deliver(self, channel, message):
+		with self._lock:
+			subscriptions = list(self._subscriptions.get(channel, ()))
+		for subscription in subscriptions:
+			try:
+				subscription.loop.call_soon_threadsafe(subscription.put, message)
+			except RuntimeError:
+				# The event loop of the subscriber is closed
+				self.unsubscribe(subscription)
+
+class LocalBackend:
+	"""Deliver messages to subscribers of this process only"""
+	def start(self, deliver):
+		self.deliver = deliver
+
+	def publish(self, channel, message):
+		deliver = getattr(self, 'deliver', None)
+		if deliver is not None:
+			deliver(channel, message)
+
+class RedisBackend:
+	"""
+	Deliver messages to subscribers of every process through Redis PUBLISH
+	Each process runs one listener thread, started with its first subscription.
+	Needs the redis package and PUBSUB_REDIS_URL.
+	"""
+	def __init__(self):
+		if redis is None:
+			raise ImportError('RedisBackend requires the redis package')
+		self.client = redis.Redis.from_url(settings.PUBSUB_REDIS_URL)
+		self.prefix = settings.PUBSUB_REDIS_PREFIX
+		self._listener = None
+		self._lock = threading.Lock()
+
+	def publish(self, channel, message):
+		try:
+			self.client.publish(self.prefix + channel, json.dumps(message))
+		except redis.RedisError:
+			# Subscribers miss the change, they catch up when they reconnect
+			logger.exception('Could not publish to %s', channel)
+
+	def start(self, deliver):
+		with self._lock:
+			if self._listener is None:
+				self._listener = threading.Thread(target=self.listen, args=(deliver,), daemon=True)
+				self._listener.start()
+
+	def listen(self, deliver):
+		while True:
+			try:
+				pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+				pubsub.psubscribe(self.prefix + '*')
+				for message in pubsub.listen():
+					channel = message['channel'].decode()[len(self.prefix):]
+					deliver(channel, json.loads(message['data']))
+			except redis.RedisError:
+				logger.exception('Lost the pub/sub connection, reconnecting')
+				time.sleep(1)
+
+_broker = None
+_broker_lock = threading.Lock()
+
+def get_broker():
+	"""Return the broker of this process, using the PUBSUB_BACKEND backend"""
+	global _broker
+	with _broker_lock:
+		if _broker is None:
+			_broker = Broker(import_string(settings.PUBSUB_BACKEND)())
+		return _broker
+
+def publish(channel, message):
+	get_broker().publish(channel, message)
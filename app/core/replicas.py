@@ -0,0 +1,126 @@
+import hashlib
+import random
+import time
+
+from asgiref.local import Local
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import OperationalError
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Routing state of the request being handled by the current thread/task
+_state = Local()
+# {replica alias: time until which it is considered down}
+_down_until = {}
+
+def reads_from_replica():
+	return getattr(_state, 'use_replica', False)
+
+def get_replica():
+	"""Return the replica used by the current request, picking a healthy one on first use"""
+	replica = getattr(_state, 'replica', None)
+	if replica is None:
+		replica = _state.replica = pick_replica()
+	return replica
+
+def pick_replica():
+	"""Return a random replica accepting connections, primary if all are down"""
+	now = time.monotonic()
+	candidates = [alias for alias in settings.DATABASE_REPLICAS if _down_until.get(alias, 0) <= now]
+	random.shuffle(candidates)
+	for alias in candidates:
+		try:
+			connections[alias].ensure_connection()
+			return alias
+		except OperationalError:
+			mark_down(alias)
+	return DEFAULT_DB_ALIAS
+
+def get_pin_key(token_key):
+	return 'replica-pin:' + hashlib.sha256(token_key.encode()).hexdigest()
+
+def get_request_token(request):
+	"""Return the key of the token in the Authorization header, None without one"""
+	authorization = request.META.get('HTTP_AUTHORIZATION', '').split()
+	if len(authorization) == 2 and authorization[0].lower() == 'token':
+		return authorization[1]
+	return None
+
+def pin_to_primary(token_key):
+	"""Make requests authenticated with a token read from primary for REPLICA_PIN_SECONDS"""
+	if settings.DATABASE_REPLICAS:
+		caches[settings.REPLICA_PIN_CACHE].set(get_pin_key(token_key), True, settings.REPLICA_PIN_SECONDS)
+
+def is_pinned(token_key):
+	return bool(caches[settings.REPLICA_PIN_CACHE].get(get_pin_key(token_key)))
+
+def mark_down(alias):
+	"""Stop routing to a replica for REPLICA_RETRY_SECONDS"""
+	_down_until[alias] = time.monotonic() + settings.REPLICA_RETRY_SECONDS
+	connections[alias].close()
+
+class ReplicaRouter:
+	"""
+	Route reads of safe requests to replicas, everything else to primary
+	Reads outside of a request, e.g. in management commands, use primary
+	The database cache holding replica pins is always read from primary
+	"""
+	def db_for_read(self, model, **hints):
+		if model._meta.app_label == 'django_cache':
+			return DEFAULT_DB_ALIAS
+		if settings.DATABASE_REPLICAS and reads_from_replica():
+			return get_replica()
+		return DEFAULT_DB_ALIAS
+
+	def db_for_write(self, model, **hints):
+		return DEFAULT_DB_ALIAS
+
+	def allow_relation(self, obj1, obj2, **hints):
+		# Replicas hold the same data as primary
+		return True
+
+	def allow_migrate(self, db, app_label, **hints):
+		return db == DEFAULT_DB_ALIAS
+
+class ReplicaRoutingMiddleware:
+	"""
+	Decide which database a request reads from
+	- Safe requests read from a replica
+	- After an unsafe request, the same token reads from primary for
+	  REPLICA_PIN_SECONDS so it sees its own writes despite replication lag,
+	  tokens issued by login are pinned too, see pin_to_primary
+	- A safe request failing on a replica is retried on primary
+	Pins are kept in the REPLICA_PIN_CACHE cache, shared by all processes
+	"""
+	def __init__(self, get_response):
+		self.get_response = get_response
+
+	def __call__(self, request):
+		if not settings.DATABASE_REPLICAS:
+			return self.get_response(request)
+		token_key = get_request_token(request)
+		_state.use_replica = (
+			request.method in SAFE_METHODS
+			and not (token_key and is_pinned(token_key))
+		)
+		_state.replica = None
+		try:
+			response = self.get_response(request)
+		finally:
+			_state.use_replica = False
+			_state.replica = None
+
+		if request.method not in SAFE_METHODS and token_key:
+			pin_to_primary(token_key)
+		return response
+
+	def process_exception(self, request, exception):
+		replica = getattr(_state, 'replica', None)
+		if not isinstance(exception, OperationalError) or replica in (None, DEFAULT_DB_ALIAS):
+			return None
+		mark_down(replica)
+		_state.use_replica = False
+		match = request.resolver_match
+		return match.func(request, *match.args, **match.kwargs)
@@ -0,0 +1,45 @@
+from rest_framework import serializers
+from django.conf import settings
+
+# Headers naming the client of the batch, only the batch request sets them
+IDENTITY_HEADERS = {
+	'authorization', 'cookie', 'host', 'forwarded', 'x-forwarded-for', 'x-forwarded-host',
+	'x-forwarded-proto', 'x-forwarded-port', 'x-real-ip',
+}
+# Headers of the connection itself, meaningless in a sub-request
+HOP_HEADERS = {
+	'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailer',
+	'transfer-encoding', 'upgrade', 'content-length',
+}
+
+class SubRequestSerializer(serializers.Serializer):
+	"""A request of a batch"""
+	method = serializers.ChoiceField(choices=('GET', 'POST', 'PUT', 'PATCH', 'DELETE'), default='GET')
+	path = serializers.CharField()
+	body = serializers.JSONField(required=False)
+	headers = serializers.DictField(child=serializers.CharField(), required=False, default=dict)
+
+	def validate_path(self, value):
+		if not value.startswith(tuple(settings.BATCH_URL_PREFIXES)):
+			raise serializers.ValidationError(
+				f'Must start with one of {", ".join(settings.BATCH_URL_PREFIXES)}'
+			)
+		return value
+
+	def validate_headers(self, value):
+		names = {name.lower().replace('_', '-') for name in value}
+		if names & IDENTITY_HEADERS:
+			raise serializers.ValidationError('Sub-requests use the authentication and client of the batch')
+		if names & HOP_HEADERS:
+			raise serializers.ValidationError('Connection headers cannot be set on sub-requests')
+		return value
+
+class BatchSerializer(serializers.Serializer):
+	requests = SubRequestSerializer(many=True, allow_empty=False)
+	# Run consecutive GET requests in parallel, other requests still run in order
+	concurrent = serializers.BooleanField(default=False)
+
+	def validate_requests(self, value):
+		if len(value) > settings.BATCH_MAX_REQUESTS:
+			raise serializers.ValidationError(f'At most {settings.BATCH_MAX_REQUESTS} requests are allowed')
+		return value
@@ -0,0 +1,9 @@
+from django.dispatch import Signal
+
+# Sent by SoftDeleteQuerySet.soft_delete() and restore(), which update rows
+# without post_save. Arguments: sender (model), user_ids, deleted (bool)
+soft_delete_changed = Signal()
+
+# Sent by Recipe.set_positions(), which reorders relations with a queryset update.
+# Arguments: sender (Recipe), instance, field ('tags' or 'ingredients')
+positions_changed = Signal()
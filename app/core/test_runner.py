@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from collections import defaultdict
+
+from django.test import override_settings
+from django.test.runner import DiscoverRunner, ParallelTestSuite, RemoteTestResult, RemoteTestRunner
+
+class TimedRemoteTestResult(RemoteTestResult):
+	"""Result of a --parallel worker, sends the duration of each test back to the main process"""
+	def startTest(self, test):
+		self._started_at = time.perf_counter()
+		super().startTest(test)
+
+	def stopTest(self, test):
+		self.events.append(('addTestDuration', self.test_index, time.perf_counter() - self._started_at))
+		super().stopTest(test)
+
+class TimedRemoteTestRunner(RemoteTestRunner):
+	resultclass = TimedRemoteTestResult
+
+class TimedParallelTestSuite(ParallelTestSuite):
+	runner_class = TimedRemoteTestRunner
+
+class TimedTextTestResult(unittest.TextTestResult):
+	"""
+	Sum test durations per module
+	- Tests run in this process are timed here
+	- Tests run by --parallel workers are timed there, see TimedRemoteTestResult
+	"""
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.module_durations = defaultdict(float)
+		self.module_tests = defaultdict(int)
+
+	def startTest(self, test):
+		self._started_at = time.perf_counter()
+		self.module_tests[type(test).__module__] += 1
+		super().startTest(test)
+
+	def stopTest(self, test):
+		# Replayed events of parallel workers arrive all at once, this adds nearly nothing for them
+		self.addTestDuration(test, time.perf_counter() - self._started_at)
+		super().stopTest(test)
+
+	def addTestDuration(self, test, duration):
+		self.module_durations[type(test).__module__] += duration
+
+class TimedTestRunner(DiscoverRunner):
+	"""
+	Test runner reporting the slowest test modules after the run
+	- Files are written below a temporary MEDIA_ROOT removed once the run is over
+	"""
+	parallel_test_suite = TimedParallelTestSuite
+
+	def __init__(self, slowest=10, **kwargs):
+		super().__init__(**kwargs)
+		self.slowest = slowest
+
+	@classmethod
+	def add_arguments(cls, parser):
+		super().add_arguments(parser)
+		parser.add_argument(
+			'--slowest', type=int, default=10,
+			help='Number of slowest test modules to report, 0 to disable',
+		)
+
+	def setup_test_environment(self, **kwargs):
+		super().setup_test_environment(**kwargs)
+		self.media_root = tempfile.mkdtemp(prefix='recipe-test-media-')
+		self.media_settings = override_settings(
+			MEDIA_ROOT=self.media_root, THUMBNAIL_ROOT=os.path.join(self.media_root, 'thumbnails'),
+		)
+		self.media_settings.enable()
+
+	def teardown_test_environment(self, **kwargs):
+		self.media_settings.disable()
+		shutil.rmtree(self.media_root, ignore_errors=True)
+		super().teardown_test_environment(**kwargs)
+
+	def get_resultclass(self):
+		return super().get_resultclass() or TimedTextTestResult
+
+	def run_suite(self, suite, **kwargs):
+		result = super().run_suite(suite, **kwargs)
+		if self.slowest and isinstance(result, TimedTextTestResult):
+			self.report_timings(result)
+		return result
+
+	def report_timings(self, result):
+		durations = sorted(result.module_durations.items(), key=lambda item: item[1], reverse=True)
+		result.stream.writeln(f'\nSlowest test modules ({sum(result.module_durations.values()):.2f}s in tests):')
+		for module, duration in durations[:self.slowest]:
+			result.stream.writeln(f'  {duration:7.2f}s  {result.module_tests[module]:4} tests  {module}')
@@ -1,20 +1,46 @@
-from django.test import TestCase
-from rest_framework.test import APIClient, force_authenticate
-from django.contrib.auth import get_user_model
+import copy
+import shutil
+import tempfile
 
-def mock_user(email='test@example.com', password='helloworld'):
-	"""Mock an user"""
-	return get_user_model().objects.create_user(email=email, password=password)
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from core.tests.factories import mock_user
 
 class AuthenticatedTestCase(TestCase):
 	"""Setup authenticated test case"""
+	@classmethod
+	def setUpTestData(cls):
+		"""Create the mock user once for all tests of the class"""
+		cls.user = mock_user()
+
 	def setUp(self):
 		"""
 		Setup authenticated test case
-		- Setup mock user
+		- Copy the shared user so in-memory changes do not leak into other tests
 		- Setup API client for making API request
 		- Authenticate user
 		"""
-		self.user = mock_user()
+		self.user = copy.deepcopy(type(self).user)
 		self.client = APIClient()
-		self.client.force_authenticate(user=self.user)
\ No newline at end of file
+		self.client.force_authenticate(user=self.user)
+
+class TemporaryMediaMixin:
+	"""
+	Give each test case class its own MEDIA_ROOT and THUMBNAIL_ROOT
+	so test processes of --parallel never share uploaded files
+	"""
+	@classmethod
+	def setUpClass(cls):
+		cls.media_root = tempfile.mkdtemp(prefix='recipe-test-media-')
+		cls.thumbnail_root = tempfile.mkdtemp(prefix='recipe-test-thumbnails-')
+		cls._media_settings = override_settings(MEDIA_ROOT=cls.media_root, THUMBNAIL_ROOT=cls.thumbnail_root)
+		cls._media_settings.enable()
+		super().setUpClass()
+
+	@classmethod
+	def tearDownClass(cls):
+		super().tearDownClass()
+		cls._media_settings.disable()
+		shutil.rmtree(cls.media_root, ignore_errors=True)
+		shutil.rmtree(cls.thumbnail_root, ignore_errors=True)
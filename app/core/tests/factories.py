@@ -0,0 +1,25 @@
+from django.contrib.auth import get_user_model
+
+from core.models import Recipe, Tag, Ingredient
+
+def mock_user(email='test@example.com', password='helloworld', **extra_fields):
+	"""Mock an user"""
+	return get_user_model().objects.create_user(email=email, password=password, **extra_fields)
+
+def mock_recipe(user, **params):
+	"""Mock a recipe"""
+	default = {
+		'title': 'Mock recipe',
+		'price': 10,
+		'time_minute': 15
+	}
+	default.update(params)
+	return Recipe.objects.create(user=user, **default)
+
+def mock_tag(user, name='tag'):
+	"""Mock a tag"""
+	return Tag.objects.create(user=user, name=name)
+
+def mock_ingredient(user, name='ingredient'):
+	"""Mock an ingredient"""
+	return Ingredient.objects.create(user=user, name=name)
@@ -2,24 +2,30 @@ from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
+from core.models import Recipe, RecipeTag, Tag
+
 class AdminTest(TestCase):
 
-	def setUp(self):
-		"""Setup that run before every test"""
-		# Setup client
-		self.client = Client()
-		# Setup admin user and simulate logging in
-		self.admin_user = get_user_model().objects.create_superuser(
+	@classmethod
+	def setUpTestData(cls):
+		"""Setup users shared by every test"""
+		# Setup admin user
+		cls.admin_user = get_user_model().objects.create_superuser(
 			email = 'admin@test.com',
 			password = 'password'
 		)
-		self.client.force_login(self.admin_user)
 		# Setup normal user
-		self.user = get_user_model().objects.create_user(
+		cls.user = get_user_model().objects.create_user(
 			email = 'user@test.com',
 			password = 'password'
 		)
 
+	def setUp(self):
+		"""Setup that run before every test"""
+		# Setup client and simulate logging in
+		self.client = Client()
+		self.client.force_login(self.admin_user)
+
 	def test_user_listing(self):
 		"""Test if Admin site list all users"""
 		url = reverse('admin:core_user_changelist')
@@ -41,3 +47,49 @@ class AdminTest(TestCase):
 		self.assertEqual(res.status_code, 200)
 
 
+
+
+class RecipeAdminTest(TestCase):
+	"""Test admin pages of recipes, tags and ingredients"""
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.admin_user = get_user_model().objects.create_superuser(email='admin@test.com', password='password')
+		cls.user = get_user_model().objects.create_user(email='user@test.com', password='password')
+		cls.tag = Tag.objects.create(user=cls.user, name='Soup')
+		cls.recipe = Recipe.objects.create(user=cls.user, title='Pho', price=5, time_minute=30)
+		cls.recipe.tags.add(cls.tag)
+
+	def setUp(self):
+		self.client = Client()
+		self.client.force_login(self.admin_user)
+
+	def test_changelists(self):
+		"""Test that changelists and searches work, soft deleted rows included"""
+		Recipe.objects.filter(id=self.recipe.id).soft_delete()
+		for model_name, search in (('recipe', 'ph'), ('tag', 'so'), ('ingredient', 'x')):
+			res = self.client.get(reverse(f'admin:core_{model_name}_changelist'), {'q': search})
+			self.assertEqual(res.status_code, 200)
+		res = self.client.get(reverse('admin:core_recipe_changelist'), {'q': 'ph'})
+		self.assertContains(res, 'Pho')
+
+	def test_recipe_change_page(self):
+		"""Test that tags are edited inline and users are not rendered as options"""
+		res = self.client.get(reverse('admin:core_recipe_change', args=[self.recipe.id]))
+
+		self.assertEqual(res.status_code, 200)
+		self.assertContains(res, 'name="recipetag_set-0-tag"')
+		self.assertNotContains(res, f'<option value="{self.user.id}"')
+
+	def test_soft_delete_and_restore_actions(self):
+		"""Test that bulk actions are single updates, plus a lookup of the users to invalidate"""
+		url = reverse('admin:core_recipe_changelist')
+		data = {'_selected_action': [self.recipe.id]}
+
+		with self.assertNumQueries(5):
+			self.client.post(url, dict(data, action='soft_delete_selected'))
+		self.assertIsNotNone(Recipe.all_objects.get(id=self.recipe.id).deleted_at)
+
+		self.client.post(url, dict(data, action='restore_selected'))
+		self.assertIsNone(Recipe.all_objects.get(id=self.recipe.id).deleted_at)
+		self.assertEqual(RecipeTag.objects.count(), 1)
@@ -0,0 +1,102 @@
+import datetime
+import importlib
+from io import StringIO
+from types import SimpleNamespace
+
+from django.apps import apps
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+from rest_framework import status
+from core.models import ExpiringToken
+from core.tests.authenticated_test_case import mock_user
+
+MANAGE_USER_URL = reverse('user:me')
+
+def expire(token):
+	"""Move token issue date to before the TTL window"""
+	ExpiringToken.objects.filter(key=token.key).update(
+		created=timezone.now() - datetime.timedelta(days=365)
+	)
+
+class ExpiringTokenAuthenticationTests(TestCase):
+	"""Test authenticating with expiring tokens"""
+	def setUp(self):
+		self.user = mock_user()
+		self.token = ExpiringToken.objects.rotate(self.user)
+		self.client = APIClient()
+		self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+	def test_valid_token_authenticates(self):
+		"""Test if a fresh token authenticates and records usage"""
+		res = self.client.get(MANAGE_USER_URL)
+		self.token.refresh_from_db()
+
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		self.assertIsNotNone(self.token.last_used)
+
+	def test_expired_token_rejected(self):
+		"""Test if an expired token is rejected"""
+		expire(self.token)
+		res = self.client.get(MANAGE_USER_URL)
+		self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+	@override_settings(TOKEN_LAST_USED_INTERVAL=3600)
+	def test_last_used_written_once_per_interval(self):
+		"""Test if usage is not written on every request"""
+		self.client.get(MANAGE_USER_URL)
+		self.token.refresh_from_db()
+		first_used = self.token.last_used
+
+		with self.assertNumQueries(1):
+			self.client.get(MANAGE_USER_URL)
+		self.token.refresh_from_db()
+		self.assertEqual(self.token.last_used, first_used)
+
+	def test_rotate_keeps_other_devices(self):
+		"""Test if rotating only drops the replaced token"""
+		other_device = ExpiringToken.objects.rotate(self.user)
+		new_token = ExpiringToken.objects.rotate(self.user, replaced_key=self.token.key)
+		self.assertNotEqual(new_token.key, self.token.key)
+		self.assertEqual(
+			set(ExpiringToken.objects.filter(user=self.user)),
+			{other_device, new_token},
+		)
+
+	@override_settings(TOKEN_MAX_PER_USER=2)
+	def test_rotate_caps_tokens_per_user(self):
+		"""Test if only the newest tokens of an user are kept"""
+		expired = ExpiringToken.objects.rotate(self.user)
+		expire(expired)
+		tokens = [ExpiringToken.objects.rotate(self.user) for _ in range(2)]
+		self.assertEqual(set(ExpiringToken.objects.filter(user=self.user)), set(tokens))
+
+	def test_copy_authtoken_tokens(self):
+		"""Test if tokens left by rest_framework.authtoken are copied with a fresh TTL"""
+		migration = importlib.import_module('core.migrations.0014_copy_authtoken_tokens')
+		with connection.cursor() as cursor:
+			cursor.execute('CREATE TABLE authtoken_token (key varchar(40) PRIMARY KEY, user_id integer, created timestamp)')
+			cursor.execute(
+				'INSERT INTO authtoken_token VALUES (%s, %s, %s), (%s, %s, %s)',
+				['a' * 40, self.user.id, '2020-01-01', self.token.key, self.user.id, '2020-01-01'],
+			)
+		# Only the connection of the schema editor is used
+		migration.copy_authtoken_tokens(apps, SimpleNamespace(connection=connection))
+
+		token = ExpiringToken.objects.get(key='a' * 40)
+		self.assertEqual(token.user, self.user)
+		self.assertFalse(token.is_expired())
+		self.assertEqual(ExpiringToken.objects.filter(user=self.user).count(), 2)
+
+	def test_clear_expired_tokens(self):
+		"""Test if cleanup command only deletes expired tokens"""
+		expire(self.token)
+		other_token = ExpiringToken.objects.rotate(mock_user(email='other@example.com'))
+		call_command('clear_expired_tokens', batch_size=1, stdout=StringIO())
+
+		self.assertFalse(ExpiringToken.objects.filter(key=self.token.key).exists())
+		self.assertTrue(ExpiringToken.objects.filter(key=other_token.key).exists())
@@ -0,0 +1,119 @@
+from unittest.mock import patch
+
+from django.db import connections
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.authentication import ExpiringTokenAuthentication
+from core.models import ExpiringToken, Recipe, Tag
+from core.views import close_connections
+from core.tests.authenticated_test_case import AuthenticatedTestCase
+from core.tests.factories import mock_user
+
+BATCH_URL = reverse('core:batch')
+
+class PublicBatchApiTests(TestCase):
+	"""Test the batch API without authentication"""
+
+	def test_authentication_required(self):
+		res = APIClient().post(BATCH_URL, {'requests': [{'path': '/api/user/me'}]}, format='json')
+		self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+class PrivateBatchApiTests(AuthenticatedTestCase):
+	"""Test running several requests in one batch"""
+
+	def test_batch_requests(self):
+		"""Test if responses of all sub-requests are returned in order"""
+		Tag.objects.create(user=self.user, name='soup')
+		res = self.client.post(BATCH_URL, {'requests': [
+			{'path': '/api/user/me'},
+			{'method': 'POST', 'path': '/api/recipe/tags', 'body': {'name': 'asian'}},
+			{'path': '/api/recipe/tags?assigned_only=0'},
+			{'path': '/api/recipe/unknown'},
+		]}, format='json')
+
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		responses = res.data['responses']
+		self.assertEqual([response['status'] for response in responses], [200, 201, 200, 404])
+		self.assertEqual(responses[0]['body']['email'], self.user.email)
+		self.assertEqual([tag['name'] for tag in responses[2]['body']], ['asian', 'soup'])
+
+	def test_batch_authenticates_once(self):
+		"""Test if the token is checked once for the whole batch"""
+		token = ExpiringToken.objects.create(user=self.user)
+		client = APIClient()
+		client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+		requests = [{'path': '/api/user/me'}, {'path': '/api/recipe/recipes'}, {'path': '/api/recipe/tags'}]
+
+		with patch.object(
+			ExpiringTokenAuthentication, 'authenticate_credentials',
+			autospec=True, side_effect=ExpiringTokenAuthentication.authenticate_credentials,
+		) as mock_authenticate:
+			res = client.post(BATCH_URL, {'requests': requests}, format='json')
+
+		self.assertEqual([response['status'] for response in res.data['responses']], [200, 200, 200])
+		self.assertEqual(mock_authenticate.call_count, 1)
+
+	def test_batch_rejects_other_paths(self):
+		"""Test if sub-requests cannot reach the admin or the batch endpoint itself"""
+		for path in ('/admin/', '/api/batch'):
+			res = self.client.post(BATCH_URL, {'requests': [{'path': path}]}, format='json')
+			self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_batch_rejects_identity_headers(self):
+		"""Test if sub-requests cannot pose as another client or set connection headers"""
+		for name in ('Authorization', 'Host', 'X-Forwarded-For', 'x_forwarded_for', 'Forwarded', 'Connection'):
+			res = self.client.post(BATCH_URL, {'requests': [
+				{'path': '/api/user/me', 'headers': {name: 'evil'}},
+			]}, format='json')
+			self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_batch_too_many_requests(self):
+		with self.settings(BATCH_MAX_REQUESTS=2):
+			res = self.client.post(BATCH_URL, {'requests': [{'path': '/api/user/me'}] * 3}, format='json')
+		self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+class ConcurrentBatchApiTests(TransactionTestCase):
+	"""Test running the reads of a batch in parallel"""
+
+	def setUp(self):
+		self.user = mock_user()
+		self.client = APIClient()
+		self.client.force_authenticate(user=self.user)
+
+	def test_concurrent_reads_around_writes(self):
+		"""Test if reads after a write see it, whatever thread they run on"""
+		res = self.client.post(BATCH_URL, {'concurrent': True, 'requests': [
+			{'path': '/api/recipe/recipes'},
+			{'path': '/api/user/me'},
+			{'method': 'POST', 'path': '/api/recipe/recipes', 'body': {
+				'title': 'Soup', 'price': '5.00', 'time_minute': 10, 'tags': [], 'ingredients': [],
+			}},
+			{'path': '/api/recipe/recipes'},
+			{'path': '/api/recipe/tags'},
+		]}, format='json')
+
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		responses = res.data['responses']
+		self.assertEqual([response['status'] for response in responses], [200, 200, 201, 200, 200])
+		self.assertEqual(responses[0]['body'], [])
+		self.assertEqual([recipe['title'] for recipe in responses[3]['body']], ['Soup'])
+		self.assertEqual(Recipe.objects.count(), 1)
+
+	def test_pool_connections_closed_once(self):
+		"""Test if connections of the pool threads are closed at shutdown, not after each read"""
+		requests = [{'path': '/api/recipe/recipes'}] * 4
+		with self.settings(BATCH_MAX_WORKERS=2), \
+				patch('core.views.connections.close_all') as mock_close_all, \
+				patch('core.views.close_connections', wraps=close_connections) as mock_close:
+			res = self.client.post(BATCH_URL, {'concurrent': True, 'requests': requests}, format='json')
+
+		self.assertEqual([response['status'] for response in res.data['responses']], [200] * 4)
+		mock_close_all.assert_not_called()
+		mock_close.assert_called_once()
+		pool_connections = mock_close.call_args.args[0]
+		self.assertTrue(pool_connections)
+		self.assertLessEqual(len(pool_connections), 2 * len(connections.all()))
+		self.assertNotIn(connections['default'], pool_connections)
@@ -0,0 +1,184 @@
+import datetime
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.utils import IntegrityError, OperationalError
+from django.test import TestCase
+from django.utils import timezone
+from unittest import skipUnless
+
+from core.management.commands.profile_startup import parse_importtime
+from core.models import Recipe, Tag, RecipeTag
+from core.tests.factories import mock_user, mock_recipe, mock_tag, mock_ingredient
+
+WAIT_FOR_DB = 'core.management.commands.wait_for_db.Command'
+
+@patch('time.sleep')
+class WaitForDbTests(TestCase):
+	"""Test the wait_for_db command"""
+
+	def test_wait_for_db_ready(self, mock_sleep):
+		"""Test that command returns at once when the database is ready"""
+		call_command('wait_for_db', stdout=StringIO())
+		mock_sleep.assert_not_called()
+
+	@patch('core.management.commands.wait_for_db.connections')
+	@patch(f'{WAIT_FOR_DB}.probe')
+	def test_wait_for_db_retries_with_backoff(self, mock_probe, mock_connections, mock_sleep):
+		"""Test that command retries with growing delays until the database answers"""
+		mock_probe.side_effect = [OperationalError] * 4 + [None]
+		call_command('wait_for_db', initial_delay=1, max_delay=4, stdout=StringIO())
+
+		self.assertEqual(mock_probe.call_count, 5)
+		self.assertEqual(mock_connections['default'].close.call_count, 4)
+		delays = [call.args[0] for call in mock_sleep.call_args_list]
+		for delay, backoff in zip(delays, [1, 2, 4, 4]):
+			self.assertGreaterEqual(delay, backoff / 2)
+			self.assertLessEqual(delay, backoff)
+
+	@patch('core.management.commands.wait_for_db.connections')
+	@patch(f'{WAIT_FOR_DB}.probe', side_effect=OperationalError)
+	def test_wait_for_db_timeout(self, mock_probe, mock_connections, mock_sleep):
+		"""Test that command fails once the timeout is spent"""
+		with self.assertRaises(CommandError):
+			call_command('wait_for_db', timeout=0, stdout=StringIO())
+
+	@patch(f'{WAIT_FOR_DB}.has_pending_migrations', side_effect=[True, False])
+	def test_wait_for_migrations(self, mock_pending, mock_sleep):
+		"""Test that command waits for pending migrations when asked to"""
+		call_command('wait_for_db', migrations='wait', stdout=StringIO())
+
+		self.assertEqual(mock_pending.call_count, 2)
+		self.assertEqual(mock_sleep.call_count, 1)
+
+	@patch('core.management.commands.wait_for_db.call_command')
+	@patch(f'{WAIT_FOR_DB}.has_pending_migrations')
+	def test_migrate_only_when_pending(self, mock_pending, mock_call_command, mock_sleep):
+		"""Test that --migrations apply skips migrate when the schema is current"""
+		mock_pending.return_value = False
+		call_command('wait_for_db', migrations='apply', stdout=StringIO())
+		mock_call_command.assert_not_called()
+
+		mock_pending.return_value = True
+		call_command('wait_for_db', migrations='apply', stdout=StringIO())
+		mock_call_command.assert_called_once()
+
+class ProfileStartupTests(TestCase):
+	"""Test the profile_startup command"""
+
+	def test_parse_importtime(self):
+		"""Test parsing of python -X importtime output"""
+		output = (
+			'import time: self [us] | cumulative | imported package\n'
+			'import time:       100 |        100 |   _io\n'
+			'import time:       300 |        400 | io\n'
+			'import time:        50 |         50 | json\n'
+		)
+		total, top_level = parse_importtime(output)
+
+		self.assertEqual(total, 450)
+		self.assertEqual(top_level, {'io': 400, 'json': 50})
+
+class PartitionRecipeTablesTests(TestCase):
+	"""Test the partition_recipe_tables command"""
+
+	@skipUnless(connection.vendor != 'postgresql', 'Partitioning works on PostgreSQL')
+	def test_partition_requires_postgres(self):
+		"""Test that partitioning is refused on other databases"""
+		with self.assertRaises(CommandError):
+			call_command('partition_recipe_tables', stdout=StringIO())
+
+	@skipUnless(connection.vendor == 'postgresql', 'Partitioning needs PostgreSQL')
+	def test_partition_dry_run(self):
+		"""Test that dry run prints the partitioning SQL without running it"""
+		out = StringIO()
+		call_command('partition_recipe_tables', partitions=4, dry_run=True, stdout=out)
+
+		self.assertIn('CREATE TABLE core_recipe_tags (LIKE core_recipe_tags_unpartitioned', out.getvalue())
+		self.assertIn('PARTITION BY HASH (user_id)', out.getvalue())
+		self.assertIn('REMAINDER 3', out.getvalue())
+		with connection.cursor() as cursor:
+			cursor.execute("SELECT count(*) FROM pg_partitioned_table")
+			self.assertEqual(cursor.fetchone()[0], 0)
+
+	@skipUnless(connection.vendor == 'postgresql', 'Partitioning needs PostgreSQL, set DB_HOST to run it')
+	def test_partition_keeps_data_and_foreign_keys(self):
+		"""Test that rows survive and link tables still reference core_recipe"""
+		user = mock_user()
+		recipe = mock_recipe(user)
+		recipe.tags.add(mock_tag(user))
+		recipe.ingredients.add(mock_ingredient(user))
+
+		call_command('partition_recipe_tables', partitions=2, stdout=StringIO())
+
+		with connection.cursor() as cursor:
+			cursor.execute("SELECT count(*) FROM pg_partitioned_table")
+			self.assertEqual(cursor.fetchone()[0], 3)
+			cursor.execute(
+				"SELECT conrelid::regclass::text, pg_get_constraintdef(oid) FROM pg_constraint "
+				"WHERE contype = 'f' AND confrelid = 'core_recipe'::regclass ORDER BY 1"
+			)
+			self.assertEqual(cursor.fetchall(), [
+				(table, 'FOREIGN KEY (recipe_id, user_id) REFERENCES core_recipe(id, user_id) DEFERRABLE INITIALLY DEFERRED')
+				for table in ('core_recipe_ingredients', 'core_recipe_tags')
+			])
+		self.assertEqual(Recipe.objects.get(id=recipe.id).tags.count(), 1)
+		self.assertEqual(recipe.ingredients.count(), 1)
+
+		# New rows still get ids from the sequence and links are enforced
+		new_recipe = mock_recipe(user)
+		self.assertGreater(new_recipe.id, recipe.id)
+		with self.assertRaises(IntegrityError), transaction.atomic():
+			RecipeTag.objects.create(user=user, recipe_id=new_recipe.id + 1000, tag=recipe.tags.get())
+			connection.check_constraints()
+
+class PurgeDeletedTests(TestCase):
+	"""Test the purge_deleted command"""
+
+	def setUp(self):
+		self.user = get_user_model().objects.create_user(email='test@example.com', password='helloworld')
+
+	def mock_recipe(self, user, deleted_days_ago=None):
+		recipe = Recipe.objects.create(user=user, title='Recipe', price=10, time_minute=10)
+		recipe.tags.add(Tag.objects.create(user=user, name='tag'))
+		if deleted_days_ago is not None:
+			Recipe.all_objects.filter(id=recipe.id).update(
+				deleted_at=timezone.now() - datetime.timedelta(days=deleted_days_ago)
+			)
+		return recipe
+
+	def test_purge_old_deleted_rows(self):
+		"""Test that only rows deleted before the cutoff are removed, with their links"""
+		old = self.mock_recipe(self.user, deleted_days_ago=10)
+		recent = self.mock_recipe(self.user, deleted_days_ago=1)
+		live = self.mock_recipe(self.user)
+
+		call_command('purge_deleted', older_than_days=7, batch_size=1, stdout=StringIO())
+
+		self.assertEqual(
+			set(Recipe.all_objects.values_list('id', flat=True)), {recent.id, live.id}
+		)
+		self.assertFalse(RecipeTag.objects.filter(recipe_id=old.id).exists())
+		self.assertEqual(Tag.objects.count(), 3)
+
+	def test_purge_user(self):
+		"""Test that every row of an user is removed in batches before the user"""
+		self.mock_recipe(self.user)
+		self.mock_recipe(self.user, deleted_days_ago=1)
+		other = get_user_model().objects.create_user(email='other@example.com', password='helloworld')
+		self.mock_recipe(other)
+
+		call_command('purge_deleted', user=self.user.id, batch_size=1, stdout=StringIO())
+
+		self.assertFalse(get_user_model().objects.filter(id=self.user.id).exists())
+		self.assertEqual(Recipe.all_objects.count(), 1)
+		self.assertEqual(Tag.all_objects.count(), 1)
+		self.assertEqual(RecipeTag.objects.count(), 1)
+
+	def test_purge_unknown_user(self):
+		with self.assertRaises(CommandError):
+			call_command('purge_deleted', user=0, stdout=StringIO())
@@ -0,0 +1,112 @@
+import os
+import shutil
+from unittest.mock import patch
+
+from PIL import Image
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from core.media import evict_thumbnails, thumbnail_cache
+from core.tests.authenticated_test_case import TemporaryMediaMixin
+
+@override_settings(THUMBNAIL_CACHE_MAX_BYTES=10 ** 9, MEDIA_ACCEL_REDIRECT='')
+class MediaTests(TemporaryMediaMixin, TestCase):
+	"""Test serving of uploaded files"""
+
+	def setUp(self):
+		shutil.rmtree(self.thumbnail_root, ignore_errors=True)
+		# Measured again on the next write
+		thumbnail_cache.root = None
+		os.makedirs(os.path.join(self.media_root, 'uploads/recipe'), exist_ok=True)
+		self.image_path = 'uploads/recipe/image.png'
+		Image.new('RGB', (400, 200), 'red').save(os.path.join(self.media_root, self.image_path))
+		self.url = reverse('media', args=[self.image_path])
+
+	def test_serve_file_with_cache_headers(self):
+		"""Test if files are sent whole with immutable cache headers and an ETag"""
+		res = self.client.get(self.url)
+
+		self.assertEqual(res.status_code, 200)
+		self.assertEqual(res['Content-Type'], 'image/png')
+		self.assertIn('immutable', res['Cache-Control'])
+		self.assertEqual(res['Accept-Ranges'], 'bytes')
+		with open(os.path.join(self.media_root, self.image_path), 'rb') as file:
+			self.assertEqual(b''.join(res.streaming_content), file.read())
+
+		res = self.client.get(self.url, HTTP_IF_NONE_MATCH=res['ETag'])
+		self.assertEqual(res.status_code, 304)
+
+	def test_if_none_match_list_weak_and_any(self):
+		"""Test if weak ETags, lists of ETags and * are answered with 304"""
+		etag = self.client.get(self.url)['ETag']
+
+		for if_none_match in (f'W/{etag}', f'"other", {etag}', '*'):
+			res = self.client.get(self.url, HTTP_IF_NONE_MATCH=if_none_match)
+			self.assertEqual(res.status_code, 304)
+		res = self.client.get(self.url, HTTP_IF_NONE_MATCH='"other", W/"another"')
+		self.assertEqual(res.status_code, 200)
+
+	def test_serve_range(self):
+		"""Test if a single byte range is answered with 206"""
+		size = os.path.getsize(os.path.join(self.media_root, self.image_path))
+
+		res = self.client.get(self.url, HTTP_RANGE='bytes=0-7')
+		self.assertEqual(res.status_code, 206)
+		self.assertEqual(res['Content-Range'], f'bytes 0-7/{size}')
+		self.assertEqual(b''.join(res.streaming_content), b'\x89PNG\r\n\x1a\n')
+
+		res = self.client.get(self.url, HTTP_RANGE=f'bytes={size}-')
+		self.assertEqual(res.status_code, 416)
+
+	def test_serve_missing_or_outside_root(self):
+		for path in ('uploads/recipe/missing.png', '../etc/passwd'):
+			res = self.client.get(reverse('media', args=[path]))
+			self.assertEqual(res.status_code, 404)
+
+	@override_settings(MEDIA_ACCEL_REDIRECT='/protected/')
+	def test_accel_redirect(self):
+		"""Test if the body is left to the front proxy when offloading is set"""
+		res = self.client.get(self.url)
+
+		self.assertEqual(res['X-Accel-Redirect'], f'/protected/media/{self.image_path}')
+		self.assertEqual(res.content, b'')
+
+	def test_thumbnail(self):
+		"""Test if thumbnails are generated once at an allowed width"""
+		res = self.client.get(self.url, {'w': 128})
+
+		self.assertEqual(res.status_code, 200)
+		thumbnail_path = os.path.join(self.thumbnail_root, '128', self.image_path)
+		with Image.open(thumbnail_path) as image:
+			self.assertEqual(image.width, 128)
+		self.assertEqual(self.client.get(self.url, {'w': 100}).status_code, 404)
+
+	def test_thumbnail_cache_evicts_least_recently_used(self):
+		"""Test if the oldest used thumbnails are removed above the size limit"""
+		self.client.get(self.url, {'w': 64})
+		old_path = os.path.join(self.thumbnail_root, '64', self.image_path)
+		os.utime(old_path, (0, 0))
+		size = os.path.getsize(old_path)
+
+		with self.settings(THUMBNAIL_CACHE_MAX_BYTES=size * 2):
+			self.client.get(self.url, {'w': 128})
+
+		self.assertFalse(os.path.exists(old_path))
+		self.assertTrue(os.path.exists(os.path.join(self.thumbnail_root, '128', self.image_path)))
+
+	def test_thumbnail_cache_size_tracked(self):
+		"""Test if the thumbnail directory is only walked again once over the limit or after many writes"""
+		with patch('core.media.evict_thumbnails', wraps=evict_thumbnails) as mock_evict:
+			for width in (64, 128, 256):
+				self.client.get(self.url, {'w': width})
+			self.assertEqual(mock_evict.call_count, 1)
+
+			with patch('core.media.THUMBNAIL_MEASURE_WRITES', 1):
+				self.client.get(self.url, {'w': 512})
+			self.assertEqual(mock_evict.call_count, 2)
+
+			os.utime(os.path.join(self.thumbnail_root, '64', self.image_path), (0, 0))
+			with self.settings(THUMBNAIL_CACHE_MAX_BYTES=thumbnail_cache.size):
+				self.client.get(self.url, {'w': 1024})
+			self.assertEqual(mock_evict.call_count, 3)
+		self.assertFalse(os.path.exists(os.path.join(self.thumbnail_root, '64', self.image_path)))
@@ -0,0 +1,78 @@
+import gzip
+import json
+from unittest.mock import Mock
+
+from django.core.cache import caches
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase
+
+from core.middleware import CompressionMiddleware, compress_gzip, negotiate_encoding
+
+PAYLOAD = [{'id': index, 'title': f'Recipe {index}', 'price': '10.00'} for index in range(200)]
+
+class CompressionMiddlewareTests(TestCase):
+	"""Test compression of responses"""
+
+	def setUp(self):
+		caches['compression'].clear()
+		self.factory = RequestFactory()
+
+	def get(self, response, accept_encoding='gzip, deflate, br'):
+		middleware = CompressionMiddleware(lambda request: response)
+		return middleware(self.factory.get('/', HTTP_ACCEPT_ENCODING=accept_encoding))
+
+	def test_compress_large_json(self):
+		"""Test if large JSON responses are gzipped"""
+		response = self.get(JsonResponse(PAYLOAD, safe=False))
+
+		self.assertEqual(response['Content-Encoding'], 'gzip')
+		self.assertEqual(response['Vary'], 'Accept-Encoding')
+		self.assertEqual(json.loads(gzip.decompress(response.content)), PAYLOAD)
+		self.assertEqual(response['Content-Length'], str(len(response.content)))
+
+	def test_skip_small_or_incompressible(self):
+		"""Test if small bodies, images and clients without gzip are left as they are"""
+		responses = (
+			self.get(JsonResponse({'id': 1})),
+			self.get(HttpResponse(b'\x00' * 4096, content_type='image/png')),
+			self.get(JsonResponse(PAYLOAD, safe=False), accept_encoding=''),
+			self.get(JsonResponse(PAYLOAD, safe=False), accept_encoding='gzip;q=0, identity'),
+		)
+		for response in responses:
+			self.assertFalse(response.has_header('Content-Encoding'))
+
+	def test_skip_no_transform(self):
+		response = JsonResponse(PAYLOAD, safe=False)
+		response['Cache-Control'] = 'private, No-Transform'
+		self.assertFalse(self.get(response).has_header('Content-Encoding'))
+
+	def test_negotiate_encoding(self):
+		compressors = {'zstd': None, 'br': None, 'gzip': None}
+		self.assertEqual(negotiate_encoding('gzip, br', compressors), 'br')
+		self.assertEqual(negotiate_encoding('gzip, br;q=0.5', compressors), 'gzip')
+		self.assertEqual(negotiate_encoding('*', compressors), 'zstd')
+		self.assertIsNone(negotiate_encoding('deflate', compressors))
+
+	def test_cached_compressed_body(self):
+		"""Test if an identical body is only compressed once"""
+		middleware = CompressionMiddleware(lambda request: JsonResponse(PAYLOAD, safe=False))
+		middleware.compressors['gzip'] = Mock(side_effect=compress_gzip)
+		request = self.factory.get('/', HTTP_ACCEPT_ENCODING='gzip')
+
+		first = middleware(request)
+		second = middleware(request)
+
+		self.assertEqual(first.content, second.content)
+		self.assertEqual(middleware.compressors['gzip'].call_count, 1)
+		# Kept apart from the cache shared with idempotency records and throttling
+		self.assertIs(middleware.cache, caches['compression'])
+
+	def test_compress_streaming(self):
+		"""Test if streamed exports are gzipped on the fly with a weak ETag"""
+		response = StreamingHttpResponse((b'{"id": 1}\n' for _ in range(10)), content_type='application/x-ndjson')
+		response['ETag'] = '"abc"'
+		response = self.get(response)
+
+		self.assertEqual(response['Content-Encoding'], 'gzip')
+		self.assertEqual(response['ETag'], 'W/"abc"')
+		self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b'{"id": 1}\n' * 10)
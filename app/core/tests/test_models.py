@@ -1,14 +1,15 @@
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from core import models
+from core.tests.factories import mock_user
 from unittest.mock import patch
 
-def mock_user(email='test@test.com', password='helloworld'):
-	"""Create a mock user and save it into db"""
-	return get_user_model().objects.create(email=email, password=password)
-
 class ModelTests(TestCase):
 
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = mock_user()
+
 	def test_create_user_with_email_successful(self):
 		"""Test creating a new user with an email is successful"""
 		email = 'vinh@test.com'
@@ -48,7 +49,7 @@ class ModelTests(TestCase):
 	def test_tag_str(self):
 		"""Test tag string representation"""
 		tag = models.Tag.objects.create(
-			user=mock_user(),
+			user=self.user,
 			name='Vegan'
 		)
 		self.assertEqual(str(tag), tag.name)
@@ -57,7 +58,7 @@ class ModelTests(TestCase):
 	def test_recipe_str(self):
 		"""Test if we can create a new recipe"""
 		recipe = models.Recipe.objects.create(
-			user=mock_user(),
+			user=self.user,
 			title='Steak',
 			time_minute=5,
 			price=10
@@ -74,3 +75,21 @@ class ModelTests(TestCase):
 		file_path = models.get_recipe_image_path(None, 'myimage.jpg')
 
 		self.assertEqual(file_path, f'uploads/recipe/{uuid}.jpg')
+
+	def test_recipe_relations_carry_owner(self):
+		"""Test if tags/ingredients added to a recipe store the recipe owner"""
+		user = self.user
+		recipe = models.Recipe.objects.create(user=user, title='Steak', time_minute=5, price=10)
+		tag = models.Tag.objects.create(user=user, name='Meat')
+		ingredient = models.Ingredient.objects.create(user=user, name='Beef')
+		recipe.tags.add(tag)
+		recipe.ingredients.set([ingredient])
+		tag_2 = models.Tag.objects.create(user=user, name='Dinner')
+		models.RecipeTag.objects.create(recipe=recipe, tag=tag_2)
+
+		self.assertEqual(
+			set(models.RecipeTag.objects.values_list('user_id', flat=True)),
+			{user.id}
+		)
+		self.assertEqual(models.RecipeIngredient.objects.get().user_id, user.id)
+
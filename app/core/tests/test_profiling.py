@@ -0,0 +1,104 @@
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import profiling
+from core.models import ExpiringToken
+from core.tests.factories import mock_user
+
+PROFILES_URL = reverse('core:profiles')
+ME_URL = reverse('user:me')
+
+def profile_url(profile_id):
+	return reverse('core:profile', args=[profile_id])
+
+class ProfilingMiddlewareTests(TestCase):
+	"""Test sampling requests under the profiler"""
+	@classmethod
+	def setUpTestData(cls):
+		cls.staff = mock_user(email='staff@example.com', is_staff=True)
+		cls.user = mock_user()
+
+	def setUp(self):
+		profiling.profiles.clear()
+
+	def get_client(self, user):
+		"""The middleware chain reads PROFILING_* settings on the first request of a client"""
+		client = APIClient()
+		client.credentials(HTTP_AUTHORIZATION=f'Token {ExpiringToken.objects.rotate(user).key}')
+		return client
+
+	def test_disabled_by_default(self):
+		"""Test if no request is profiled unless profiling is enabled"""
+		with override_settings(PROFILING_SAMPLE_RATE=1):
+			self.get_client(self.staff).get(ME_URL, HTTP_X_PROFILE='1')
+		self.assertEqual(len(profiling.profiles), 0)
+
+	@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1, PROFILING_MODE='cprofile')
+	def test_sampled_request_cprofile(self):
+		"""Test if sampled requests keep their top functions and allocations"""
+		res = self.get_client(self.user).get(ME_URL)
+
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		profile, = profiling.profiles
+		self.assertEqual((profile['method'], profile['path'], profile['status']), ('GET', ME_URL, 200))
+		self.assertTrue(profile['functions'])
+		self.assertTrue(any('get_response' in row['function'] for row in profile['functions']))
+		self.assertTrue(profile['allocations'])
+
+	@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1, PROFILING_INTERVAL=0.0001)
+	def test_sampled_request_stacks(self):
+		"""Test if the stack sampler keeps the most seen stacks"""
+		self.get_client(self.user).get(ME_URL)
+
+		profile, = profiling.profiles
+		self.assertEqual(profile['mode'], 'sampling')
+		self.assertIn('stacks', profile)
+		self.assertNotIn('functions', profile)
+
+	@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=0, PROFILING_MODE='cprofile')
+	def test_header_requires_staff(self):
+		"""Test if the profiling header is only honoured for staff users"""
+		self.get_client(self.user).get(ME_URL, HTTP_X_PROFILE='1')
+		self.get_client(self.staff).get(ME_URL)
+		self.assertEqual(len(profiling.profiles), 0)
+
+		self.get_client(self.staff).get(ME_URL, HTTP_X_PROFILE='1')
+		self.assertEqual(len(profiling.profiles), 1)
+
+	@override_settings(
+		PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1, PROFILING_MODE='cprofile', PROFILING_BUFFER_SIZE=2,
+	)
+	def test_buffer_size(self):
+		"""Test if only the latest PROFILING_BUFFER_SIZE profiles are kept"""
+		client = self.get_client(self.user)
+		for _ in range(3):
+			client.get(ME_URL)
+
+		first, second = profiling.profiles
+		self.assertEqual(second['id'], first['id'] + 1)
+		# Listing while profiles are added does not iterate the buffer itself
+		for _ in profiling.profiles:
+			profiling.profiles.append({'id': 0})
+
+	@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1, PROFILING_MODE='cprofile')
+	def test_profiles_endpoint(self):
+		"""Test if staff users list and read profiles"""
+		client = self.get_client(self.staff)
+		client.get(ME_URL)
+
+		res = self.get_client(self.user).get(PROFILES_URL)
+		self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+		res = client.get(PROFILES_URL)
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		self.assertEqual(res.data[-1]['path'], ME_URL)
+		self.assertNotIn('functions', res.data[-1])
+
+		res = client.get(profile_url(res.data[-1]['id']))
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		self.assertTrue(res.data['functions'])
+
+		res = client.get(profile_url(0))
+		self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
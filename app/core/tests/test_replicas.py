@@ -0,0 +1,94 @@
+from unittest.mock import MagicMock, patch
+
+from django.core.cache import caches
+from django.db.utils import OperationalError
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import replicas
+from core.models import Recipe
+from core.tests.factories import mock_user
+
+router = replicas.ReplicaRouter()
+
+@override_settings(DATABASE_REPLICAS=['replica_0'], REPLICA_PIN_SECONDS=5)
+@patch('core.replicas.connections', MagicMock())
+class ReplicaRoutingTests(TestCase):
+	"""Test routing reads to replicas"""
+	def setUp(self):
+		caches['replica_pins'].clear()
+		replicas._down_until.clear()
+		self.factory = RequestFactory()
+		self.middleware = replicas.ReplicaRoutingMiddleware(self.read_database)
+
+	def read_database(self, request):
+		"""Fake view returning the database a read would go to"""
+		return router.db_for_read(Recipe)
+
+	def test_safe_request_reads_from_replica(self):
+		"""Test that GET requests read from a replica"""
+		request = self.factory.get('/api/recipe/recipes')
+		self.assertEqual(self.middleware(request), 'replica_0')
+
+	def test_unsafe_request_reads_from_primary(self):
+		"""Test that writes and their reads go to primary"""
+		request = self.factory.post('/api/recipe/recipes')
+		self.assertEqual(self.middleware(request), 'default')
+		self.assertEqual(router.db_for_write(Recipe), 'default')
+
+	def test_reads_outside_request_use_primary(self):
+		"""Test that reads outside of a request go to primary"""
+		self.assertEqual(router.db_for_read(Recipe), 'default')
+
+	def test_read_your_writes(self):
+		"""Test that a client reads from primary for a while after writing"""
+		self.middleware(self.factory.post('/api/recipe/recipes', HTTP_AUTHORIZATION='Token abc'))
+
+		request = self.factory.get('/api/recipe/recipes', HTTP_AUTHORIZATION='Token abc')
+		self.assertEqual(self.middleware(request), 'default')
+		request = self.factory.get('/api/recipe/recipes', HTTP_AUTHORIZATION='Token other')
+		self.assertEqual(self.middleware(request), 'replica_0')
+
+	def test_login_pins_new_token(self):
+		"""Test that a token issued by login reads from primary before replicas have it"""
+		mock_user(email='test@example.com', password='helloworld')
+		res = APIClient().post(reverse('user:token'), {'email': 'test@example.com', 'password': 'helloworld'})
+
+		request = self.factory.get('/api/user/me', HTTP_AUTHORIZATION=f'Token {res.data["token"]}')
+		self.assertEqual(self.middleware(request), 'default')
+
+	def test_pins_read_from_primary(self):
+		"""Test that the shared pin cache is not read from a lagging replica"""
+		self.assertEqual(router.db_for_read(caches['replica_pins'].cache_model_class), 'default')
+
+	def test_unavailable_replica_falls_back_to_primary(self):
+		"""Test that a replica refusing connections is skipped"""
+		replicas.connections['replica_0'].ensure_connection.side_effect = OperationalError
+		try:
+			request = self.factory.get('/api/recipe/recipes')
+			self.assertEqual(self.middleware(request), 'default')
+			self.assertIn('replica_0', replicas._down_until)
+		finally:
+			replicas.connections['replica_0'].ensure_connection.side_effect = None
+
+	def test_failed_replica_query_retried_on_primary(self):
+		"""Test that a request failing on a replica is run again on primary"""
+		databases = []
+		def view(request):
+			databases.append(router.db_for_read(Recipe))
+			if databases[-1] == 'replica_0':
+				raise OperationalError
+			return databases[-1]
+		request = self.factory.get('/api/recipe/recipes')
+		request.resolver_match = MagicMock(func=view, args=(), kwargs={})
+
+		def get_response(request):
+			try:
+				return view(request)
+			except OperationalError as error:
+				return self.middleware.process_exception(request, error)
+		self.middleware.get_response = get_response
+
+		self.assertEqual(self.middleware(request), 'default')
+		self.assertEqual(databases, ['replica_0', 'default'])
@@ -0,0 +1,10 @@
+from django.urls import path
+from core import views
+
+app_name = 'core'
+
+urlpatterns = [
+	path('batch', views.BatchView.as_view(), name='batch'),
+	path('profiles', views.ProfileListView.as_view(), name='profiles'),
+	path('profiles/<int:pk>', views.ProfileDetailView.as_view(), name='profile'),
+]
@@ -0,0 +1,153 @@
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connections
+from django.http import Http404
+from django.urls import Resolver404, resolve
+from rest_framework import permissions, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from core import profiling
+from core.authentication import ExpiringTokenAuthentication
+from core.serializers import BatchSerializer
+
+# Request metadata passed on to sub-requests, e.g. for throttling by client IP
+FORWARDED_META = (
+	'REMOTE_ADDR', 'SERVER_NAME', 'SERVER_PORT', 'SERVER_PROTOCOL',
+	'HTTP_HOST', 'HTTP_USER_AGENT', 'HTTP_X_FORWARDED_FOR',
+)
+
+def close_connections(pool_connections):
+	"""Close database connections of pool threads that exited, connections are per thread"""
+	for connection in pool_connections:
+		# The thread owning the connection is gone, nothing else uses it
+		connection.inc_thread_sharing()
+		try:
+			connection.close()
+		finally:
+			connection.dec_thread_sharing()
+
+class BatchView(APIView):
+	"""
+	Run many API requests in one round trip
+	- The batch is authenticated once, sub-requests reuse its user and token
+	- Sub-requests skip middleware and go straight to the resolved view
+	- With concurrent set, consecutive GET requests run in parallel threads
+	"""
+	authentication_classes = (ExpiringTokenAuthentication,)
+	permission_classes = (permissions.IsAuthenticated,)
+
+	def post(self, request):
+		serializer = BatchSerializer(data=request.data)
+		serializer.is_valid(raise_exception=True)
+		sub_requests = serializer.validated_data['requests']
+
+		read_count = sum(sub_request['method'] == 'GET' for sub_request in sub_requests)
+		if not serializer.validated_data['concurrent'] or not read_count:
+			responses = [self.dispatch_sub_request(request, sub_request) for sub_request in sub_requests]
+			return Response({'responses': responses}, status.HTTP_200_OK)
+
+		responses = []
+		reads = []
+		# Connection wrappers of each pool thread, closed once the pool shut down
+		pool_connections = []
+		try:
+			with ThreadPoolExecutor(
+				max_workers=min(settings.BATCH_MAX_WORKERS, read_count),
+				initializer=lambda: pool_connections.extend(connections.all()),
+			) as executor:
+				for sub_request in sub_requests + [None]:
+					if sub_request is not None and sub_request['method'] == 'GET':
+						reads.append(sub_request)
+						continue
+					# Writes wait for the reads before them, and the reads after them wait for the write
+					responses.extend(executor.map(lambda read: self.dispatch_sub_request(request, read), reads))
+					reads = []
+					if sub_request is not None:
+						responses.append(self.dispatch_sub_request(request, sub_request))
+		finally:
+			close_connections(pool_connections)
+		return Response({'responses': responses}, status.HTTP_200_OK)
+
+	def build_sub_request(self, request, sub_request):
+		"""Return a Django request for a sub-request, authenticated as the batch"""
+		url = urlsplit(sub_request['path'])
+		body = b''
+		if 'body' in sub_request:
+			body = json.dumps(sub_request['body']).encode()
+		# Headers go first so they never replace the metadata of the batch
+		environ = {
+			'HTTP_' + name.upper().replace('-', '_'): value
+			for name, value in sub_request['headers'].items()
+		}
+		environ.update({key: request.META[key] for key in FORWARDED_META if key in request.META})
+		environ.update({
+			'REQUEST_METHOD': sub_request['method'],
+			'PATH_INFO': url.path,
+			'QUERY_STRING': url.query,
+			'CONTENT_TYPE': 'application/json',
+			'CONTENT_LENGTH': str(len(body)),
+			'HTTP_ACCEPT': 'application/json',
+			'wsgi.input': io.BytesIO(body),
+			'wsgi.url_scheme': request.scheme,
+		})
+
+		django_request = WSGIRequest(environ)
+		# Picked up by DRF so sub-requests skip authentication
+		django_request._force_auth_user = request.user
+		django_request._force_auth_token = request.auth
+		return django_request
+
+	def dispatch_sub_request(self, request, sub_request):
+		"""Run a sub-request through its view, return its status and body"""
+		django_request = self.build_sub_request(request, sub_request)
+		try:
+			match = resolve(django_request.path_info)
+		except Resolver404:
+			return {'status': status.HTTP_404_NOT_FOUND, 'body': {'detail': 'Not found.'}}
+		django_request.resolver_match = match
+
+		response = match.func(django_request, *match.args, **match.kwargs)
+		if response.streaming:
+			return {
+				'status': status.HTTP_400_BAD_REQUEST,
+				'body': {'detail': 'Streaming responses are not supported in a batch.'},
+			}
+		if hasattr(response, 'render'):
+			response.render()
+
+		body = None
+		if response.content:
+			if response.get('Content-Type', '').startswith('application/json'):
+				body = json.loads(response.content)
+			else:
+				body = response.content.decode(response.charset)
+		return {'status': response.status_code, 'body': body}
+
+class ProfileListView(APIView):
+	"""List the request profiles kept by this process, newest first"""
+	authentication_classes = (ExpiringTokenAuthentication,)
+	permission_classes = (permissions.IsAdminUser,)
+
+	def get(self, request):
+		summaries = [
+			{key: value for key, value in profile.items() if key not in ('allocations', 'functions', 'stacks')}
+			for profile in reversed(profiling.profiles.snapshot())
+		]
+		return Response(summaries)
+
+class ProfileDetailView(APIView):
+	"""Show the top functions or stacks and allocation sites of a request profile"""
+	authentication_classes = (ExpiringTokenAuthentication,)
+	permission_classes = (permissions.IsAdminUser,)
+
+	def get(self, request, pk):
+		for profile in profiling.profiles:
+			if profile['id'] == pk:
+				return Response(profile)
+		raise Http404('Not found')
@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class RecipeConfig(AppConfig):
     name = 'recipe'
+
+    def ready(self):
+        from django.core import checks
+        from . import events, idempotency, pantry, similarity
+        checks.register(idempotency.check_idempotency_cache, checks.Tags.caches)
+        events.connect_signals()
+        pantry.connect_signals()
+        similarity.connect_signals()
@@ -0,0 +1,24 @@
+import random
+import statistics
+import time
+
+def generate_rows(count, tags=50, ingredients=500, tags_per_recipe=3, ingredients_per_recipe=8):
+	"""Yield random recipes in the import format"""
+	for index in range(count):
+		yield {
+			'title': f'Recipe {index}',
+			'price': f'{random.uniform(1, 100):.2f}',
+			'time_minute': random.randint(5, 180),
+			'tags': [f'tag {random.randrange(tags)}' for _ in range(tags_per_recipe)],
+			'ingredients': [f'ingredient {random.randrange(ingredients)}' for _ in range(ingredients_per_recipe)],
+		}
+
+def measure(func, repeat):
+	"""Call func repeat times, return (mean, p95) duration in milliseconds"""
+	durations = []
+	for _ in range(repeat):
+		started = time.perf_counter()
+		func()
+		durations.append((time.perf_counter() - started) * 1000)
+	durations.sort()
+	return statistics.mean(durations), durations[min(len(durations) - 1, int(len(durations) * 0.95))]
@@ -0,0 +1,180 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from rest_framework import exceptions
+
+from core import pubsub
+from core.authentication import ExpiringTokenAuthentication
+from core.models import Recipe, Tag, Ingredient, RecipeTag, RecipeIngredient
+from core.signals import positions_changed, soft_delete_changed
+
+EVENTS_PATH = '/api/recipe/events'
+PUSHED_MODELS = {Recipe: 'recipe', Tag: 'tag', Ingredient: 'ingredient'}
+# Sent by the stream when the subscriber fell behind, clients refetch everything
+RESYNC_EVENT = b'event: resync\ndata: {}\n\n'
+# Published for bulk writes changing many rows at once, also sent as a resync event
+RESYNC_MESSAGE = {'type': 'resync'}
+DISCONNECTED = object()
+
+def user_channel(user_id):
+	return f'user:{user_id}'
+
+def on_commit_publish(user_id, model, object_id, action):
+	"""Only push changes once they are committed"""
+	message = {'type': PUSHED_MODELS[model], 'id': object_id, 'action': action}
+	transaction.on_commit(lambda: pubsub.publish(user_channel(user_id), message))
+
+def on_commit_resync(user_id):
+	"""Ask the clients of an user to refetch everything once bulk writes are committed"""
+	transaction.on_commit(lambda: pubsub.publish(user_channel(user_id), RESYNC_MESSAGE))
+
+def object_saved(sender, instance, created, **kwargs):
+	if instance.deleted_at is not None:
+		action = 'deleted'
+	else:
+		action = 'created' if created else 'updated'
+	on_commit_publish(instance.user_id, sender, instance.id, action)
+
+def object_deleted(sender, instance, **kwargs):
+	# Purged rows were already pushed as deleted when they were soft deleted
+	if instance.deleted_at is None:
+		on_commit_publish(instance.user_id, sender, instance.id, 'deleted')
+
+def relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+	if action not in ('post_add', 'post_remove', 'post_clear', 'pre_clear'):
+		return
+	if not reverse:
+		# recipe.tags.add(...) / .remove(...) / .clear()
+		if action != 'pre_clear':
+			on_commit_publish(instance.user_id, Recipe, instance.id, 'updated')
+		return
+	# tag.recipe_set.add(...) / .remove(...) / .clear()
+	if action == 'post_clear':
+		return
+	if action == 'pre_clear':
+		pk_set = list(instance.recipe_set.values_list('id', flat=True))
+	for recipe_id in pk_set:
+		on_commit_publish(instance.user_id, Recipe, recipe_id, 'updated')
+
+def rows_soft_delete_changed(sender, user_ids, **kwargs):
+	if sender in PUSHED_MODELS:
+		for user_id in user_ids:
+			on_commit_resync(user_id)
+
+def positions_set(sender, instance, **kwargs):
+	on_commit_publish(instance.user_id, Recipe, instance.id, 'updated')
+
+def connect_signals():
+	"""
+	Other bulk writes such as QuerySet.update() send no signal, their callers
+	publish a resync with on_commit_resync(), see RecipeImporter.save
+	"""
+	soft_delete_changed.connect(rows_soft_delete_changed, dispatch_uid='events_soft_delete_changed')
+	positions_changed.connect(positions_set, sender=Recipe, dispatch_uid='events_positions_changed')
+	for model in PUSHED_MODELS:
+		post_save.connect(object_saved, sender=model, dispatch_uid=f'events_{model.__name__}_saved')
+		post_delete.connect(object_deleted, sender=model, dispatch_uid=f'events_{model.__name__}_deleted')
+	for model in (RecipeTag, RecipeIngredient):
+		m2m_changed.connect(relations_changed, sender=model, dispatch_uid=f'events_{model.__name__}')
+
+def authenticate(scope):
+	"""Return the user of the token in the Authorization header or the token parameter, EventSource cannot set headers"""
+	key = None
+	for name, value in scope['headers']:
+		if name == b'authorization':
+			scheme, _, key = value.decode('latin1').partition(' ')
+			if scheme.lower() != 'token':
+				key = None
+	if key is None:
+		key = parse_qs(scope['query_string'].decode('latin1')).get('token', [None])[0]
+	if not key:
+		return None
+	close_old_connections()
+	try:
+		user, _ = ExpiringTokenAuthentication().authenticate_credentials(key.strip())
+	except exceptions.AuthenticationFailed:
+		return None
+	finally:
+		close_old_connections()
+	return user
+
+def format_event(message):
+	return f'event: change\ndata: {json.dumps(message)}\n\n'.encode()
+
+class EventStream:
+	"""
+	ASGI app pushing changes of the recipes, tags and ingredients of an user as Server-Sent Events
+	- Each change is an event `change` with data {type, id, action}
+	- An event `resync` asks the client to refetch everything after bulk writes
+	- A comment is sent every EVENTS_HEARTBEAT seconds to keep proxies from closing the stream,
+	  the stream ends once the token expired or was rotated
+	- A subscriber falling more than PUBSUB_QUEUE_SIZE messages behind gets an event
+	  `resync` and the stream ends, the client refetches and reconnects
+	"""
+	async def __call__(self, scope, receive, send):
+		if scope['method'] != 'GET':
+			await self.send_error(send, 405, 'Method not allowed.')
+			return
+		user = await sync_to_async(authenticate)(scope)
+		if user is None:
+			await self.send_error(send, 401, 'Authentication credentials were not provided or are invalid.')
+			return
+
+		subscription = pubsub.get_broker().subscribe(user_channel(user.id))
+		watcher = asyncio.ensure_future(self.watch_disconnect(receive, subscription))
+		try:
+			await send({
+				'type': 'http.response.start',
+				'status': 200,
+				'headers': [
+					(b'content-type', b'text/event-stream'),
+					(b'cache-control', b'no-cache'),
+					# Stops nginx from buffering the stream
+					(b'x-accel-buffering', b'no'),
+				],
+			})
+			await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n', 'more_body': True})
+			await self.stream(scope, user, subscription, send)
+		finally:
+			watcher.cancel()
+			subscription.close()
+
+	async def stream(self, scope, user, subscription, send):
+		while True:
+			try:
+				message = await asyncio.wait_for(subscription.get(), settings.EVENTS_HEARTBEAT)
+			except asyncio.TimeoutError:
+				current_user = await sync_to_async(authenticate)(scope)
+				if current_user is None or current_user.id != user.id:
+					# The client reconnects and gets a 401
+					await send({'type': 'http.response.body', 'body': b''})
+					return
+				await send({'type': 'http.response.body', 'body': b': ping\n\n', 'more_body': True})
+				continue
+			if message is DISCONNECTED:
+				return
+			if message is pubsub.RESYNC:
+				await send({'type': 'http.response.body', 'body': RESYNC_EVENT})
+				return
+			if message == RESYNC_MESSAGE:
+				await send({'type': 'http.response.body', 'body': RESYNC_EVENT, 'more_body': True})
+				continue
+			await send({'type': 'http.response.body', 'body': format_event(message), 'more_body': True})
+
+	async def watch_disconnect(self, receive, subscription):
+		while (await receive())['type'] != 'http.disconnect':
+			pass
+		subscription.queue.put_nowait(DISCONNECTED)
+
+	async def send_error(self, send, status, detail):
+		await send({
+			'type': 'http.response.start',
+			'status': status,
+			'headers': [(b'content-type', b'application/json')],
+		})
+		await send({'type': 'http.response.body', 'body': json.dumps({'detail': detail}).encode()})
@@ -0,0 +1,88 @@
+import csv
+import json
+from collections import defaultdict
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from core.models import Recipe
+
+# Columns of an exported recipe, tags and ingredients are lists of names
+EXPORT_FIELDS = ('id', 'title', 'price', 'time_minute', 'link', 'tags', 'ingredients')
+EXPORT_FORMATS = {
+	'ndjson': 'application/x-ndjson',
+	'csv': 'text/csv',
+}
+EXPORT_CHUNK_SIZE = 500
+# Separator of tag/ingredient names in a CSV cell
+CSV_LIST_SEPARATOR = ';'
+
+def chunked(iterable, size):
+	"""Yield lists of at most size items from iterable"""
+	iterator = iter(iterable)
+	while True:
+		chunk = list(islice(iterator, size))
+		if not chunk:
+			return
+		yield chunk
+
+def get_names_by_recipe(field, user, recipe_ids):
+	"""Return {recipe_id: [name, ...]} of a M2M field for a batch of recipes of an user"""
+	through = getattr(Recipe, field).through
+	related = getattr(Recipe, field).field.m2m_reverse_field_name()
+	rows = (
+		through.objects
+		.filter(user=user, recipe_id__in=recipe_ids, **{f'{related}__deleted_at__isnull': True})
+		.order_by('position', 'id')
+		.values_list('recipe_id', f'{related}__name')
+	)
+	names = defaultdict(list)
+	for recipe_id, name in rows:
+		names[recipe_id].append(name)
+	return names
+
+def iter_recipes(user, chunk_size=EXPORT_CHUNK_SIZE):
+	"""
+	Yield recipes of an user as dicts
+	- Recipes are read with a server-side cursor, chunk_size rows at a time
+	- Tag and ingredient names are fetched with one query per chunk
+	"""
+	recipes = (
+		Recipe.objects
+		.filter(user=user)
+		.order_by('id')
+		.values('id', 'title', 'price', 'time_minute', 'link')
+		.iterator(chunk_size=chunk_size)
+	)
+	for chunk in chunked(recipes, chunk_size):
+		recipe_ids = [recipe['id'] for recipe in chunk]
+		tags = get_names_by_recipe('tags', user, recipe_ids)
+		ingredients = get_names_by_recipe('ingredients', user, recipe_ids)
+		for recipe in chunk:
+			recipe['tags'] = tags.get(recipe['id'], [])
+			recipe['ingredients'] = ingredients.get(recipe['id'], [])
+			yield recipe
+
+class Echo:
+	"""File-like object returning what is written, for streaming csv.writer output"""
+	def write(self, value):
+		return value
+
+def stream_ndjson(recipes):
+	for recipe in recipes:
+		yield json.dumps(recipe, cls=DjangoJSONEncoder) + '\n'
+
+def stream_csv(recipes):
+	writer = csv.writer(Echo())
+	yield writer.writerow(EXPORT_FIELDS)
+	for recipe in recipes:
+		recipe['tags'] = CSV_LIST_SEPARATOR.join(recipe['tags'])
+		recipe['ingredients'] = CSV_LIST_SEPARATOR.join(recipe['ingredients'])
+		yield writer.writerow([recipe[field] for field in EXPORT_FIELDS])
+
+def stream_export(user, export_format):
+	"""Return an iterator of encoded lines of all recipes of an user"""
+	recipes = iter_recipes(user)
+	if export_format == 'csv':
+		return stream_csv(recipes)
+	return stream_ndjson(recipes)
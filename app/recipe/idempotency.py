@@ -0,0 +1,114 @@
+import functools
+import hashlib
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework import status
+from rest_framework.response import Response
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# How long a key is locked while its first request is still running
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+
+# Set again by DRF when the response is rendered
+UNSTORED_HEADERS = ('content-type', 'content-length')
+
+def get_cache_key(request, key):
+	digest = hashlib.sha256(key.encode()).hexdigest()
+	return f'idempotency:{request.user.pk}:{digest}'
+
+def get_fingerprint(request):
+	"""
+	Identify a request by its user, endpoint and body
+	Multipart bodies are hashed from their parsed fields and files,
+	their boundary is random so the raw body differs on every retry.
+	Every value of repeated fields such as tags is hashed, not only the last one
+	"""
+	digest = hashlib.sha256()
+	if request.content_type.startswith('multipart/'):
+		for name, values in sorted(request.data.lists()):
+			for value in values:
+				digest.update(f'{name}='.encode())
+				if hasattr(value, 'chunks'):
+					for chunk in value.chunks():
+						digest.update(chunk)
+					value.seek(0)
+				else:
+					digest.update(str(value).encode())
+				digest.update(b'&')
+	else:
+		digest.update(request.body)
+	return f'{request.user.pk} {request.method} {request.path} {digest.hexdigest()}'
+
+def check_idempotency_cache(app_configs, **kwargs):
+	"""Refuse a per-process cache, a retry reaching another worker would run the write again"""
+	if isinstance(caches[settings.IDEMPOTENCY_CACHE], LocMemCache):
+		return [checks.Error(
+			f'IDEMPOTENCY_CACHE {settings.IDEMPOTENCY_CACHE!r} is a local-memory cache',
+			hint='Point it to a cache shared by all processes, such as memcached or a database cache',
+			id='recipe.E001',
+		)]
+	return []
+
+def idempotent(view_method):
+	"""
+	Replay the first response of a write for retries carrying the same Idempotency-Key
+	- Successful responses are kept in IDEMPOTENCY_CACHE for IDEMPOTENCY_TTL seconds
+	- Retries are answered with the stored status, body and headers such as Location
+	- A retry arriving while the first request still runs gets 409
+	- Reusing a key for another endpoint or another body gets 422
+	Requests without the header are not affected
+	"""
+	@functools.wraps(view_method)
+	def wrapper(self, request, *args, **kwargs):
+		key = request.META.get(IDEMPOTENCY_HEADER)
+		if not key:
+			return view_method(self, request, *args, **kwargs)
+		if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+			return Response({'detail': 'Idempotency-Key is too long'}, status.HTTP_400_BAD_REQUEST)
+
+		cache = caches[settings.IDEMPOTENCY_CACHE]
+		cache_key = get_cache_key(request, key)
+		fingerprint = get_fingerprint(request)
+		if not cache.add(cache_key, {'fingerprint': fingerprint, 'status': None}, IDEMPOTENCY_LOCK_TIMEOUT):
+			stored = cache.get(cache_key)
+			if stored is not None:
+				if stored['fingerprint'] != fingerprint:
+					return Response(
+						{'detail': 'Idempotency-Key was used for another request'},
+						status.HTTP_422_UNPROCESSABLE_ENTITY
+					)
+				if stored['status'] is None:
+					return Response(
+						{'detail': 'A request with this Idempotency-Key is in progress'},
+						status.HTTP_409_CONFLICT
+					)
+				headers = dict(stored['headers'], **{'Idempotent-Replayed': 'true'})
+				return Response(stored['data'], stored['status'], headers=headers)
+			# Evicted between add() and get(), take the key over
+			cache.set(cache_key, {'fingerprint': fingerprint, 'status': None}, IDEMPOTENCY_LOCK_TIMEOUT)
+
+		try:
+			response = view_method(self, request, *args, **kwargs)
+		except Exception:
+			cache.delete(cache_key)
+			raise
+
+		if status.is_success(response.status_code):
+			cache.set(cache_key, {
+				'fingerprint': fingerprint,
+				'status': response.status_code,
+				'data': response.data,
+				'headers': {
+					name: value for name, value in response.items()
+					if name.lower() not in UNSTORED_HEADERS
+				},
+			}, settings.IDEMPOTENCY_TTL)
+		else:
+			# Failed writes changed nothing, let the client retry them
+			cache.delete(cache_key)
+		return response
+	return wrapper
@@ -0,0 +1,173 @@
+import codecs
+import csv
+import json
+import time
+from itertools import islice
+
+from django.db import DatabaseError, connection, transaction
+from rest_framework import serializers
+
+from core.models import Tag, Ingredient, Recipe, RecipeTag, RecipeIngredient
+from .export import CSV_LIST_SEPARATOR, EXPORT_FORMATS, chunked
+from .events import on_commit_resync
+from .pantry import pantry_indexes
+from .similarity import similarity_indexes
+
+IMPORT_CHUNK_SIZE = 500
+
+class RecipeImportError(Exception):
+	"""Importing stopped at a row, every row before committed is saved"""
+	def __init__(self, message, row, committed):
+		super().__init__(message)
+		self.row = row
+		self.committed = committed
+
+class RecipeImportSerializer(serializers.Serializer):
+	"""Validate a single imported recipe, tags and ingredients are given by name"""
+	title = serializers.CharField(max_length=20)
+	price = serializers.DecimalField(max_digits=6, decimal_places=2)
+	time_minute = serializers.IntegerField()
+	link = serializers.CharField(max_length=255, required=False, allow_blank=True, default='')
+	tags = serializers.ListField(child=serializers.CharField(max_length=40), required=False, default=list)
+	ingredients = serializers.ListField(child=serializers.CharField(max_length=40), required=False, default=list)
+
+def parse_ndjson(lines):
+	for line in lines:
+		if line.strip():
+			yield json.loads(line)
+
+def parse_csv(lines):
+	for row in csv.DictReader(lines):
+		for field in ('tags', 'ingredients'):
+			row[field] = [name for name in (row.get(field) or '').split(CSV_LIST_SEPARATOR) if name]
+		yield row
+
+def parse_rows(file, import_format):
+	"""Lazily parse an uploaded file of exported recipes into dicts"""
+	if import_format not in EXPORT_FORMATS:
+		raise ValueError(f'Unknown format {import_format}')
+	lines = codecs.iterdecode(file, 'utf-8')
+	if import_format == 'csv':
+		return parse_csv(lines)
+	return parse_ndjson(lines)
+
+class RecipeImporter:
+	"""
+	Import recipes of an user in chunked transactions
+	- Each chunk of rows is validated, then saved in its own transaction
+	- Tags and ingredients are matched by name and created in bulk
+	- Recipes and their M2M rows are inserted with bulk_create
+	A failed import can be resumed by skipping the committed rows
+	"""
+	def __init__(self, user, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+		self.user = user
+		self.chunk_size = chunk_size
+		self.progress = progress
+		self.imported = 0
+		self.elapsed = 0
+		self.rows_read = 0
+
+	@property
+	def rows_per_second(self):
+		return self.imported / self.elapsed if self.elapsed else 0
+
+	def run(self, rows, skip=0):
+		"""Import rows after the first skip ones, return number of imported rows"""
+		started = time.perf_counter()
+		committed = skip
+		self.rows_read = 0
+		rows = islice(self.count_rows(rows), skip, None)
+		try:
+			for chunk in chunked(rows, self.chunk_size):
+				recipes = [self.validate(row, committed + index + 1) for index, row in enumerate(chunk)]
+				try:
+					with transaction.atomic():
+						self.save(recipes)
+				except DatabaseError as error:
+					# The chunk is rolled back as a whole, its first row is reported
+					raise RecipeImportError(str(error), committed + 1, committed)
+				committed += len(recipes)
+				self.imported += len(recipes)
+				if self.progress:
+					self.progress(committed)
+		except RecipeImportError as error:
+			error.committed = committed
+			raise
+		except (ValueError, csv.Error) as error:
+			# Malformed line in the file itself, right after the last row read
+			raise RecipeImportError(str(error), self.rows_read + 1, committed)
+		finally:
+			self.elapsed += time.perf_counter() - started
+			# bulk_create sends no post_save, clients refetch once instead of once per row
+			if committed > skip:
+				on_commit_resync(self.user.pk)
+		return self.imported
+
+	def count_rows(self, rows):
+		"""Yield rows, keeping the number of rows parsed so far in rows_read"""
+		for self.rows_read, row in enumerate(rows, 1):
+			yield row
+
+	def validate(self, row, row_number):
+		serializer = RecipeImportSerializer(data=row)
+		if not serializer.is_valid():
+			raise RecipeImportError(serializer.errors, row_number, None)
+		return serializer.validated_data
+
+	def resolve(self, model, names):
+		"""Return {name: id} for names, creating the missing ones in bulk"""
+		if not names:
+			return {}
+		queryset = model.objects.filter(user=self.user, name__in=names)
+		ids = dict(queryset.values_list('name', 'id'))
+		missing = names - ids.keys()
+		if missing:
+			model.objects.bulk_create(model(user=self.user, name=name) for name in missing)
+			ids.update(queryset.filter(name__in=missing).values_list('name', 'id'))
+		return ids
+
+	def create_recipes(self, recipes):
+		if connection.features.can_return_rows_from_bulk_insert:
+			return Recipe.objects.bulk_create(recipes, batch_size=self.chunk_size)
+		# Primary keys are only set by bulk_create when the backend returns them
+		for recipe in recipes:
+			recipe.save(force_insert=True)
+		return recipes
+
+	def save(self, rows):
+		tag_ids = self.resolve(Tag, {name for row in rows for name in row['tags']})
+		ingredient_ids = self.resolve(Ingredient, {name for row in rows for name in row['ingredients']})
+		recipes = self.create_recipes([
+			Recipe(
+				user=self.user,
+				title=row['title'],
+				price=row['price'],
+				time_minute=row['time_minute'],
+				link=row['link'],
+			)
+			for row in rows
+		])
+
+		recipe_tags = []
+		recipe_ingredients = []
+		for recipe, row in zip(recipes, rows):
+			# dict.fromkeys drops repeated names but keeps their order
+			recipe_tags.extend(
+				RecipeTag(recipe_id=recipe.id, tag_id=tag_ids[name], user_id=self.user.pk, position=position)
+				for position, name in enumerate(dict.fromkeys(row['tags']))
+			)
+			recipe_ingredients.extend(
+				RecipeIngredient(
+					recipe_id=recipe.id,
+					ingredient_id=ingredient_ids[name],
+					user_id=self.user.pk,
+					position=position,
+				)
+				for position, name in enumerate(dict.fromkeys(row['ingredients']))
+			)
+		RecipeTag.objects.bulk_create(recipe_tags, batch_size=self.chunk_size)
+		RecipeIngredient.objects.bulk_create(recipe_ingredients, batch_size=self.chunk_size)
+		# bulk_create sends no M2M signals
+		links = [(link.recipe_id, link.ingredient_id) for link in recipe_ingredients]
+		transaction.on_commit(lambda: pantry_indexes.add_links(self.user.pk, links))
+		transaction.on_commit(lambda: similarity_indexes.invalidate(self.user.pk))
@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+# Builds of different users run in parallel, builds hashing to the same lock wait
+BUILD_LOCKS = 64
+
+class UserIndexes:
+	"""
+	Per user indexes of this process, least recently used ones dropped first
+	- Built lazily by `build(user_id)`, one build at a time per user
+	- Updates arriving while an index is built are replayed on it once built,
+	  an invalidation during a build keeps the result out of the cache
+	- Rebuilt after the `ttl_setting` seconds, at most `size_setting` users are kept
+	"""
+	def __init__(self, build, ttl_setting, size_setting):
+		self.build = build
+		self.ttl_setting = ttl_setting
+		self.size_setting = size_setting
+		self._indexes = OrderedDict()
+		# {user_id: [(method, args)] of updates to replay, None once invalidated}
+		self._pending = {}
+		self._lock = threading.Lock()
+		self._build_locks = [threading.Lock() for _ in range(BUILD_LOCKS)]
+
+	def _get_fresh(self, user_id):
+		"""Return the cached index of an user unless it expired, call with the lock held"""
+		index = self._indexes.get(user_id)
+		if index is None or time.monotonic() - index.built_at >= getattr(settings, self.ttl_setting):
+			return None
+		self._indexes.move_to_end(user_id)
+		return index
+
+	def get(self, user_id):
+		with self._lock:
+			index = self._get_fresh(user_id)
+		if index is not None:
+			return index
+
+		with self._build_locks[hash(user_id) % BUILD_LOCKS]:
+			with self._lock:
+				# Built by another thread while this one waited
+				index = self._get_fresh(user_id)
+				if index is not None:
+					return index
+				self._pending[user_id] = []
+			try:
+				index = self.build(user_id)
+			finally:
+				with self._lock:
+					pending = self._pending.pop(user_id)
+			with self._lock:
+				if pending is not None:
+					for method, args in pending:
+						getattr(index, method)(*args)
+					self._indexes[user_id] = index
+					while len(self._indexes) > getattr(settings, self.size_setting):
+						self._indexes.popitem(last=False)
+			return index
+
+	def update(self, user_id, method, *args):
+		"""Apply a change to the index of an user if it is built or being built"""
+		with self._lock:
+			index = self._indexes.get(user_id)
+			if index is not None:
+				getattr(index, method)(*args)
+			pending = self._pending.get(user_id)
+			if pending is not None:
+				pending.append((method, args))
+
+	def invalidate(self, user_id=None):
+		with self._lock:
+			if user_id is None:
+				self._indexes.clear()
+				for building in self._pending:
+					self._pending[building] = None
+			else:
+				self._indexes.pop(user_id, None)
+				if user_id in self._pending:
+					self._pending[user_id] = None
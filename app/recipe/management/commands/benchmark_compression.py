@@ -0,0 +1,51 @@
+import gzip
+import hashlib
+import json
+
+from django.core.management.base import BaseCommand
+
+from core.middleware import brotli, zstandard
+from recipe.benchmark import generate_rows, measure
+
+class Command(BaseCommand):
+	help = 'Measure CPU time against bytes saved when compressing recipe list payloads'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--sizes', default='10,100,1000,10000', help='Recipes per payload')
+		parser.add_argument('--repeat', type=int, default=20)
+
+	def get_compressors(self):
+		"""Return {name: compress function} for the levels worth comparing"""
+		compressors = {
+			f'gzip-{level}': lambda content, level=level: gzip.compress(content, compresslevel=level, mtime=0)
+			for level in (1, 6, 9)
+		}
+		if brotli is not None:
+			for quality in (1, 5, 11):
+				compressors[f'br-{quality}'] = lambda content, quality=quality: brotli.compress(content, quality=quality)
+		if zstandard is not None:
+			for level in (1, 3, 19):
+				compressors[f'zstd-{level}'] = (
+					lambda content, level=level: zstandard.ZstdCompressor(level=level).compress(content)
+				)
+		return compressors
+
+	def handle(self, *args, **options):
+		compressors = self.get_compressors()
+		for size in (int(size) for size in options['sizes'].split(',')):
+			rows = list(generate_rows(size))
+			for index, row in enumerate(rows):
+				row['id'] = index
+			payload = json.dumps(rows).encode()
+			self.stdout.write(f'{size} recipes, {len(payload)} bytes')
+
+			# What a cache hit costs instead of compressing again
+			mean, _ = measure(lambda: hashlib.sha256(payload).hexdigest(), options['repeat'])
+			self.stdout.write(f'  {"cache key":10} {mean:8.3f} ms')
+			for name, compress in compressors.items():
+				compressed = compress(payload)
+				mean, p95 = measure(lambda: compress(payload), options['repeat'])
+				self.stdout.write(
+					f'  {name:10} {mean:8.3f} ms  p95 {p95:8.3f} ms  '
+					f'{len(compressed):9} bytes  ratio {len(payload) / len(compressed):5.1f}'
+				)
@@ -0,0 +1,33 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipe.benchmark import generate_rows
+from recipe.importer import IMPORT_CHUNK_SIZE, RecipeImporter
+
+class Rollback(Exception):
+	pass
+
+class Command(BaseCommand):
+	help = 'Measure import throughput in rows/second on generated recipes, nothing is kept'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--rows', type=int, default=10000)
+		parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+		parser.add_argument('--tags', type=int, default=50, help='Distinct tag names')
+		parser.add_argument('--ingredients', type=int, default=500, help='Distinct ingredient names')
+
+	def handle(self, *args, **options):
+		importer = RecipeImporter(None, chunk_size=options['chunk_size'])
+		rows = generate_rows(options['rows'], options['tags'], options['ingredients'])
+		try:
+			with transaction.atomic():
+				importer.user = get_user_model().objects.create_user(email='benchmark-import@example.com')
+				importer.run(rows)
+				raise Rollback
+		except Rollback:
+			pass
+		self.stdout.write(
+			f'{importer.imported} rows, chunk size {options["chunk_size"]}: '
+			f'{importer.elapsed:.2f}s, {importer.rows_per_second:.0f} rows/second'
+		)
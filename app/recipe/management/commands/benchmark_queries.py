@@ -0,0 +1,81 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Avg, Count
+
+from core.models import Recipe, RecipeTag, RecipeIngredient
+from recipe.benchmark import generate_rows, measure
+from recipe.importer import RecipeImporter
+from recipe.pantry import PantryIndex
+
+BENCHMARK_EMAIL = 'benchmark-{}@example.com'
+
+class Command(BaseCommand):
+	help = 'Time the per-user recipe queries of the API, optionally seeding benchmark users first'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--seed-users', type=int, default=0, help='Benchmark users to create first')
+		parser.add_argument('--recipes', type=int, default=10000, help='Recipes of each seeded user')
+		parser.add_argument('--repeat', type=int, default=20)
+		parser.add_argument('--explain', action='store_true', help='Print query plans')
+		parser.add_argument('--pantry-size', type=int, default=30, help='Ingredients at hand for pantry matching')
+
+	def seed(self, options):
+		existing = get_user_model().objects.filter(email__startswith='benchmark-').count()
+		for index in range(existing, existing + options['seed_users']):
+			user = get_user_model().objects.create_user(email=BENCHMARK_EMAIL.format(index))
+			RecipeImporter(user, chunk_size=1000).run(generate_rows(options['recipes']))
+			self.stdout.write(f'Seeded {user.email} with {options["recipes"]} recipes')
+
+	def get_queries(self, user):
+		"""Return the queries behind the recipe endpoints for an user"""
+		recipes = Recipe.objects.filter(user=user)
+		tag_id = RecipeTag.objects.filter(user=user).values_list('tag_id', flat=True).first()
+		return {
+			'list first page': recipes.order_by('title', 'id')[:50],
+			'price range': recipes.filter(price__lte=10).order_by('price', 'id')[:50],
+			'time range': recipes.filter(time_minute__lte=30).order_by('time_minute', 'id')[:50],
+			'filter by tag': recipes.filter(
+				id__in=RecipeTag.objects.filter(user=user, tag_id=tag_id).values('recipe_id')
+			).order_by('title', 'id')[:50],
+			'stats': recipes.values('user').annotate(
+				recipe_count=Count('id'), average_price=Avg('price')
+			),
+		}
+
+	def handle(self, *args, **options):
+		if options['seed_users']:
+			self.seed(options)
+
+		users = list(get_user_model().objects.filter(email__startswith='benchmark-'))
+		if not users:
+			self.stdout.write('No benchmark users, run with --seed-users first')
+			return
+		total = Recipe.objects.count()
+		self.stdout.write(f'{len(users)} benchmark users, {total} recipes in total')
+
+		for name, queryset in self.get_queries(users[0]).items():
+			if options['explain']:
+				self.stdout.write(queryset.explain())
+		for name in self.get_queries(users[0]):
+			mean, p95 = measure(
+				lambda: list(self.get_queries(random.choice(users))[name]),
+				options['repeat']
+			)
+			self.stdout.write(f'{name:20} mean {mean:8.2f} ms  p95 {p95:8.2f} ms')
+
+		user = users[0]
+		started = time.perf_counter()
+		index = PantryIndex.build(user.pk)
+		self.stdout.write(f'{"pantry index build":20} {(time.perf_counter() - started) * 1000:8.2f} ms  {len(index.recipes)} recipes')
+		ingredient_ids = list(
+			RecipeIngredient.objects.filter(user=user).values_list('ingredient_id', flat=True).distinct()
+		)
+		for missing in (0, 2):
+			mean, p95 = measure(
+				lambda: index.match(random.sample(ingredient_ids, min(options['pantry_size'], len(ingredient_ids))), missing),
+				options['repeat']
+			)
+			self.stdout.write(f'{f"pantry missing<={missing}":20} mean {mean:8.2f} ms  p95 {p95:8.2f} ms')
@@ -0,0 +1,92 @@
+import heapq
+import random
+from collections import defaultdict
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from recipe.benchmark import measure
+from recipe.similarity import SIMILARITY_WEIGHTS, Incidence, SimilarityIndex
+
+class Command(BaseCommand):
+	help = 'Time similar recipe lookups of the NumPy index against a naive Python loop'
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			'--synthetic', type=int, default=0,
+			help='Use this many random in-memory recipes instead of the first benchmark user',
+		)
+		parser.add_argument('--limit', type=int, default=10)
+		parser.add_argument('--repeat', type=int, default=20)
+
+	def synthetic(self, count, tags=50, ingredients=500, tags_per_recipe=3, ingredients_per_recipe=8):
+		"""Return an index and the link pairs of random recipes"""
+		recipe_ids = np.arange(1, count + 1, dtype=np.int64)
+		links = []
+		for features, per_recipe in ((tags, tags_per_recipe), (ingredients, ingredients_per_recipe)):
+			links.append([
+				(recipe_id, feature)
+				for recipe_id in range(1, count + 1)
+				for feature in set(random.randrange(features) for _ in range(per_recipe))
+			])
+		incidences = [
+			(Incidence(recipe_ids, pairs), weight)
+			for pairs, (_, _, weight) in zip(links, SIMILARITY_WEIGHTS)
+		]
+		return SimilarityIndex(recipe_ids, incidences), links
+
+	def from_database(self):
+		user = get_user_model().objects.filter(email__startswith='benchmark-').first()
+		if user is None:
+			return None, None
+		links = [
+			list(model.objects.filter(user=user).values_list('recipe_id', f'{field}_id'))
+			for model, field, _ in SIMILARITY_WEIGHTS
+		]
+		return SimilarityIndex.build(user.pk), links
+
+	def naive_similar(self, features, recipe_id, limit):
+		"""Weighted Jaccard against every recipe, one set operation at a time"""
+		total_weight = sum(weight for _, _, weight in SIMILARITY_WEIGHTS)
+		scores = []
+		for other_id in features[0]:
+			if other_id == recipe_id:
+				continue
+			score = 0
+			for by_recipe, (_, _, weight) in zip(features, SIMILARITY_WEIGHTS):
+				own, other = by_recipe[recipe_id], by_recipe[other_id]
+				union = len(own | other)
+				if union:
+					score += weight * len(own & other) / union
+			if score:
+				scores.append((score / total_weight, other_id))
+		return heapq.nlargest(limit, scores)
+
+	def handle(self, *args, **options):
+		if options['synthetic']:
+			index, links = self.synthetic(options['synthetic'])
+		else:
+			index, links = self.from_database()
+			if index is None:
+				self.stdout.write('No benchmark users, run benchmark_queries --seed-users first or pass --synthetic')
+				return
+
+		recipe_ids = [int(recipe_id) for recipe_id in index.recipe_ids]
+		features = []
+		for pairs in links:
+			by_recipe = defaultdict(set)
+			for recipe_id in recipe_ids:
+				by_recipe[recipe_id] = set()
+			for recipe_id, feature in pairs:
+				by_recipe[recipe_id].add(feature)
+			features.append(by_recipe)
+		self.stdout.write(f'{len(recipe_ids)} recipes')
+
+		limit = options['limit']
+		for name, similar in (
+			('numpy', lambda: index.similar(random.choice(recipe_ids), limit)),
+			('naive loop', lambda: self.naive_similar(features, random.choice(recipe_ids), limit)),
+		):
+			mean, p95 = measure(similar, options['repeat'])
+			self.stdout.write(f'{name:12} mean {mean:8.2f} ms  p95 {p95:8.2f} ms')
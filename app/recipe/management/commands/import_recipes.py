@@ -0,0 +1,43 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from recipe.export import EXPORT_FORMATS
+from recipe.importer import IMPORT_CHUNK_SIZE, RecipeImporter, RecipeImportError, parse_rows
+
+class Command(BaseCommand):
+	help = 'Import recipes of an user from an NDJSON or CSV export'
+
+	def add_arguments(self, parser):
+		parser.add_argument('email')
+		parser.add_argument('path')
+		parser.add_argument('--type', choices=EXPORT_FORMATS, help='Defaults to the file extension')
+		parser.add_argument('--skip', type=int, default=0, help='Number of rows already committed')
+		parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+
+	def handle(self, *args, **options):
+		try:
+			user = get_user_model().objects.get(email=options['email'])
+		except get_user_model().DoesNotExist:
+			raise CommandError(f'User {options["email"]} does not exist')
+
+		import_format = options['type'] or options['path'].rsplit('.', 1)[-1]
+		if import_format not in EXPORT_FORMATS:
+			raise CommandError(f'Unknown format {import_format}, use --type')
+
+		importer = RecipeImporter(
+			user,
+			chunk_size=options['chunk_size'],
+			progress=lambda committed: self.stdout.write(f'{committed} rows committed'),
+		)
+		with open(options['path'], 'rb') as file:
+			try:
+				importer.run(parse_rows(file, import_format), skip=options['skip'])
+			except RecipeImportError as error:
+				raise CommandError(
+					f'Row {error.row}: {error.args[0]}. '
+					f'Resume with --skip {error.committed}'
+				)
+		self.stdout.write(self.style.SUCCESS(
+			f'Imported {importer.imported} recipes in {importer.elapsed:.2f}s '
+			f'({importer.rows_per_second:.0f} rows/second)'
+		))
@@ -0,0 +1,18 @@
+from rest_framework import pagination
+
+class RecipeCursorPagination(pagination.CursorPagination):
+	"""
+	Keyset pagination over the ordering chosen by RecipeViewSet
+	Only used when the client asks for it with page_size,
+	otherwise the full list is returned as before
+	"""
+	page_size_query_param = 'page_size'
+	max_page_size = 100
+
+	def paginate_queryset(self, queryset, request, view=None):
+		if self.page_size_query_param not in request.query_params:
+			return None
+		return super().paginate_queryset(queryset, request, view)
+
+	def get_ordering(self, request, queryset, view):
+		return view.get_ordering()
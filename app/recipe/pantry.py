@@ -0,0 +1,168 @@
+import threading
+import time
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete
+
+from core.models import Recipe, Ingredient, RecipeIngredient
+from core.signals import soft_delete_changed
+from .indexes import UserIndexes
+
+def popcount(mask):
+	return bin(mask).count('1')
+
+class PantryIndex:
+	"""
+	Ingredients of every recipe of an user as bitsets
+	- Each ingredient id is given a bit, each recipe is an int with the bits of its ingredients
+	- A pantry is matched against all recipes with a few integer operations per recipe
+	- Updates come from commit hooks of other threads, matches work on a snapshot
+	"""
+	def __init__(self):
+		self.bits = {}
+		self.ids = []
+		self.recipes = {}
+		self.built_at = time.monotonic()
+		self._lock = threading.Lock()
+
+	@classmethod
+	def build(cls, user_id):
+		"""Build the index of an user from a single scan of the (user_id, ingredient_id) index"""
+		index = cls()
+		rows = (
+			RecipeIngredient.objects
+			.filter(user_id=user_id, recipe__deleted_at__isnull=True, ingredient__deleted_at__isnull=True)
+			.values_list('recipe_id', 'ingredient_id')
+		)
+		for recipe_id, ingredient_id in rows.iterator():
+			index.add(recipe_id, [ingredient_id])
+		return index
+
+	def bit(self, ingredient_id):
+		"""Return the bit of an ingredient, giving it the next free one if it is new"""
+		bit = self.bits.get(ingredient_id)
+		if bit is None:
+			bit = self.bits[ingredient_id] = 1 << len(self.ids)
+			self.ids.append(ingredient_id)
+		return bit
+
+	def mask(self, ingredient_ids):
+		"""Return the bitset of ingredients, ids unknown to the index are ignored"""
+		mask = 0
+		for ingredient_id in ingredient_ids:
+			mask |= self.bits.get(ingredient_id, 0)
+		return mask
+
+	def add(self, recipe_id, ingredient_ids):
+		with self._lock:
+			mask = self.recipes.get(recipe_id, 0)
+			for ingredient_id in ingredient_ids:
+				mask |= self.bit(ingredient_id)
+			self.recipes[recipe_id] = mask
+
+	def add_links(self, links):
+		"""Add (recipe_id, ingredient_id) pairs"""
+		for recipe_id, ingredient_id in links:
+			self.add(recipe_id, [ingredient_id])
+
+	def remove(self, recipe_id, ingredient_ids):
+		with self._lock:
+			if recipe_id in self.recipes:
+				self.recipes[recipe_id] &= ~self.mask(ingredient_ids)
+
+	def discard(self, recipe_id):
+		with self._lock:
+			self.recipes.pop(recipe_id, None)
+
+	def match(self, ingredient_ids, missing=0):
+		"""
+		Return [(recipe_id, missing_mask, coverage)] of recipes missing at most `missing` ingredients
+		- Sorted by fewest missing ingredients, then best coverage
+		- Recipes without ingredients are left out
+		"""
+		with self._lock:
+			pantry = self.mask(ingredient_ids)
+			recipes = list(self.recipes.items())
+		matches = []
+		for recipe_id, mask in recipes:
+			if not mask:
+				continue
+			missing_mask = mask & ~pantry
+			if missing_mask and not missing:
+				continue
+			missing_count = popcount(missing_mask)
+			if missing_count > missing:
+				continue
+			total = popcount(mask)
+			matches.append((missing_count, -(total - missing_count) / total, recipe_id, missing_mask))
+		matches.sort()
+		return [(recipe_id, missing_mask, -coverage) for _, coverage, recipe_id, missing_mask in matches]
+
+	def ingredient_ids(self, mask):
+		"""Return ingredient ids whose bits are set in a mask"""
+		ids = []
+		while mask:
+			bit = mask & -mask
+			ids.append(self.ids[bit.bit_length() - 1])
+			mask ^= bit
+		return ids
+
+class PantryIndexes(UserIndexes):
+	"""
+	Per user pantry indexes of this process
+	- Built lazily on the first match of an user
+	- Kept up to date from M2M signals, rebuilt after PANTRY_INDEX_TTL seconds to
+	  pick up changes made by other processes
+	- At most PANTRY_INDEX_MAX_USERS users are kept
+	"""
+	def __init__(self):
+		super().__init__(PantryIndex.build, 'PANTRY_INDEX_TTL', 'PANTRY_INDEX_MAX_USERS')
+
+	def add_links(self, user_id, links):
+		"""Add (recipe_id, ingredient_id) pairs created without M2M signals, e.g. by bulk_create"""
+		self.update(user_id, 'add_links', links)
+
+pantry_indexes = PantryIndexes()
+
+def on_commit_update(user_id, method, *args):
+	"""Only apply changes to the index once they are committed"""
+	transaction.on_commit(lambda: pantry_indexes.update(user_id, method, *args))
+
+def recipe_ingredients_changed(sender, instance, action, reverse, pk_set, **kwargs):
+	if action not in ('post_add', 'post_remove', 'pre_clear'):
+		return
+	method = 'add' if action == 'post_add' else 'remove'
+	if not reverse:
+		# recipe.ingredients.add(...) / .remove(...) / .clear()
+		if action == 'pre_clear':
+			pk_set = list(instance.ingredients.values_list('id', flat=True))
+		on_commit_update(instance.user_id, method, instance.id, list(pk_set))
+		return
+	# ingredient.recipe_set.add(...) / .remove(...) / .clear()
+	if action == 'pre_clear':
+		pk_set = list(instance.recipe_set.values_list('id', flat=True))
+	for recipe_id in pk_set:
+		on_commit_update(instance.user_id, method, recipe_id, [instance.id])
+
+def recipe_saved(sender, instance, created, **kwargs):
+	if instance.deleted_at is not None:
+		on_commit_update(instance.user_id, 'discard', instance.id)
+
+def recipe_deleted(sender, instance, **kwargs):
+	on_commit_update(instance.user_id, 'discard', instance.id)
+
+def ingredient_saved(sender, instance, created, **kwargs):
+	if instance.deleted_at is not None:
+		transaction.on_commit(lambda: pantry_indexes.invalidate(instance.user_id))
+
+def rows_soft_delete_changed(sender, user_ids, **kwargs):
+	if sender in (Recipe, Ingredient):
+		for user_id in user_ids:
+			transaction.on_commit(lambda user_id=user_id: pantry_indexes.invalidate(user_id))
+
+def connect_signals():
+	soft_delete_changed.connect(rows_soft_delete_changed, dispatch_uid='pantry_soft_delete_changed')
+	m2m_changed.connect(recipe_ingredients_changed, sender=RecipeIngredient, dispatch_uid='pantry_m2m')
+	post_save.connect(recipe_saved, sender=Recipe, dispatch_uid='pantry_recipe_saved')
+	post_delete.connect(recipe_deleted, sender=Recipe, dispatch_uid='pantry_recipe_deleted')
+	post_save.connect(ingredient_saved, sender=Ingredient, dispatch_uid='pantry_ingredient_saved')
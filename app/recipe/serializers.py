@@ -1,16 +1,36 @@
+from django.db.models import Prefetch, prefetch_related_objects
 from rest_framework import serializers
 from core.models import Tag, Ingredient, Recipe
+from .shopping import SHOPPING_LIST_MAX_RECIPES
+
+# Largest id of an integer primary key column
+MAX_ID = 2 ** 31 - 1
+
+def get_ordered_relations():
+	"""Prefetch tags and ingredients of recipes in the order they were given, see Recipe.set_positions"""
+	return (
+		Prefetch('tags', queryset=Tag.objects.order_by('recipetag__position', 'recipetag__id')),
+		Prefetch('ingredients', queryset=Ingredient.objects.order_by(
+			'recipeingredient__position', 'recipeingredient__id'
+		)),
+	)
 
 class TagSerializer(serializers.ModelSerializer):
+	# Annotated by BaseRecipeViewSet.get_queryset
+	recipe_count = serializers.IntegerField(read_only=True, default=0)
+
 	class Meta:
 		model = Tag
-		fields = ('id', 'name',)
+		fields = ('id', 'name', 'recipe_count')
 		read_only_fields = ('id',)
 
 class IngredientSerializer(serializers.ModelSerializer):
+	# Annotated by BaseRecipeViewSet.get_queryset
+	recipe_count = serializers.IntegerField(read_only=True, default=0)
+
 	class Meta:
 		model = Ingredient
-		fields = ('id', 'name',)
+		fields = ('id', 'name', 'recipe_count')
 		read_only_fields = ('id',)
 
 class RecipeSerializer(serializers.ModelSerializer):
@@ -28,6 +48,16 @@ class RecipeSerializer(serializers.ModelSerializer):
 		fields = ('id', 'title', 'price', 'time_minute', 'link', 'ingredients', 'tags')
 		read_only_fields = ('id',)
 
+	def save(self, **kwargs):
+		"""Save recipe, then store the order tags/ingredients were given in"""
+		recipe = super().save(**kwargs)
+		for field in ('tags', 'ingredients'):
+			if field in self.validated_data:
+				recipe.set_positions(field, [obj.pk for obj in self.validated_data[field]])
+		# The response lists relations in their stored order too
+		prefetch_related_objects([recipe], *get_ordered_relations())
+		return recipe
+
 class RecipeDetailSerializer(RecipeSerializer):
 	"""Serializer a recipe detail"""
 	ingredients = IngredientSerializer(many=True, read_only=True)
@@ -37,4 +67,43 @@ class RecipeImageSerializer(serializers.ModelSerializer):
 	class Meta:
 		model = Recipe
 		fields = ('id', 'image')
-		read_only_fields = ('id',)
\ No newline at end of file
+		read_only_fields = ('id',)
+
+class UsageSerializer(serializers.Serializer):
+	"""Serialize a tag or an ingredient with the number of recipes using it"""
+	id = serializers.IntegerField()
+	name = serializers.CharField()
+	recipe_count = serializers.IntegerField()
+
+class RecipeStatsSerializer(serializers.Serializer):
+	"""Serialize aggregated statistics of an user's recipes"""
+	recipe_count = serializers.IntegerField()
+	average_price = serializers.DecimalField(max_digits=8, decimal_places=2, allow_null=True)
+	average_time_minute = serializers.FloatField(allow_null=True)
+	top_tags = UsageSerializer(many=True)
+	top_ingredients = UsageSerializer(many=True)
+
+class PantryMatchSerializer(serializers.Serializer):
+	"""Serialize a recipe matched against a pantry, with the ingredients it still needs"""
+	recipe = RecipeSerializer()
+	missing = serializers.ListField(child=serializers.IntegerField())
+	coverage = serializers.FloatField()
+
+class SimilarRecipeSerializer(serializers.Serializer):
+	"""Serialize a recipe with its similarity to another one"""
+	recipe = RecipeSerializer()
+	score = serializers.FloatField()
+
+class ShoppingListRequestSerializer(serializers.Serializer):
+	"""Validate the recipe ids a shopping list is built from"""
+	recipes = serializers.ListField(
+		child=serializers.IntegerField(min_value=1, max_value=MAX_ID),
+		max_length=SHOPPING_LIST_MAX_RECIPES,
+	)
+
+class ShoppingListSerializer(serializers.Serializer):
+	"""Serialize ingredients needed by a set of recipes, with their totals"""
+	recipe_count = serializers.IntegerField()
+	total_price = serializers.DecimalField(max_digits=12, decimal_places=2)
+	total_time_minute = serializers.IntegerField()
+	ingredients = UsageSerializer(many=True)
@@ -0,0 +1,50 @@
+from django.db.models import Count, Sum
+
+from core.models import Recipe, RecipeIngredient
+from .export import EXPORT_CHUNK_SIZE, stream_ndjson
+
+# Recipes a shopping list can be built from in one request
+SHOPPING_LIST_MAX_RECIPES = 1000
+
+def get_shopping_list_items(user, recipe_ids):
+	"""
+	Return ingredients of recipes of an user with the number of recipes needing each
+	- One GROUP BY over the relation table, scoped by its user_id
+	- Deleted recipes and ingredients are left out
+	"""
+	return (
+		RecipeIngredient.objects
+		.filter(
+			user=user,
+			recipe_id__in=recipe_ids,
+			recipe__deleted_at__isnull=True,
+			ingredient__deleted_at__isnull=True,
+		)
+		.values('ingredient_id', 'ingredient__name')
+		.annotate(recipe_count=Count('recipe_id'))
+		.order_by('ingredient__name', 'ingredient_id')
+	)
+
+def get_shopping_list_totals(user, recipe_ids):
+	"""Return the number of recipes found, with their total price and time"""
+	totals = Recipe.objects.filter(user=user, id__in=recipe_ids).aggregate(
+		recipe_count=Count('id'),
+		total_price=Sum('price'),
+		total_time_minute=Sum('time_minute'),
+	)
+	totals['total_price'] = totals['total_price'] or 0
+	totals['total_time_minute'] = totals['total_time_minute'] or 0
+	return totals
+
+def format_item(item):
+	return {
+		'id': item['ingredient_id'],
+		'name': item['ingredient__name'],
+		'recipe_count': item['recipe_count'],
+	}
+
+def stream_shopping_list(user, recipe_ids):
+	"""Yield NDJSON lines, the totals first then one line per ingredient"""
+	items = get_shopping_list_items(user, recipe_ids).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+	yield from stream_ndjson([get_shopping_list_totals(user, recipe_ids)])
+	yield from stream_ndjson(format_item(item) for item in items)
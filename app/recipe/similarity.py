@@ -0,0 +1,141 @@
+import time
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete
+
+from core.models import Recipe, RecipeTag, RecipeIngredient
+from core.signals import soft_delete_changed
+from .indexes import UserIndexes
+
+# numpy is imported where it is used, so it is only loaded once a similarity is asked
+
+# Weight of the Jaccard similarity of each relation in the final score
+SIMILARITY_WEIGHTS = (
+	(RecipeTag, 'tag', 1.0),
+	(RecipeIngredient, 'ingredient', 2.0),
+)
+
+class Incidence:
+	"""
+	Sparse recipe x feature (tag or ingredient) matrix, stored both ways
+	- By feature (CSC): rows of the recipes having each feature
+	- By recipe (CSR): features of each recipe
+	"""
+	def __init__(self, recipe_ids, pairs):
+		import numpy as np
+
+		count = len(recipe_ids)
+		links = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+		rows = np.searchsorted(recipe_ids, links[:, 0])
+		# Drop links of recipes created after recipe_ids were read
+		known = rows < count
+		known[known] = recipe_ids[rows[known]] == links[known, 0]
+		links, rows = links[known], rows[known]
+		features, columns = np.unique(links[:, 1], return_inverse=True)
+
+		by_feature = np.argsort(columns, kind='stable')
+		self.feature_rows = rows[by_feature]
+		self.feature_indptr = np.searchsorted(columns[by_feature], np.arange(len(features) + 1))
+
+		by_recipe = np.argsort(rows, kind='stable')
+		self.recipe_columns = columns[by_recipe]
+		self.recipe_indptr = np.searchsorted(rows[by_recipe], np.arange(count + 1))
+
+		self.sizes = np.bincount(rows, minlength=count)
+
+	def jaccard(self, row):
+		"""Return the Jaccard similarity of every recipe with the recipe at row"""
+		import numpy as np
+
+		columns = self.recipe_columns[self.recipe_indptr[row]:self.recipe_indptr[row + 1]]
+		count = len(self.sizes)
+		if not len(columns):
+			return np.zeros(count)
+		sharing = np.concatenate([
+			self.feature_rows[self.feature_indptr[column]:self.feature_indptr[column + 1]]
+			for column in columns
+		])
+		intersection = np.bincount(sharing, minlength=count)
+		union = self.sizes + len(columns) - intersection
+		return intersection / np.maximum(union, 1)
+
+class SimilarityIndex:
+	"""Tag and ingredient incidence matrices of every recipe of an user"""
+	def __init__(self, recipe_ids, incidences):
+		self.recipe_ids = recipe_ids
+		self.incidences = incidences
+		self.built_at = time.monotonic()
+
+	@classmethod
+	def build(cls, user_id):
+		import numpy as np
+
+		recipe_ids = np.fromiter(
+			Recipe.objects.filter(user_id=user_id).order_by('id').values_list('id', flat=True).iterator(),
+			dtype=np.int64,
+		)
+		incidences = []
+		for model, field, weight in SIMILARITY_WEIGHTS:
+			pairs = list(
+				model.objects
+				.filter(user_id=user_id, recipe__deleted_at__isnull=True, **{f'{field}__deleted_at__isnull': True})
+				.values_list('recipe_id', f'{field}_id')
+				.iterator()
+			)
+			incidences.append((Incidence(recipe_ids, pairs), weight))
+		return cls(recipe_ids, incidences)
+
+	def similar(self, recipe_id, limit):
+		"""Return [(recipe_id, score)] of the most similar recipes, best first"""
+		import numpy as np
+
+		row = np.searchsorted(self.recipe_ids, recipe_id)
+		if row >= len(self.recipe_ids) or self.recipe_ids[row] != recipe_id:
+			return []
+		scores = sum(incidence.jaccard(row) * weight for incidence, weight in self.incidences)
+		scores /= sum(weight for _, weight in self.incidences)
+		scores[row] = 0
+
+		candidates = np.flatnonzero(scores)
+		if len(candidates) > limit:
+			candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+		# Best score first, lowest id first on ties
+		candidates = candidates[np.lexsort((self.recipe_ids[candidates], -scores[candidates]))]
+		return [(int(self.recipe_ids[row]), float(scores[row])) for row in candidates]
+
+class SimilarityIndexes(UserIndexes):
+	"""
+	Per user similarity indexes of this process
+	- Built lazily, dropped when tags/ingredients of a recipe change
+	- Rebuilt after SIMILAR_INDEX_TTL seconds to pick up changes made by other processes
+	- At most SIMILAR_INDEX_MAX_USERS users are kept
+	"""
+	def __init__(self):
+		super().__init__(SimilarityIndex.build, 'SIMILAR_INDEX_TTL', 'SIMILAR_INDEX_MAX_USERS')
+
+similarity_indexes = SimilarityIndexes()
+
+def on_commit_invalidate(user_id):
+	transaction.on_commit(lambda: similarity_indexes.invalidate(user_id))
+
+def relations_changed(sender, instance, action, **kwargs):
+	if action in ('post_add', 'post_remove', 'post_clear'):
+		on_commit_invalidate(instance.user_id)
+
+def recipe_saved(sender, instance, created, **kwargs):
+	if created or instance.deleted_at is not None:
+		on_commit_invalidate(instance.user_id)
+
+def recipe_deleted(sender, instance, **kwargs):
+	on_commit_invalidate(instance.user_id)
+
+def rows_soft_delete_changed(sender, user_ids, **kwargs):
+	for user_id in user_ids:
+		on_commit_invalidate(user_id)
+
+def connect_signals():
+	soft_delete_changed.connect(rows_soft_delete_changed, dispatch_uid='similarity_soft_delete_changed')
+	for model, _, _ in SIMILARITY_WEIGHTS:
+		m2m_changed.connect(relations_changed, sender=model, dispatch_uid=f'similarity_{model.__name__}')
+	post_save.connect(recipe_saved, sender=Recipe, dispatch_uid='similarity_recipe_saved')
+	post_delete.connect(recipe_deleted, sender=Recipe, dispatch_uid='similarity_recipe_deleted')
@@ -0,0 +1,155 @@
+import json
+from unittest.mock import patch
+
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from core import pubsub
+from core.models import ExpiringToken, Tag
+from core.tests.factories import mock_user, mock_recipe, mock_tag
+from recipe.events import EVENTS_PATH, RESYNC_MESSAGE, EventStream, user_channel
+from recipe.importer import RecipeImporter
+
+def get_scope(token=None, query_string=b''):
+	headers = [(b'authorization', f'Token {token}'.encode())] if token else []
+	return {
+		'type': 'http',
+		'method': 'GET',
+		'path': EVENTS_PATH,
+		'query_string': query_string,
+		'headers': headers,
+	}
+
+class ChangePublishTest(TransactionTestCase):
+	"""Test that committed changes are published to the channel of their user"""
+
+	def setUp(self):
+		self.user = mock_user()
+
+	@patch('core.pubsub.publish')
+	def test_changes_published(self, publish):
+		channel = user_channel(self.user.id)
+		tag = mock_tag(self.user, 'soup')
+		recipe = mock_recipe(self.user)
+		recipe.tags.add(tag)
+		recipe.title = 'ramen'
+		recipe.save()
+		tag.soft_delete()
+
+		self.assertEqual([call.args for call in publish.call_args_list], [
+			(channel, {'type': 'tag', 'id': tag.id, 'action': 'created'}),
+			(channel, {'type': 'recipe', 'id': recipe.id, 'action': 'created'}),
+			(channel, {'type': 'recipe', 'id': recipe.id, 'action': 'updated'}),
+			(channel, {'type': 'recipe', 'id': recipe.id, 'action': 'updated'}),
+			(channel, {'type': 'tag', 'id': tag.id, 'action': 'deleted'}),
+		])
+
+	@patch('core.pubsub.publish')
+	def test_bulk_writes_publish_resync(self, publish):
+		"""Test if writes sending no post_save, from the importer or the admin, ask clients to resync"""
+		channel = user_channel(self.user.id)
+		RecipeImporter(self.user).run([
+			{'title': 'ramen', 'price': '5.00', 'time_minute': 10, 'tags': ['soup'], 'ingredients': []},
+		])
+		self.assertIn((channel, RESYNC_MESSAGE), [call.args for call in publish.call_args_list])
+
+		publish.reset_mock()
+		Tag.objects.filter(user=self.user).soft_delete()
+		Tag.all_objects.filter(user=self.user).restore()
+		self.assertEqual([call.args for call in publish.call_args_list], [(channel, RESYNC_MESSAGE)] * 2)
+
+	@patch('core.pubsub.publish')
+	def test_reorder_published(self, publish):
+		"""Test if reordering relations, a queryset update, is pushed as an update of the recipe"""
+		soup, asian = mock_tag(self.user, 'soup'), mock_tag(self.user, 'asian')
+		recipe = mock_recipe(self.user)
+		recipe.tags.add(soup, asian)
+		publish.reset_mock()
+
+		recipe.set_positions('tags', [asian.id, soup.id])
+		publish.assert_called_once_with(
+			user_channel(self.user.id), {'type': 'recipe', 'id': recipe.id, 'action': 'updated'}
+		)
+
+class EventStreamTest(TestCase):
+	"""Test the Server-Sent Events stream of changes"""
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = mock_user()
+		cls.token = ExpiringToken.objects.rotate(cls.user).key
+
+	async def open_stream(self, scope):
+		communicator = ApplicationCommunicator(EventStream(), scope)
+		await communicator.send_input({'type': 'http.request'})
+		start = await communicator.receive_output(1)
+		return communicator, start
+
+	async def test_authentication_required(self):
+		communicator, start = await self.open_stream(get_scope())
+		self.assertEqual(start['status'], 401)
+
+		communicator, start = await self.open_stream(get_scope('invalid'))
+		self.assertEqual(start['status'], 401)
+
+	async def test_changes_pushed(self):
+		communicator, start = await self.open_stream(get_scope(query_string=f'token={self.token}'.encode()))
+		self.assertEqual(start['status'], 200)
+		self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+		self.assertEqual((await communicator.receive_output(1))['body'], b'retry: 5000\n\n')
+
+		message = {'type': 'recipe', 'id': 1, 'action': 'created'}
+		pubsub.publish(user_channel(self.user.id + 1), {'type': 'recipe', 'id': 2, 'action': 'created'})
+		pubsub.publish(user_channel(self.user.id), message)
+		body = (await communicator.receive_output(1))['body']
+		self.assertEqual(body, f'event: change\ndata: {json.dumps(message)}\n\n'.encode())
+
+		await communicator.send_input({'type': 'http.disconnect'})
+		await communicator.wait(1)
+		self.assertNotIn(user_channel(self.user.id), pubsub.get_broker()._subscriptions)
+
+	@override_settings(EVENTS_HEARTBEAT=0.01)
+	async def test_heartbeat(self):
+		communicator, _ = await self.open_stream(get_scope(self.token))
+		await communicator.receive_output(1)
+		self.assertEqual((await communicator.receive_output(1))['body'], b': ping\n\n')
+		await communicator.send_input({'type': 'http.disconnect'})
+		await communicator.wait(1)
+
+	@override_settings(EVENTS_HEARTBEAT=0.01)
+	async def test_stream_ends_once_token_rotated(self):
+		communicator, _ = await self.open_stream(get_scope(self.token))
+		await communicator.receive_output(1)
+		await communicator.receive_output(1)
+
+		await sync_to_async(ExpiringToken.objects.filter(key=self.token).delete)()
+		output = await communicator.receive_output(1)
+		self.assertEqual(output['body'], b'')
+		self.assertFalse(output.get('more_body', False))
+		await communicator.wait(1)
+
+	async def test_resync_message(self):
+		"""Test if a published resync is sent as a resync event and the stream goes on"""
+		communicator, _ = await self.open_stream(get_scope(self.token))
+		await communicator.receive_output(1)
+		pubsub.publish(user_channel(self.user.id), RESYNC_MESSAGE)
+
+		output = await communicator.receive_output(1)
+		self.assertEqual(output['body'], b'event: resync\ndata: {}\n\n')
+		self.assertTrue(output['more_body'])
+		await communicator.send_input({'type': 'http.disconnect'})
+		await communicator.wait(1)
+
+	@override_settings(PUBSUB_QUEUE_SIZE=2)
+	async def test_slow_subscriber_resync(self):
+		"""Test if a subscriber falling behind is asked to resync and the stream ends"""
+		communicator, _ = await self.open_stream(get_scope(self.token))
+		await communicator.receive_output(1)
+		for recipe_id in range(3):
+			pubsub.publish(user_channel(self.user.id), {'type': 'recipe', 'id': recipe_id, 'action': 'created'})
+
+		output = await communicator.receive_output(1)
+		self.assertEqual(output['body'], b'event: resync\ndata: {}\n\n')
+		self.assertFalse(output.get('more_body', False))
+		await communicator.wait(1)
@@ -1,18 +1,15 @@
 from django.test import TestCase
-from django.contrib.auth import get_user_model
 from django.urls import reverse
 
 from core.tests.authenticated_test_case import AuthenticatedTestCase
+from core.tests.factories import mock_user
 from rest_framework.test import APIClient
 from rest_framework import status
-from core.models import Ingredient
+from core.models import Ingredient, Recipe
 from recipe.serializers import IngredientSerializer
 
 INGREDIENT_URL = reverse('recipe:ingredient-list')
 
-def mock_user(email='test@example.com', password='helloworld'):
-	return get_user_model().objects.create_user(email=email, password=password)
-
 class PublicIngredientApiTests(TestCase):
 	"""Test public ingredient API."""
 	def setUp(self):
@@ -74,4 +71,32 @@ class PrivateIngredientApiTests(AuthenticatedTestCase):
 		res = self.client.post(INGREDIENT_URL, payload)
 
 		# Assertions
-		self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+		self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_list_ingredients_with_recipe_count(self):
+		"""Test if listed ingredients include the number of recipes using them"""
+		ingredient_1 = Ingredient.objects.create(name='Ingredient1', user=self.user)
+		Ingredient.objects.create(name='Ingredient2', user=self.user)
+		for _ in range(2):
+			recipe = Recipe.objects.create(title='Recipe', price=10, time_minute=10, user=self.user)
+			recipe.ingredients.add(ingredient_1)
+
+		res = self.client.get(INGREDIENT_URL)
+
+		# Assertions
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		self.assertEqual([item['recipe_count'] for item in res.data], [2, 0])
+
+	def test_list_assigned_ingredients_only(self):
+		"""Test if assigned_only filter returns only ingredients used by a recipe"""
+		ingredient_1 = Ingredient.objects.create(name='Ingredient1', user=self.user)
+		Ingredient.objects.create(name='Ingredient2', user=self.user)
+		recipe = Recipe.objects.create(title='Recipe', price=10, time_minute=10, user=self.user)
+		recipe.ingredients.add(ingredient_1)
+
+		res = self.client.get(INGREDIENT_URL, {'assigned_only': 1})
+
+		# Assertions
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		self.assertEqual(len(res.data), 1)
+		self.assertEqual(res.data[0]['id'], ingredient_1.id)
@@ -1,48 +1,50 @@
+import csv
+import io
+import json
 import os
 import tempfile
 from PIL import Image
 
-from django.test import TestCase
-from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 
 from rest_framework.test import APIClient
 from rest_framework import status
-from core.models import Recipe, Tag, Ingredient
+from core.models import Recipe, Tag, RecipeTag
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
-from core.tests.authenticated_test_case import AuthenticatedTestCase
+from recipe.views import PANTRY_MISSING_MAX
+from core.tests.authenticated_test_case import AuthenticatedTestCase, TemporaryMediaMixin
+from core.tests.factories import mock_user, mock_recipe, mock_tag, mock_ingredient
+from recipe.idempotency import check_idempotency_cache
+from recipe.importer import RecipeImporter, RecipeImportError
+from recipe.pantry import PantryIndex, pantry_indexes
+from recipe.similarity import similarity_indexes
+from unittest.mock import patch
 
 RECIPE_URL = reverse('recipe:recipe-list')
+RECIPE_STATS_URL = reverse('recipe:recipe-stats')
+RECIPE_EXPORT_URL = reverse('recipe:recipe-export')
+RECIPE_IMPORT_URL = reverse('recipe:recipe-import-recipes')
+RECIPE_PANTRY_URL = reverse('recipe:recipe-pantry')
+RECIPE_SHOPPING_LIST_URL = reverse('recipe:recipe-shopping-list')
 
 def get_detail_url(recipe_id):
 	"""Return recipe detail URL"""
 	return reverse('recipe:recipe-detail', args=[recipe_id])
 
+def get_similar_url(recipe_id):
+	"""Return URL of recipes similar to a recipe"""
+	return reverse('recipe:recipe-similar', args=[recipe_id])
+
 def get_image_upload_url(recipe_id):
 	"""Return URL for uploading recipe image"""
 	return reverse('recipe:recipe-upload-image', args=[recipe_id])
 
-def mock_user(email='test@example.com', password='helloworld'):
-	return get_user_model().objects.create_user(email=email, password=password)
-
-def mock_recipe(user, **params):
-	"""Mock a recipe"""
-	default = {
-		'title': 'Mock recipe',
-		'price': 10,
-		'time_minute': 15
-	}
-	default.update(params)
-	return Recipe.objects.create(user=user, **default)
-
-def mock_tag(user, name='tag'):
-	"""Mock a tag"""
-	return Tag.objects.create(user=user, name=name)
-
-def mock_ingredient(user, name='ingredient'):
-	"""Mock an ingredient"""
-	return Ingredient.objects.create(user=user, name=name)
-
 class PublicRecipeApiTest(TestCase):
 	"""Test public recipe API"""
 
@@ -220,7 +222,651 @@ class PrivateRecipeTest(AuthenticatedTestCase):
 		self.assertEqual(len(res_2.data), 1)
 		self.assertIn(serializer_1.data, res_2.data)
 
-class ImageRecipeTest(AuthenticatedTestCase):
+	def test_recipe_stats(self):
+		"""Test aggregated statistics of own recipes"""
+		recipe_1 = mock_recipe(self.user, price=10, time_minute=10)
+		recipe_2 = mock_recipe(self.user, price=20, time_minute=30)
+		mock_recipe(mock_user(email='other@test.com'), price=100, time_minute=100)
+		tag_1 = mock_tag(self.user, 'tag1')
+		tag_2 = mock_tag(self.user, 'tag2')
+		ingredient = mock_ingredient(self.user)
+		recipe_1.tags.add(tag_1, tag_2)
+		recipe_2.tags.add(tag_1)
+		recipe_2.ingredients.add(ingredient)
+
+		with self.assertNumQueries(3):
+			res = self.client.get(RECIPE_STATS_URL)
+
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		self.assertEqual(res.data['recipe_count'], 2)
+		self.assertEqual(res.data['average_price'], '15.00')
+		self.assertEqual(res.data['average_time_minute'], 20)
+		self.assertEqual(
+			[(tag['name'], tag['recipe_count']) for tag in res.data['top_tags']],
+			[('tag1', 2), ('tag2', 1)]
+		)
+		self.assertEqual(res.data['top_ingredients'][0]['id'], ingredient.id)
+
+	def test_recipe_stats_without_recipes(self):
+		"""Test statistics when user has no recipes"""
+		res = self.client.get(RECIPE_STATS_URL)
+
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		self.assertEqual(res.data['recipe_count'], 0)
+		self.assertIsNone(res.data['average_price'])
+		self.assertEqual(res.data['top_tags'], [])
+
+	def test_filter_recipe_by_many_tags_without_duplicates(self):
+		"""Test that a recipe having several of the filtered tags is listed once"""
+		recipe = mock_recipe(self.user)
+		tag_1 = mock_tag(self.user)
+		tag_2 = mock_tag(self.user)
+		recipe.tags.add(tag_1, tag_2)
+
+		res = self.client.get(RECIPE_URL, {'tags': f'{tag_1.id},{tag_2.id}'})
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		self.assertEqual([item['id'] for item in res.data], [recipe.id])
+
+	def test_tag_filter_uses_relation_index(self):
+		"""Test if the tag filter is planned on the (user, tag, recipe) index"""
+		if connection.vendor == 'postgresql':
+			with connection.cursor() as cursor:
+				cursor.execute('SET LOCAL enable_seqscan = off')
+		plan = RecipeTag.objects.filter(user=self.user, tag_id__in=[1, 2]).values('recipe_id').explain()
+		self.assertIn('recipetag_user_tag_idx', plan)
+
+	def test_create_recipe_keeps_tag_order(self):
+		"""Test that tags are stored in the order they were given"""
+		tags = [mock_tag(self.user, name) for name in ('a', 'b', 'c')]
+		payload = {
+			'title': 'My new recipe',
+			'price': 10,
+			'time_minute': 20,
+			'tags': [tags[2].id, tags[0].id, tags[1].id]
+		}
+		res = self.client.post(RECIPE_URL, payload)
+		relations = RecipeTag.objects.filter(recipe_id=res.data['id']).order_by('position')
+
+		self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+		self.assertEqual([relation.tag_id for relation in relations], payload['tags'])
+
+	def test_recipe_relations_listed_in_stored_order(self):
+		"""Test that responses list tags and ingredients in the order they were given"""
+		tags = [mock_tag(self.user, name) for name in ('a', 'b', 'c')]
+		ingredients = [mock_ingredient(self.user, name) for name in ('x', 'y')]
+		payload = {
+			'title': 'My new recipe',
+			'price': 10,
+			'time_minute': 20,
+			'tags': [tags[2].id, tags[0].id, tags[1].id],
+			'ingredients': [ingredients[1].id, ingredients[0].id],
+		}
+		res = self.client.post(RECIPE_URL, payload)
+		self.assertEqual(res.data['tags'], payload['tags'])
+		# Sharing tags with another recipe does not mix up orders
+		self.client.post(RECIPE_URL, dict(payload, title='Other recipe', tags=[tags[0].id, tags[2].id]))
+
+		res = self.client.get(RECIPE_URL)
+		self.assertEqual(res.data[0]['tags'], payload['tags'])
+		self.assertEqual(res.data[0]['ingredients'], payload['ingredients'])
+		self.assertEqual(res.data[1]['tags'], [tags[0].id, tags[2].id])
+
+		res = self.client.patch(get_detail_url(res.data[0]['id']), {'tags': [tags[1].id, tags[2].id]})
+		self.assertEqual(res.data['tags'], [tags[1].id, tags[2].id])
+		res = self.client.get(get_detail_url(res.data['id']))
+		self.assertEqual([tag['id'] for tag in res.data['tags']], [tags[1].id, tags[2].id])
+		self.assertEqual([ingredient['id'] for ingredient in res.data['ingredients']], payload['ingredients'])
+
+	def test_delete_recipe_soft_deletes(self):
+		"""Test if deleting a recipe keeps the row but hides it"""
+		recipe = mock_recipe(self.user)
+		recipe.tags.add(mock_tag(self.user))
+
+		res = self.client.delete(get_detail_url(recipe.id))
+
+		# Assertions
+		self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+		self.assertFalse(Recipe.objects.filter(id=recipe.id).exists())
+		self.assertIsNotNone(Recipe.all_objects.get(id=recipe.id).deleted_at)
+		self.assertEqual(RecipeTag.objects.filter(recipe_id=recipe.id).count(), 1)
+		self.assertEqual(self.client.get(RECIPE_URL).data, [])
+		self.assertEqual(self.client.get(get_detail_url(recipe.id)).status_code, status.HTTP_404_NOT_FOUND)
+
+	def test_filter_recipe_by_price_and_time(self):
+		"""Test filtering recipes by price range and maximum time"""
+		cheap_quick = mock_recipe(self.user, price=5, time_minute=10)
+		mock_recipe(self.user, price=5, time_minute=60)
+		mock_recipe(self.user, price=50, time_minute=10)
+
+		res = self.client.get(RECIPE_URL, {'price_min': '1', 'price_max': '10', 'time_max': 30})
+
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		self.assertEqual([recipe['id'] for recipe in res.data], [cheap_quick.id])
+
+	def test_filter_out_of_range(self):
+		"""Test if filter values no column can hold are rejected"""
+		for params in (
+			{'time_max': 10 ** 30}, {'price_min': 'NaN'}, {'price_max': 'Infinity'}, {'price_max': '10000'},
+		):
+			res = self.client.get(RECIPE_URL, params)
+			self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_filter_recipe_invalid_number(self):
+		"""Test if filtering by a non numeric price fails"""
+		res = self.client.get(RECIPE_URL, {'price_max': 'cheap'})
+		self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_sort_recipes(self):
+		"""Test sorting recipes by whitelisted keys only"""
+		recipe_1 = mock_recipe(self.user, price=20, time_minute=5)
+		recipe_2 = mock_recipe(self.user, price=10, time_minute=50)
+
+		res = self.client.get(RECIPE_URL, {'ordering': '-time_minute'})
+		self.assertEqual([recipe['id'] for recipe in res.data], [recipe_2.id, recipe_1.id])
+
+		res = self.client.get(RECIPE_URL, {'ordering': 'price'})
+		self.assertEqual([recipe['id'] for recipe in res.data], [recipe_2.id, recipe_1.id])
+
+		res = self.client.get(RECIPE_URL, {'ordering': 'user__password'})
+		self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_keyset_pagination(self):
+		"""Test paging through sorted recipes with a cursor"""
+		recipes = [mock_recipe(self.user, price=price) for price in (30, 10, 20)]
+
+		res = self.client.get(RECIPE_URL, {'ordering': 'price', 'page_size': 2})
+		self.assertEqual(
+			[recipe['id'] for recipe in res.data['results']],
+			[recipes[1].id, recipes[2].id]
+		)
+		res = self.client.get(res.data['next'])
+		self.assertEqual([recipe['id'] for recipe in res.data['results']], [recipes[0].id])
+		self.assertIsNone(res.data['next'])
+
+	def test_range_filter_uses_index(self):
+		"""Test if price/time range filters are planned on the composite indexes"""
+		if connection.vendor == 'postgresql':
+			# Tables are tiny in tests, force the planner off sequential scans
+			with connection.cursor() as cursor:
+				cursor.execute('SET LOCAL enable_seqscan = off')
+		recipes = Recipe.objects.filter(user=self.user)
+
+		plan = recipes.filter(price__lte=10).order_by('price').explain()
+		self.assertIn('recipe_user_price_idx', plan)
+
+		plan = recipes.filter(time_minute__lte=30).order_by('time_minute').explain()
+		self.assertIn('recipe_user_time_idx', plan)
+
+class ExportRecipeTest(AuthenticatedTestCase):
+	"""Test streaming export of recipes"""
+	def setUp(self):
+		super().setUp()
+		self.recipe = mock_recipe(self.user, title='Pho', price=5)
+		self.recipe.tags.add(mock_tag(self.user, 'soup'), mock_tag(self.user, 'asian'))
+		self.recipe.ingredients.add(mock_ingredient(self.user, 'noodle'))
+		mock_recipe(self.user, title='Salad')
+		mock_recipe(mock_user(email='other@test.com'), title='Not mine')
+
+	def test_export_ndjson(self):
+		"""Test exporting own recipes as NDJSON"""
+		res = self.client.get(RECIPE_EXPORT_URL)
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		self.assertTrue(res.streaming)
+		rows = [json.loads(line) for line in b''.join(res.streaming_content).decode().splitlines()]
+
+		self.assertEqual([row['title'] for row in rows], ['Pho', 'Salad'])
+		self.assertEqual(rows[0]['tags'], ['soup', 'asian'])
+		self.assertEqual(rows[0]['ingredients'], ['noodle'])
+		self.assertEqual(rows[1]['tags'], [])
+
+	def test_export_csv(self):
+		"""Test exporting own recipes as CSV"""
+		res = self.client.get(RECIPE_EXPORT_URL, {'type': 'csv'})
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		self.assertEqual(res['Content-Type'], 'text/csv')
+		content = b''.join(res.streaming_content).decode()
+		rows = list(csv.DictReader(io.StringIO(content)))
+
+		self.assertEqual(len(rows), 2)
+		self.assertEqual(rows[0]['price'], '5.00')
+		self.assertEqual(rows[0]['tags'], 'soup;asian')
+
+	def test_export_batches_m2m_queries(self):
+		"""Test that tags/ingredients are fetched once per chunk, not per recipe"""
+		for _ in range(10):
+			mock_recipe(self.user)
+		res = self.client.get(RECIPE_EXPORT_URL)
+		with self.assertNumQueries(3):
+			b''.join(res.streaming_content)
+
+	def test_export_invalid_type(self):
+		"""Test if exporting to unknown format fails"""
+		res = self.client.get(RECIPE_EXPORT_URL, {'type': 'xml'})
+		self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+def ndjson_file(rows, name='recipes.ndjson'):
+	"""Return an uploadable NDJSON file of rows"""
+	content = ''.join(json.dumps(row) + '\n' for row in rows)
+	return SimpleUploadedFile(name, content.encode())
+
+class ImportRecipeTest(AuthenticatedTestCase):
+	"""Test bulk import of recipes"""
+	def test_import_ndjson(self):
+		"""Test importing recipes and matching tags by name"""
+		existing_tag = mock_tag(self.user, 'soup')
+		rows = [
+			{'title': 'Pho', 'price': '5.00', 'time_minute': 60, 'tags': ['soup', 'asian'], 'ingredients': ['noodle']},
+			{'title': 'Ramen', 'price': '7.50', 'time_minute': 30, 'tags': ['soup']},
+		]
+		res = self.client.post(RECIPE_IMPORT_URL, {'file': ndjson_file(rows)}, format='multipart')
+
+		self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+		self.assertEqual(res.data['imported'], 2)
+		pho = Recipe.objects.get(user=self.user, title='Pho')
+		self.assertEqual(sorted(tag.name for tag in pho.tags.all()), ['asian', 'soup'])
+		self.assertIn(existing_tag, pho.tags.all())
+		self.assertEqual(Tag.objects.filter(user=self.user).count(), 2)
+		self.assertEqual(pho.ingredients.get().name, 'noodle')
+
+	def test_import_exported_csv(self):
+		"""Test importing a CSV export round trips"""
+		recipe = mock_recipe(self.user, title='Pho')
+		recipe.tags.add(mock_tag(self.user, 'soup'))
+		content = b''.join(self.client.get(RECIPE_EXPORT_URL, {'type': 'csv'}).streaming_content)
+		upload = SimpleUploadedFile('recipes.csv', content)
+
+		res = self.client.post(RECIPE_IMPORT_URL, {'file': upload}, format='multipart')
+
+		self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+		recipes = Recipe.objects.filter(user=self.user, title='Pho')
+		self.assertEqual(recipes.count(), 2)
+		self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
+	def test_import_resume_after_failure(self):
+		"""Test that failed import keeps committed chunks and can be resumed"""
+		rows = [
+			{'title': 'First', 'price': '1.00', 'time_minute': 1},
+			{'title': 'Broken', 'price': 'free', 'time_minute': 1},
+			{'title': 'Third', 'price': '3.00', 'time_minute': 3},
+		]
+		with patch('recipe.views.RecipeImporter', lambda user: RecipeImporter(user, chunk_size=1)):
+			res = self.client.post(RECIPE_IMPORT_URL, {'file': ndjson_file(rows)}, format='multipart')
+			self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+			self.assertEqual(res.data['row'], 2)
+			self.assertEqual(res.data['committed'], 1)
+
+			rows[1]['price'] = '2.00'
+			url = f'{RECIPE_IMPORT_URL}?skip={res.data["committed"]}'
+			res = self.client.post(url, {'file': ndjson_file(rows)}, format='multipart')
+
+		self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+		self.assertEqual(res.data['imported'], 2)
+		self.assertEqual(
+			list(Recipe.objects.filter(user=self.user).order_by('id').values_list('title', flat=True)),
+			['First', 'Broken', 'Third']
+		)
+
+	def test_import_malformed_line(self):
+		"""Test if a malformed line is reported at its own row, not at the first row of its chunk"""
+		content = ndjson_file([{'title': 'First', 'price': '1.00', 'time_minute': 1}] * 2).read() + b'{"title":\n'
+		res = self.client.post(
+			RECIPE_IMPORT_URL, {'file': SimpleUploadedFile('recipes.ndjson', content)}, format='multipart'
+		)
+
+		self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+		self.assertEqual((res.data['row'], res.data['committed']), (3, 0))
+
+	def test_import_database_error(self):
+		"""Test if a failing chunk is reported with the rows committed before it"""
+		rows = [{'title': title, 'price': '1.00', 'time_minute': 1} for title in ('First', 'Second')]
+		importer = RecipeImporter(self.user, chunk_size=1)
+		save = importer.save
+
+		def save_first(recipes):
+			if importer.imported:
+				raise IntegrityError('duplicate key')
+			save(recipes)
+
+		with patch.object(importer, 'save', save_first), self.assertRaises(RecipeImportError) as context:
+			importer.run(rows)
+		self.assertEqual((context.exception.row, context.exception.committed), (2, 1))
+
+	def test_import_command(self):
+		"""Test importing recipes with the management command"""
+		with tempfile.NamedTemporaryFile(suffix='.ndjson') as ntf:
+			ntf.write(json.dumps({'title': 'Pho', 'price': '5', 'time_minute': 60}).encode())
+			ntf.flush()
+			call_command('import_recipes', self.user.email, ntf.name, stdout=io.StringIO())
+
+		self.assertTrue(Recipe.objects.filter(user=self.user, title='Pho').exists())
+
+class IdempotentRecipeTest(TemporaryMediaMixin, AuthenticatedTestCase):
+	"""Test replaying recipe writes retried with an Idempotency-Key"""
+	def setUp(self):
+		super().setUp()
+		caches[settings.IDEMPOTENCY_CACHE].clear()
+		self.payload = {'title': 'My new recipe', 'price': 10, 'time_minute': 20}
+
+	def test_retried_create_is_replayed(self):
+		"""Test if retrying a create with the same key does not create a duplicate"""
+		res_1 = self.client.post(RECIPE_URL, self.payload, HTTP_IDEMPOTENCY_KEY='key-1')
+		res_2 = self.client.post(RECIPE_URL, self.payload, HTTP_IDEMPOTENCY_KEY='key-1')
+
+		self.assertEqual(res_1.status_code, status.HTTP_201_CREATED)
+		self.assertEqual(res_2.status_code, status.HTTP_201_CREATED)
+		self.assertEqual(res_2.data, res_1.data)
+		self.assertEqual(res_2['Idempotent-Replayed'], 'true')
+		self.assertEqual(Recipe.objects.filter(user=self.user).count(), 1)
+
+	def test_different_keys_create_separately(self):
+		"""Test if requests with different keys or without key all run"""
+		self.client.post(RECIPE_URL, self.payload, HTTP_IDEMPOTENCY_KEY='key-1')
+		self.client.post(RECIPE_URL, self.payload, HTTP_IDEMPOTENCY_KEY='key-2')
+		self.client.post(RECIPE_URL, self.payload)
+		self.assertEqual(Recipe.objects.filter(user=self.user).count(), 3)
+
+	def test_failed_create_is_not_stored(self):
+		"""Test if a failed write can be retried with the same key"""
+		res = self.client.post(RECIPE_URL, {'title': 'Missing fields'}, HTTP_IDEMPOTENCY_KEY='key-1')
+		self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+		res = self.client.post(RECIPE_URL, self.payload, HTTP_IDEMPOTENCY_KEY='key-1')
+		self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+	def test_key_reused_for_other_endpoint(self):
+		"""Test if reusing a key on another endpoint is rejected"""
+		self.client.post(RECIPE_URL, self.payload, HTTP_IDEMPOTENCY_KEY='key-1')
+		res = self.client.post(reverse('recipe:tag-list'), {'name': 'tag'}, HTTP_IDEMPOTENCY_KEY='key-1')
+
+		self.assertEqual(res.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+		self.assertFalse(Tag.objects.filter(user=self.user).exists())
+
+	def test_key_reused_with_other_body(self):
+		"""Test if reusing a key for a different payload is rejected instead of replayed"""
+		self.client.post(RECIPE_URL, self.payload, HTTP_IDEMPOTENCY_KEY='key-1')
+		res = self.client.post(RECIPE_URL, dict(self.payload, title='Other recipe'), HTTP_IDEMPOTENCY_KEY='key-1')
+
+		self.assertEqual(res.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+		self.assertFalse(Recipe.objects.filter(user=self.user, title='Other recipe').exists())
+
+	def test_replay_keeps_headers(self):
+		"""Test if headers of the first response such as Location are replayed"""
+		with patch('recipe.views.RecipeViewSet.get_success_headers', return_value={'Location': '/recipes/1'}):
+			self.client.post(RECIPE_URL, self.payload, HTTP_IDEMPOTENCY_KEY='key-1')
+		res = self.client.post(RECIPE_URL, self.payload, HTTP_IDEMPOTENCY_KEY='key-1')
+
+		self.assertEqual(res['Location'], '/recipes/1')
+		self.assertEqual(res['Idempotent-Replayed'], 'true')
+
+	def test_retried_image_upload_is_replayed(self):
+		"""Test if multipart retries match although their boundary changes"""
+		recipe = mock_recipe(self.user)
+		url = get_image_upload_url(recipe.id)
+		with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+			Image.new('RGB', (10, 10)).save(image_file, format='JPEG')
+			for _ in range(2):
+				image_file.seek(0)
+				res = self.client.post(url, {'image': image_file}, format='multipart', HTTP_IDEMPOTENCY_KEY='key-1')
+				self.assertEqual(res.status_code, status.HTTP_200_OK)
+		self.assertEqual(res['Idempotent-Replayed'], 'true')
+
+	def test_key_reused_with_other_repeated_field(self):
+		"""Test if multipart bodies differing only in a repeated field are not taken for retries"""
+		tags = [mock_tag(self.user, name) for name in ('vegan', 'quick', 'dessert')]
+		self.client.post(
+			RECIPE_URL, dict(self.payload, tags=[tags[0].id, tags[2].id]),
+			format='multipart', HTTP_IDEMPOTENCY_KEY='key-1'
+		)
+		res = self.client.post(
+			RECIPE_URL, dict(self.payload, tags=[tags[1].id, tags[2].id]),
+			format='multipart', HTTP_IDEMPOTENCY_KEY='key-1'
+		)
+
+		self.assertEqual(res.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+	def test_local_memory_cache_refused(self):
+		"""Test if a per-process idempotency cache fails the system checks"""
+		self.assertEqual(check_idempotency_cache(None), [])
+		with override_settings(IDEMPOTENCY_CACHE='default'):
+			self.assertEqual([error.id for error in check_idempotency_cache(None)], ['recipe.E001'])
+
+	def test_retried_tag_create_is_replayed(self):
+		"""Test if tag creation is covered too"""
+		for _ in range(2):
+			res = self.client.post(reverse('recipe:tag-list'), {'name': 'tag'}, HTTP_IDEMPOTENCY_KEY='key-1')
+			self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+		self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
+class PantryRecipeTest(AuthenticatedTestCase):
+	"""Test matching recipes against the ingredients an user has"""
+
+	@classmethod
+	def setUpTestData(cls):
+		super().setUpTestData()
+		cls.egg = mock_ingredient(cls.user, 'egg')
+		cls.flour = mock_ingredient(cls.user, 'flour')
+		cls.milk = mock_ingredient(cls.user, 'milk')
+		cls.omelette = mock_recipe(cls.user, title='omelette')
+		cls.omelette.ingredients.add(cls.egg)
+		cls.pancake = mock_recipe(cls.user, title='pancake')
+		cls.pancake.ingredients.add(cls.egg, cls.flour, cls.milk)
+
+	def setUp(self):
+		super().setUp()
+		pantry_indexes.invalidate()
+
+	def test_pantry_all_present(self):
+		"""Test if only recipes with every ingredient at hand are returned"""
+		res = self.client.get(RECIPE_PANTRY_URL, {'ingredients': f'{self.egg.id},{self.milk.id}'})
+
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		self.assertEqual([item['recipe']['id'] for item in res.data], [self.omelette.id])
+		self.assertEqual(res.data[0]['missing'], [])
+		self.assertEqual(res.data[0]['coverage'], 1.0)
+
+	def test_pantry_missing_ingredients(self):
+		"""Test if recipes missing at most k ingredients are ranked by missing count"""
+		res = self.client.get(RECIPE_PANTRY_URL, {'ingredients': f'{self.egg.id},{self.milk.id}', 'missing': 1})
+
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		self.assertEqual([item['recipe']['id'] for item in res.data], [self.omelette.id, self.pancake.id])
+		self.assertEqual(res.data[1]['missing'], [self.flour.id])
+		self.assertAlmostEqual(res.data[1]['coverage'], 2 / 3, places=3)
+
+	def test_pantry_own_recipes_only(self):
+		"""Test if recipes of other users and deleted recipes are never matched"""
+		other = mock_user(email='other@example.com')
+		other_recipe = mock_recipe(other)
+		other_recipe.ingredients.add(mock_ingredient(other, 'egg'))
+		Recipe.objects.filter(id=self.omelette.id).soft_delete()
+
+		res = self.client.get(RECIPE_PANTRY_URL, {'ingredients': f'{self.egg.id}', 'missing': 2})
+
+		self.assertEqual([item['recipe']['id'] for item in res.data], [self.pancake.id])
+
+	def test_pantry_invalid_ingredients(self):
+		res = self.client.get(RECIPE_PANTRY_URL, {'ingredients': 'egg'})
+		self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_pantry_huge_missing(self):
+		"""Test if a huge missing count is capped instead of looping over it for every recipe"""
+		with patch('recipe.pantry.PantryIndex.match', autospec=True, side_effect=PantryIndex.match) as mock_match:
+			res = self.client.get(RECIPE_PANTRY_URL, {'ingredients': f'{self.egg.id}', 'missing': 100000})
+
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		self.assertEqual([item['recipe']['id'] for item in res.data], [self.omelette.id, self.pancake.id])
+		self.assertEqual(mock_match.call_args.args[2], PANTRY_MISSING_MAX)
+
+class PantryIndexTest(TransactionTestCase):
+	"""Test that the pantry index follows committed M2M changes"""
+
+	def setUp(self):
+		pantry_indexes.invalidate()
+		self.user = mock_user()
+		self.egg = mock_ingredient(self.user, 'egg')
+		self.flour = mock_ingredient(self.user, 'flour')
+		self.recipe = mock_recipe(self.user)
+		self.recipe.ingredients.add(self.egg)
+
+	def test_index_updated_incrementally(self):
+		index = pantry_indexes.get(self.user.id)
+		self.assertEqual([m[0] for m in index.match([self.egg.id])], [self.recipe.id])
+
+		self.recipe.ingredients.add(self.flour)
+		self.assertIs(pantry_indexes.get(self.user.id), index)
+		self.assertEqual(index.match([self.egg.id]), [])
+
+		self.flour.recipe_set.remove(self.recipe)
+		self.assertEqual([m[0] for m in index.match([self.egg.id])], [self.recipe.id])
+
+		self.recipe.soft_delete()
+		self.assertEqual(index.match([self.egg.id]), [])
+
+	def test_bulk_soft_delete_invalidates_indexes(self):
+		"""Test that queryset soft deletes and restores, e.g. from the admin, drop cached indexes"""
+		index = pantry_indexes.get(self.user.id)
+		similar_index = similarity_indexes.get(self.user.id)
+
+		Recipe.objects.filter(id=self.recipe.id).soft_delete()
+		self.assertIsNot(pantry_indexes.get(self.user.id), index)
+		self.assertIsNot(similarity_indexes.get(self.user.id), similar_index)
+		self.assertEqual(pantry_indexes.get(self.user.id).match([self.egg.id]), [])
+
+		Recipe.all_objects.filter(id=self.recipe.id).restore()
+		self.assertEqual([m[0] for m in pantry_indexes.get(self.user.id).match([self.egg.id])], [self.recipe.id])
+
+	def test_update_during_build_replayed(self):
+		"""Test that changes committed while an index is built are not lost"""
+		build = PantryIndex.build
+
+		def build_then_update(user_id):
+			index = build(user_id)
+			pantry_indexes.update(user_id, 'add', self.recipe.id, [self.flour.id])
+			return index
+
+		with patch.object(pantry_indexes, 'build', build_then_update):
+			index = pantry_indexes.get(self.user.id)
+		self.assertEqual(index.match([self.egg.id]), [])
+		self.assertEqual([m[0] for m in index.match([self.egg.id, self.flour.id])], [self.recipe.id])
+
+	@override_settings(PANTRY_INDEX_MAX_USERS=1)
+	def test_least_recently_used_dropped(self):
+		other = mock_user('other@testi.com')
+		index = pantry_indexes.get(self.user.id)
+		pantry_indexes.get(other.id)
+		self.assertIsNot(pantry_indexes.get(self.user.id), index)
+
+class SimilarRecipeTest(AuthenticatedTestCase):
+	"""Test similar recipe recommendations"""
+
+	@classmethod
+	def setUpTestData(cls):
+		super().setUpTestData()
+		soup, asian = mock_tag(cls.user, 'soup'), mock_tag(cls.user, 'asian')
+		egg, noodle, pork = (mock_ingredient(cls.user, name) for name in ('egg', 'noodle', 'pork'))
+		cls.ramen = mock_recipe(cls.user, title='ramen')
+		cls.ramen.tags.add(soup, asian)
+		cls.ramen.ingredients.add(egg, noodle, pork)
+		cls.pho = mock_recipe(cls.user, title='pho')
+		cls.pho.tags.add(soup, asian)
+		cls.pho.ingredients.add(noodle, pork)
+		cls.omelette = mock_recipe(cls.user, title='omelette')
+		cls.omelette.ingredients.add(egg)
+		mock_recipe(cls.user, title='salad')
+
+	def setUp(self):
+		super().setUp()
+		similarity_indexes.invalidate()
+
+	def test_similar_recipes_ranked(self):
+		"""Test if recipes are ranked by weighted Jaccard similarity, unrelated ones left out"""
+		res = self.client.get(get_similar_url(self.ramen.id))
+
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		self.assertEqual([item['recipe']['id'] for item in res.data], [self.pho.id, self.omelette.id])
+		# tags 2/2 with weight 1, ingredients 2/3 with weight 2
+		self.assertAlmostEqual(res.data[0]['score'], (1 + 2 * 2 / 3) / 3, places=3)
+		self.assertAlmostEqual(res.data[1]['score'], (2 * 1 / 3) / 3, places=3)
+
+	def test_similar_recipes_limit(self):
+		res = self.client.get(get_similar_url(self.ramen.id), {'limit': 1})
+		self.assertEqual([item['recipe']['id'] for item in res.data], [self.pho.id])
+
+	def test_similar_recipes_of_other_user(self):
+		"""Test if similar recipes of another user's recipe cannot be read"""
+		other_recipe = mock_recipe(mock_user(email='other@example.com'))
+		res = self.client.get(get_similar_url(other_recipe.id))
+		self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+	@override_settings(SIMILAR_INDEX_MAX_USERS=1)
+	def test_least_recently_used_dropped(self):
+		index = similarity_indexes.get(self.user.id)
+		self.assertIs(similarity_indexes.get(self.user.id), index)
+		other = mock_user(email='other@example.com')
+		similarity_indexes.get(other.id)
+		self.assertIsNot(similarity_indexes.get(self.user.id), index)
+
+class ShoppingListRecipeTest(AuthenticatedTestCase):
+	"""Test shopping lists built from several recipes"""
+
+	@classmethod
+	def setUpTestData(cls):
+		super().setUpTestData()
+		cls.egg = mock_ingredient(cls.user, 'egg')
+		cls.flour = mock_ingredient(cls.user, 'flour')
+		cls.pancake = mock_recipe(cls.user, title='pancake', price=5, time_minute=20)
+		cls.pancake.ingredients.add(cls.egg, cls.flour)
+		cls.omelette = mock_recipe(cls.user, title='omelette', price=3, time_minute=10)
+		cls.omelette.ingredients.add(cls.egg)
+
+	def test_shopping_list(self):
+		"""Test if ingredients are listed once with recipe counts and totals"""
+		other_recipe = mock_recipe(mock_user(email='other@example.com'))
+		ids = f'{self.pancake.id},{self.omelette.id},{self.omelette.id},{other_recipe.id}'
+
+		with self.assertNumQueries(2):
+			res = self.client.get(RECIPE_SHOPPING_LIST_URL, {'recipes': ids})
+
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		self.assertEqual(res.data['recipe_count'], 2)
+		self.assertEqual(res.data['total_price'], '8.00')
+		self.assertEqual(res.data['total_time_minute'], 30)
+		self.assertEqual(res.data['ingredients'], [
+			{'id': self.egg.id, 'name': 'egg', 'recipe_count': 2},
+			{'id': self.flour.id, 'name': 'flour', 'recipe_count': 1},
+		])
+
+	def test_shopping_list_post_stream(self):
+		"""Test if a plan posted as JSON can be streamed as NDJSON"""
+		Recipe.objects.filter(id=self.pancake.id).soft_delete()
+		res = self.client.post(
+			f'{RECIPE_SHOPPING_LIST_URL}?type=ndjson',
+			{'recipes': [self.pancake.id, self.omelette.id]},
+			format='json'
+		)
+
+		lines = [json.loads(line) for line in b''.join(res.streaming_content).decode().splitlines()]
+		self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+		self.assertEqual(lines[0]['recipe_count'], 1)
+		self.assertEqual(lines[1:], [{'id': self.egg.id, 'name': 'egg', 'recipe_count': 1}])
+
+	def test_shopping_list_invalid_recipes(self):
+		res = self.client.get(RECIPE_SHOPPING_LIST_URL, {'recipes': 'pancake'})
+		self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_shopping_list_invalid_body(self):
+		"""Test if bodies other than {"recipes": [ids]} are rejected instead of failing"""
+		for body in ([self.pancake.id], {'recipes': '12'}, {'recipes': [self.pancake.id, 'egg']}, {}):
+			res = self.client.post(RECIPE_SHOPPING_LIST_URL, body, format='json')
+			self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_shopping_list_ids_out_of_range(self):
+		"""Test if ids no integer column holds and too many recipes are rejected"""
+		for ids in ('99999999999999999999999', '0', ','.join(map(str, range(1, 1002)))):
+			res = self.client.get(RECIPE_SHOPPING_LIST_URL, {'recipes': ids})
+			self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+class ImageRecipeTest(TemporaryMediaMixin, AuthenticatedTestCase):
 	"""Test recipe image API"""
 	def setUp(self):
 		"""Setup the test with authenticated user and premade recipe"""
@@ -1,18 +1,15 @@
 from django.test import TestCase
-from django.contrib.auth import get_user_model
 from django.urls import reverse
 
 from core.tests.authenticated_test_case import AuthenticatedTestCase
+from core.tests.factories import mock_user
 from rest_framework.test import APIClient
 from rest_framework import status
-from core.models import Tag
+from core.models import Tag, Recipe
 from recipe.serializers import TagSerializer
 
 TAG_URL = reverse('recipe:tag-list')
 
-def mock_user(email='test@example.com', password='helloworld'):
-	return get_user_model().objects.create_user(email=email, password=password)
-
 class PublicTagApiTests(TestCase):
 	"""Test public tag API."""
 	def setUp(self):
@@ -76,5 +73,45 @@ class PrivateTagApiTests(AuthenticatedTestCase):
 		# Assertions
 		self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
+	def test_list_tags_with_recipe_count(self):
+		"""Test if listed tags include the number of recipes using them"""
+		tag_1 = Tag.objects.create(name='Tag1', user=self.user)
+		Tag.objects.create(name='Tag2', user=self.user)
+		for _ in range(2):
+			recipe = Recipe.objects.create(title='Recipe', price=10, time_minute=10, user=self.user)
+			recipe.tags.add(tag_1)
+
+		res = self.client.get(TAG_URL)
+
+		# Assertions
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		self.assertEqual([item['recipe_count'] for item in res.data], [2, 0])
 
+	def test_list_assigned_tags_only(self):
+		"""Test if assigned_only filter returns only tags used by a recipe"""
+		tag_1 = Tag.objects.create(name='Tag1', user=self.user)
+		Tag.objects.create(name='Tag2', user=self.user)
+		recipe = Recipe.objects.create(title='Recipe', price=10, time_minute=10, user=self.user)
+		recipe.tags.add(tag_1)
 
+		res = self.client.get(TAG_URL, {'assigned_only': 1})
+
+		# Assertions
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		self.assertEqual(len(res.data), 1)
+		self.assertEqual(res.data[0]['id'], tag_1.id)
+
+	def test_soft_deleted_tags_hidden(self):
+		"""Test if soft deleted tags and recipes are not listed nor counted"""
+		tag_1 = Tag.objects.create(name='Tag1', user=self.user)
+		Tag.objects.create(name='Tag2', user=self.user).soft_delete()
+		recipe = Recipe.objects.create(title='Recipe', price=10, time_minute=10, user=self.user)
+		recipe.tags.add(tag_1)
+		recipe.soft_delete()
+
+		res = self.client.get(TAG_URL)
+
+		# Assertions
+		self.assertEqual(res.status_code, status.HTTP_200_OK)
+		self.assertEqual(len(res.data), 1)
+		self.assertEqual(res.data[0]['recipe_count'], 0)
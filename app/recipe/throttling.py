@@ -0,0 +1,19 @@
+from rest_framework.throttling import UserRateThrottle
+
+class RecipeReadRateThrottle(UserRateThrottle):
+	"""Throttle safe requests to recipe endpoints per user"""
+	scope = 'recipe_read'
+
+	def allow_request(self, request, view):
+		if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+			return True
+		return super().allow_request(request, view)
+
+class RecipeWriteRateThrottle(UserRateThrottle):
+	"""Throttle unsafe requests to recipe endpoints per user"""
+	scope = 'recipe_write'
+
+	def allow_request(self, request, view):
+		if request.method in ('GET', 'HEAD', 'OPTIONS'):
+			return True
+		return super().allow_request(request, view)
@@ -1,19 +1,64 @@
-from rest_framework import viewsets, mixins, authentication, permissions, status
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Avg, Count, Q
+from django.http import StreamingHttpResponse
+from rest_framework import viewsets, mixins, permissions, status, exceptions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
 from . import serializers
-from core.models import Tag, Ingredient, Recipe
+from .export import EXPORT_FORMATS, stream_export
+from .idempotency import idempotent
+from .importer import RecipeImporter, RecipeImportError, parse_rows
+from .pagination import RecipeCursorPagination
+from .pantry import pantry_indexes
+from .similarity import similarity_indexes
+from .shopping import format_item, get_shopping_list_items, get_shopping_list_totals, stream_shopping_list
+from .throttling import RecipeReadRateThrottle, RecipeWriteRateThrottle
+from core.authentication import ExpiringTokenAuthentication
+from core.models import Tag, Ingredient, Recipe, RecipeTag, RecipeIngredient
+
+# Query params are compared with integer and price columns, larger values do not fit them
+MAX_INTEGER = 2 ** 31
+PRICE_FIELD = Recipe._meta.get_field('price')
+MAX_PRICE = Decimal(10) ** (PRICE_FIELD.max_digits - PRICE_FIELD.decimal_places)
+# Sort keys accepted by RecipeViewSet, each one is backed by a (user, field) index
+RECIPE_ORDERINGS = ('title', 'price', '-price', 'time_minute', '-time_minute')
+# Number of recipes using a tag/ingredient, soft deleted recipes do not count
+RECIPE_COUNT = Count('recipe', filter=Q(recipe__deleted_at__isnull=True))
+STATS_TOP_COUNT = 5
+STATS_TOP_COUNT_MAX = 50
+PANTRY_MATCH_LIMIT = 20
+PANTRY_MATCH_LIMIT_MAX = 100
+# Recipes missing more ingredients than this are not worth listing
+PANTRY_MISSING_MAX = 50
+SIMILAR_LIMIT = 10
+SIMILAR_LIMIT_MAX = 100
 
 class BaseRecipeViewSet(viewsets.GenericViewSet, mixins.ListModelMixin, mixins.CreateModelMixin):
 	"""Base configurations for Recipe attributes (Tags, Ingredients,...)"""
-	authentication_classes = (authentication.TokenAuthentication,)
+	authentication_classes = (ExpiringTokenAuthentication,)
 	permission_classes = (permissions.IsAuthenticated,)
+	throttle_classes = (RecipeReadRateThrottle, RecipeWriteRateThrottle)
 
 	# Overwrite default method
 	def get_queryset(self):
-		"""Return only tags belong to current authenticated user"""
-		return self.queryset.filter(user=self.request.user).order_by('name')
+		"""
+		Return only tags belong to current authenticated user
+		- Annotate each one with the number of recipes using it
+		- Only return the ones used by a recipe if assigned_only is set
+		"""
+		queryset = self.queryset.filter(user=self.request.user).annotate(
+			recipe_count=RECIPE_COUNT
+		)
+		if self.request.query_params.get('assigned_only') in ('1', 'true'):
+			queryset = queryset.filter(recipe_count__gt=0)
+
+		return queryset.order_by('name')
+
+	@idempotent
+	def create(self, request, *args, **kwargs):
+		return super().create(request, *args, **kwargs)
 
 	def perform_create(self, serializer):
 		"""Create a new tag for an user"""
@@ -38,28 +83,73 @@ class RecipeViewSet(viewsets.ModelViewSet):
 	"""
 	serializer_class = serializers.RecipeSerializer
 	queryset = Recipe.objects.all()
-	authentication_classes = (authentication.TokenAuthentication,)
+	authentication_classes = (ExpiringTokenAuthentication,)
 	permission_classes = (permissions.IsAuthenticated,)
+	throttle_classes = (RecipeReadRateThrottle, RecipeWriteRateThrottle)
+	pagination_class = RecipeCursorPagination
 
 	def __params_to_ints(self, qs):
 		"""Convert a list of string Ids to a list of integers"""
 		return [int(str_id) for str_id in qs.split(',')]
 
+	def __param_to_number(self, name, convert, limit=MAX_INTEGER):
+		"""Convert a query param to a number below limit in absolute value, None if it is missing"""
+		value = self.request.query_params.get(name)
+		if value is None:
+			return None
+		try:
+			number = convert(value)
+		except (ValueError, InvalidOperation):
+			raise exceptions.ValidationError({name: 'Must be a number'})
+		# NaN and Infinity are valid Decimals, neither they nor overflowing values fit a column
+		if (isinstance(number, Decimal) and not number.is_finite()) or abs(number) >= limit:
+			raise exceptions.ValidationError({name: f'Must be a number between -{limit} and {limit}'})
+		return number
+
+	def get_ordering(self):
+		"""Return whitelisted ordering, with id as tie breaker for keyset pagination"""
+		ordering = self.request.query_params.get('ordering', 'title')
+		if ordering not in RECIPE_ORDERINGS:
+			raise exceptions.ValidationError({'ordering': f'Must be one of {", ".join(RECIPE_ORDERINGS)}'})
+		return (ordering, '-id' if ordering.startswith('-') else 'id')
+
 	def get_queryset(self):
 		"""Return recipe belongs to an user"""
 		tags = self.request.query_params.get('tags')
 		ingredients = self.request.query_params.get('ingredients')
+		price_min = self.__param_to_number('price_min', Decimal, MAX_PRICE)
+		price_max = self.__param_to_number('price_max', Decimal, MAX_PRICE)
+		time_max = self.__param_to_number('time_max', int)
 		queryset = self.queryset
 
+		# Relations carry user_id, so these subqueries are index-only scans
+		# on (user_id, tag_id, recipe_id) that never join core_recipe
 		if tags:
 			tag_ids = self.__params_to_ints(tags)
-			queryset = queryset.filter(tags__id__in=tag_ids)
+			queryset = queryset.filter(id__in=RecipeTag.objects.filter(
+				user=self.request.user, tag_id__in=tag_ids
+			).values('recipe_id'))
 
 		if ingredients:
 			ingredient_ids = self.__params_to_ints(ingredients)
-			queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+			queryset = queryset.filter(id__in=RecipeIngredient.objects.filter(
+				user=self.request.user, ingredient_id__in=ingredient_ids
+			).values('recipe_id'))
+
+		if price_min is not None:
+			queryset = queryset.filter(price__gte=price_min)
 
-		return queryset.filter(user=self.request.user).order_by('title')
+		if price_max is not None:
+			queryset = queryset.filter(price__lte=price_max)
+
+		if time_max is not None:
+			queryset = queryset.filter(time_minute__lte=time_max)
+
+		return (
+			queryset.filter(user=self.request.user)
+			.prefetch_related(*serializers.get_ordered_relations())
+			.order_by(*self.get_ordering())
+		)
 
 	def get_serializer_class(self):
 		"""Return proper serializer class for action"""
@@ -70,11 +160,181 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
 		return self.serializer_class
 
+	@idempotent
+	def create(self, request, *args, **kwargs):
+		return super().create(request, *args, **kwargs)
+
 	def perform_create(self, serializer):
 		"""Create a new recipe for own user"""
 		serializer.save(user=self.request.user)
 
+	def perform_destroy(self, instance):
+		"""Soft delete, rows and image are removed later by purge_deleted"""
+		instance.soft_delete()
+
+	def __top_usage(self, model, limit):
+		"""Return most used tags/ingredients with a single GROUP BY over the M2M table"""
+		return (
+			model.objects
+			.filter(user=self.request.user)
+			.annotate(recipe_count=RECIPE_COUNT)
+			.filter(recipe_count__gt=0)
+			.order_by('-recipe_count', 'name')
+			.values('id', 'name', 'recipe_count')[:limit]
+		)
+
+	@action(detail=False, methods=['get'])
+	def stats(self, request):
+		"""Return recipe count, averages and most used tags/ingredients of own recipes"""
+		try:
+			limit = int(request.query_params.get('top', STATS_TOP_COUNT))
+		except ValueError:
+			return Response({'top': 'Must be an integer'}, status.HTTP_400_BAD_REQUEST)
+		limit = max(1, min(limit, STATS_TOP_COUNT_MAX))
+
+		stats = Recipe.objects.filter(user=request.user).aggregate(
+			recipe_count=Count('id'),
+			average_price=Avg('price'),
+			average_time_minute=Avg('time_minute'),
+		)
+		stats['top_tags'] = self.__top_usage(Tag, limit)
+		stats['top_ingredients'] = self.__top_usage(Ingredient, limit)
+		serializer = serializers.RecipeStatsSerializer(stats)
+		return Response(serializer.data, status.HTTP_200_OK)
+
+	@action(detail=False, methods=['get'])
+	def pantry(self, request):
+		"""
+		Return own recipes which can be cooked with the given ingredients
+		- ?ingredients=1,2,3 are the ingredients at hand
+		- ?missing=k also returns recipes missing at most k ingredients, k is capped to PANTRY_MISSING_MAX
+		- Recipes are ranked by fewest missing ingredients, then by coverage
+		"""
+		ingredients = request.query_params.get('ingredients')
+		try:
+			ingredient_ids = self.__params_to_ints(ingredients) if ingredients else []
+		except ValueError:
+			return Response({'ingredients': 'Must be a comma separated list of ids'}, status.HTTP_400_BAD_REQUEST)
+		missing = max(0, min(self.__param_to_number('missing', int) or 0, PANTRY_MISSING_MAX))
+		limit = self.__param_to_number('limit', int) or PANTRY_MATCH_LIMIT
+		limit = max(1, min(limit, PANTRY_MATCH_LIMIT_MAX))
+
+		index = pantry_indexes.get(request.user.pk)
+		matches = index.match(ingredient_ids, missing)[:limit]
+		recipes = (
+			Recipe.objects.filter(user=request.user)
+			.prefetch_related(*serializers.get_ordered_relations())
+			.in_bulk([recipe_id for recipe_id, _, _ in matches])
+		)
+		results = [
+			{
+				'recipe': recipes[recipe_id],
+				'missing': index.ingredient_ids(missing_mask),
+				'coverage': round(coverage, 4),
+			}
+			for recipe_id, missing_mask, coverage in matches
+			if recipe_id in recipes
+		]
+		serializer = serializers.PantryMatchSerializer(results, many=True)
+		return Response(serializer.data, status.HTTP_200_OK)
+
+	@action(detail=True, methods=['get'])
+	def similar(self, request, pk=None):
+		"""Return own recipes sharing the most tags and ingredients with a recipe"""
+		recipe = self.get_object()
+		limit = self.__param_to_number('limit', int) or SIMILAR_LIMIT
+		limit = max(1, min(limit, SIMILAR_LIMIT_MAX))
+
+		scores = similarity_indexes.get(request.user.pk).similar(recipe.id, limit)
+		recipes = (
+			Recipe.objects.filter(user=request.user)
+			.prefetch_related(*serializers.get_ordered_relations())
+			.in_bulk([recipe_id for recipe_id, _ in scores])
+		)
+		results = [
+			{'recipe': recipes[recipe_id], 'score': round(score, 4)}
+			for recipe_id, score in scores
+			if recipe_id in recipes
+		]
+		serializer = serializers.SimilarRecipeSerializer(results, many=True)
+		return Response(serializer.data, status.HTTP_200_OK)
+
+	@action(detail=False, methods=['get', 'post'], url_path='shopping-list')
+	def shopping_list(self, request):
+		"""
+		Return the ingredients needed by a set of own recipes
+		- Recipe ids come from ?recipes=1,2,3, or from a POST body {"recipes": [...]} for large plans
+		- Each ingredient is listed once with the number of recipes needing it
+		- ?type=ndjson streams the totals then one line per ingredient
+		"""
+		if request.method == 'POST':
+			data = request.data
+		else:
+			data = {'recipes': request.query_params.get('recipes', '').split(',')}
+		serializer = serializers.ShoppingListRequestSerializer(data=data)
+		if not serializer.is_valid():
+			return Response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+		recipe_ids = list(dict.fromkeys(serializer.validated_data['recipes']))
+
+		if request.query_params.get('type') == 'ndjson':
+			return StreamingHttpResponse(
+				stream_shopping_list(request.user, recipe_ids),
+				content_type=EXPORT_FORMATS['ndjson']
+			)
+
+		shopping_list = get_shopping_list_totals(request.user, recipe_ids)
+		shopping_list['ingredients'] = [
+			format_item(item) for item in get_shopping_list_items(request.user, recipe_ids)
+		]
+		serializer = serializers.ShoppingListSerializer(shopping_list)
+		return Response(serializer.data, status.HTTP_200_OK)
+
+	@action(detail=False, methods=['get'])
+	def export(self, request):
+		"""Stream all own recipes as NDJSON (default) or CSV with ?type=csv"""
+		export_format = request.query_params.get('type', 'ndjson')
+		if export_format not in EXPORT_FORMATS:
+			return Response({'type': f'Must be one of {", ".join(EXPORT_FORMATS)}'}, status.HTTP_400_BAD_REQUEST)
+
+		response = StreamingHttpResponse(
+			stream_export(request.user, export_format),
+			content_type=EXPORT_FORMATS[export_format]
+		)
+		response['Content-Disposition'] = f'attachment; filename="recipes.{export_format}"'
+		return response
+
+	@action(detail=False, methods=['post'], url_path='import')
+	def import_recipes(self, request):
+		"""
+		Import recipes from an uploaded NDJSON or CSV export
+		- The format comes from ?type=, or from the file extension
+		- ?skip=N resumes a failed import after its N committed rows
+		"""
+		upload = request.FILES.get('file')
+		if upload is None:
+			return Response({'file': 'This field is required'}, status.HTTP_400_BAD_REQUEST)
+
+		import_format = request.query_params.get('type', upload.name.rsplit('.', 1)[-1])
+		if import_format not in EXPORT_FORMATS:
+			return Response({'type': f'Must be one of {", ".join(EXPORT_FORMATS)}'}, status.HTTP_400_BAD_REQUEST)
+		skip = max(self.__param_to_number('skip', int) or 0, 0)
+
+		importer = RecipeImporter(request.user)
+		try:
+			importer.run(parse_rows(upload, import_format), skip=skip)
+		except RecipeImportError as error:
+			return Response({
+				'detail': error.args[0],
+				'row': error.row,
+				'committed': error.committed,
+			}, status.HTTP_400_BAD_REQUEST)
+		return Response({
+			'imported': importer.imported,
+			'rows_per_second': round(importer.rows_per_second),
+		}, status.HTTP_201_CREATED)
+
 	@action(detail=True, methods=['post'], url_path='upload-image')
+	@idempotent
 	def upload_image(self, request, pk=None):
 		recipe = self.get_object()
 		# Get serializer instance
@@ -1,5 +1,7 @@
 from django.contrib.auth import get_user_model, authenticate
-from rest_framework import serializers
+from rest_framework import serializers, exceptions
+
+from user.throttling import login_limiter, get_login_keys
 
 class UserSerializer(serializers.ModelSerializer):
 	"""Serializer from the user object"""
@@ -29,13 +31,21 @@ class AuthTokenSerializer(serializers.Serializer):
 		"""Validate and authenticate user"""
 		email = attrs.get('email')
 		password = attrs.get('password')
+		request = self.context.get('request')
+		# Reject throttled attempts before paying for a password hash
+		keys = get_login_keys(request, email)
+		if not login_limiter.is_allowed(*keys):
+			raise exceptions.Throttled(wait=login_limiter.wait(*keys))
+
 		user = authenticate(
-			request = self.context.get('request'),
+			request = request,
 			username = email,
 			password = password
 		)
 		if not user:
+			login_limiter.hit(*keys)
 			msg = 'Unable to authenticate'
 			raise serializers.ValidationError(msg, code='authentication')
+		login_limiter.reset(keys[0])
 		attrs['user'] = user
 		return attrs
@@ -1,9 +1,19 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+from django.utils import timezone
 
-from rest_framework.test import APIClient, force_authenticate
+from rest_framework.test import APIClient
 from rest_framework import status
+from unittest.mock import patch
+from core.authentication import ExpiringTokenAuthentication
+from core.models import ExpiringToken
+from core.tests.authenticated_test_case import AuthenticatedTestCase
+from core.tests.factories import mock_user
+from user.throttling import SlidingWindowRateLimiter, login_limiter
 
 CREATE_USER_URL = reverse('user:create')
 TOKEN_URL = reverse('user:token')
@@ -15,13 +25,11 @@ USER_PAYLOAD = {
 	'name': 'Test user'
 }
 
-def create_user(**params):
-	return get_user_model().objects.create_user(**params)
-
 class PublicUserApiTests(TestCase):
 	"""Test the public users API"""
 	def setUp(self):
 		self.client = APIClient()
+		login_limiter.reset()
 
 	def test_create_valid_user_success(self):
 		"""Test creating user with valid payload"""
@@ -32,13 +40,6 @@ class PublicUserApiTests(TestCase):
 		self.assertTrue(user.check_password(USER_PAYLOAD['password']))
 		self.assertNotIn('password', res.data)
 
-	def test_user_exists(self):
-		"""Test if creating an already existed user fails"""
-		# Create an user
-		create_user(**USER_PAYLOAD)
-		res = self.client.post(CREATE_USER_URL, USER_PAYLOAD)
-		self.assertEquals(res.status_code, status.HTTP_400_BAD_REQUEST)
-
 	def test_user_valid_password(self):
 		"""Test if creating a new user with less than 5 chars password fails"""
 		res = self.client.post(CREATE_USER_URL, {
@@ -48,20 +49,92 @@ class PublicUserApiTests(TestCase):
 		user_exists = get_user_model().objects.filter(email = USER_PAYLOAD['email'])
 		self.assertFalse(user_exists)
 
+	@patch.object(login_limiter, 'attempts', 2)
+	def test_create_token_forwarded_for_ignored(self):
+		"""Test if clients cannot escape the IP limit by sending X-Forwarded-For"""
+		for index in range(2):
+			self.client.post(
+				TOKEN_URL, {'email': f'user{index}@testi.com', 'password': 'wrong_password'},
+				HTTP_X_FORWARDED_FOR=f'10.0.0.{index}',
+			)
+		res = self.client.post(
+			TOKEN_URL, {'email': 'user2@testi.com', 'password': 'wrong_password'},
+			HTTP_X_FORWARDED_FOR='10.0.0.2',
+		)
+		# Assertions
+		self.assertEquals(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+	def test_limiter_memory_bounded(self):
+		"""Test if checked keys are not kept and hit keys are capped"""
+		limiter = SlidingWindowRateLimiter(attempts=2, window=60, max_keys=2)
+		self.assertTrue(limiter.is_allowed('ip:1', 'ip:2'))
+		self.assertEquals(len(limiter._histories), 0)
+		for key in ('ip:1', 'ip:2', 'ip:3'):
+			limiter.hit(key)
+		# Assertions
+		self.assertEquals(list(limiter._histories), ['ip:2', 'ip:3'])
+
+	def test_private_manage_user_endpoint(self):
+		"""Test if manage user endpoint is a private one."""
+		res = self.client.get(MANAGE_USER_URL)
+		# Assertions
+		self.assertEquals(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+class UserTokenApiTests(TestCase):
+	"""Test logging in an existing user"""
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = mock_user(**USER_PAYLOAD)
+
+	def setUp(self):
+		self.client = APIClient()
+		login_limiter.reset()
+
+	def test_user_exists(self):
+		"""Test if creating an already existed user fails"""
+		res = self.client.post(CREATE_USER_URL, USER_PAYLOAD)
+		self.assertEquals(res.status_code, status.HTTP_400_BAD_REQUEST)
+
 	def test_create_token(self):
 		"""Test that a valid token could be created for an user"""
-		# First, create a new user
-		create_user(**USER_PAYLOAD)
-		# Use data of the new user to request for the token
+		# Use data of the existing user to request for the token
 		res = self.client.post(TOKEN_URL, USER_PAYLOAD)
 		# Assertions
 		self.assertEquals(res.status_code, status.HTTP_200_OK)
 		# Make sure token field exists in res.data
 		self.assertIn('token', res.data)
+		self.assertIn('expires_at', res.data)
+
+	def test_create_token_rotates_previous_token(self):
+		"""Test that logging in again with a token invalidates that token only"""
+		other_device_token = self.client.post(TOKEN_URL, USER_PAYLOAD).data['token']
+		first_token = self.client.post(TOKEN_URL, USER_PAYLOAD).data['token']
+		self.client.credentials(HTTP_AUTHORIZATION=f'Token {first_token}')
+		second_token = self.client.post(TOKEN_URL, USER_PAYLOAD).data['token']
+		self.assertNotEquals(first_token, second_token)
+
+		res = self.client.get(MANAGE_USER_URL)
+		self.assertEquals(res.status_code, status.HTTP_401_UNAUTHORIZED)
+		self.client.credentials(HTTP_AUTHORIZATION=f'Token {other_device_token}')
+		res = self.client.get(MANAGE_USER_URL)
+		self.assertEquals(res.status_code, status.HTTP_200_OK)
+
+	# Default of app.settings_api, views without authentication_classes check the token
+	@patch('rest_framework.views.APIView.authentication_classes', (ExpiringTokenAuthentication,))
+	def test_create_token_with_expired_or_unknown_token(self):
+		"""Test if a device logging in again with a token that is no longer valid gets a new one"""
+		expired_token = ExpiringToken.objects.create(user=self.user)
+		ExpiringToken.objects.filter(key=expired_token.key).update(
+			created=timezone.now() - timedelta(seconds=settings.TOKEN_TTL + 1)
+		)
+		for key in (expired_token.key, 'unknown'):
+			self.client.credentials(HTTP_AUTHORIZATION=f'Token {key}')
+			res = self.client.post(TOKEN_URL, USER_PAYLOAD)
+			self.assertEquals(res.status_code, status.HTTP_200_OK)
+		self.assertFalse(ExpiringToken.objects.filter(key=expired_token.key).exists())
 
 	def test_create_token_invalid_credentials(self):
 		"""Test if create token fails if invalid credentials are provided"""
-		create_user(**USER_PAYLOAD)
 		invalid_credential = USER_PAYLOAD.copy()
 		invalid_credential['email'] = 'invalid_email@test.com'
 		res = self.client.post(TOKEN_URL, invalid_credential)
@@ -71,7 +144,6 @@ class PublicUserApiTests(TestCase):
 
 	def test_create_token_missing_user_fields(self):
 		"""Test if create token fails if user fields are missing"""
-		create_user(**USER_PAYLOAD)
 		missing_fields_credential = USER_PAYLOAD.copy()
 		missing_fields_credential['password'] = ''
 		res = self.client.post(TOKEN_URL, missing_fields_credential)
@@ -79,18 +151,37 @@ class PublicUserApiTests(TestCase):
 		self.assertEquals(res.status_code, status.HTTP_400_BAD_REQUEST)
 		self.assertNotIn('token', res.data)
 
-	def test_private_manage_user_endpoint(self):
-		"""Test if manage user endpoint is a private one."""
-		res = self.client.get(MANAGE_USER_URL)
+	def test_create_token_throttled_after_failed_attempts(self):
+		"""Test if login is throttled before hashing once attempts are used up"""
+		invalid_credential = USER_PAYLOAD.copy()
+		invalid_credential['password'] = 'wrong_password'
+		for _ in range(login_limiter.attempts):
+			res = self.client.post(TOKEN_URL, invalid_credential)
+			self.assertEquals(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+		with patch('user.serializers.authenticate') as mock_authenticate:
+			res = self.client.post(TOKEN_URL, USER_PAYLOAD)
+			mock_authenticate.assert_not_called()
 		# Assertions
-		self.assertEquals(res.status_code, status.HTTP_401_UNAUTHORIZED)
+		self.assertEquals(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+		self.assertNotIn('token', res.data)
+		self.assertEquals(login_limiter.get_stats()['hashes_avoided'], 1)
 
-class PrivateUserApiTests(TestCase):
-	def setUp(self):
-		self.user = create_user(**USER_PAYLOAD)
-		self.client = APIClient()
-		# Force authenticate the user
-		self.client.force_authenticate(user=self.user)
+	@patch.object(login_limiter, 'attempts', 2)
+	def test_create_token_success_resets_email_attempts(self):
+		"""Test if a successful login clears failed attempts of the email"""
+		invalid_credential = USER_PAYLOAD.copy()
+		invalid_credential['password'] = 'wrong_password'
+		self.client.post(TOKEN_URL, invalid_credential, REMOTE_ADDR='10.0.0.1')
+		res = self.client.post(TOKEN_URL, USER_PAYLOAD, REMOTE_ADDR='10.0.0.2')
+		self.assertEquals(res.status_code, status.HTTP_200_OK)
+		self.client.post(TOKEN_URL, invalid_credential, REMOTE_ADDR='10.0.0.3')
+		res = self.client.post(TOKEN_URL, invalid_credential, REMOTE_ADDR='10.0.0.4')
+		# Assertions
+		self.assertEquals(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+class PrivateUserApiTests(AuthenticatedTestCase):
+	"""Test the users API of an authenticated user"""
 
 	def test_get_user_success(self):
 		"""Test if authenticated user can get own user data"""
@@ -110,4 +201,3 @@ class PrivateUserApiTests(TestCase):
 			'email': params['email'],
 			'name': params['name']
 		})
-
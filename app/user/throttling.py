@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+class SlidingWindowRateLimiter:
+	"""
+	Sliding window rate limiter for login attempts
+	- Keeps a history of attempt timestamps per key
+	- Histories live in process memory, or in a shared cache when cache_alias is given
+	- In memory, empty histories are dropped and at most max_keys are kept,
+	  the least recently hit keys are forgotten first
+	"""
+	def __init__(self, attempts, window, cache_alias=None, prefix='login', max_keys=100000):
+		self.attempts = attempts
+		self.window = window
+		self.prefix = prefix
+		self.max_keys = max_keys
+		self.cache = caches[cache_alias] if cache_alias else None
+		self._histories = OrderedDict()
+		self._lock = threading.Lock()
+		self.stats = {'checked': 0, 'throttled': 0, 'failed': 0}
+
+	def _cache_key(self, key):
+		return f'{self.prefix}:{key}'
+
+	def _history(self, key, now):
+		"""Return the attempt history of a key, dropping expired attempts"""
+		if self.cache is not None:
+			history = deque(self.cache.get(self._cache_key(key), []))
+		else:
+			history = self._histories.get(key, deque())
+		while history and history[0] <= now - self.window:
+			history.popleft()
+		if not history:
+			self._histories.pop(key, None)
+		return history
+
+	def _store(self, key, history, now):
+		"""Keep the history of a key in memory, making room for it if needed"""
+		self._histories[key] = history
+		self._histories.move_to_end(key)
+		if len(self._histories) <= self.max_keys:
+			return
+		for expired_key in [
+			expired_key for expired_key, expired in self._histories.items()
+			if expired[-1] <= now - self.window
+		]:
+			del self._histories[expired_key]
+		while len(self._histories) > self.max_keys:
+			self._histories.popitem(last=False)
+
+	def is_allowed(self, *keys):
+		"""Check if all keys still have attempts left in the current window"""
+		now = time.time()
+		with self._lock:
+			self.stats['checked'] += 1
+			for key in keys:
+				if len(self._history(key, now)) >= self.attempts:
+					self.stats['throttled'] += 1
+					return False
+		return True
+
+	def hit(self, *keys):
+		"""Record a failed attempt for all keys"""
+		now = time.time()
+		with self._lock:
+			self.stats['failed'] += 1
+			for key in keys:
+				history = self._history(key, now)
+				history.append(now)
+				if self.cache is not None:
+					self.cache.set(self._cache_key(key), list(history), self.window)
+				else:
+					self._store(key, history, now)
+
+	def reset(self, *keys):
+		"""Forget attempts of given keys, or of every key when none are given"""
+		with self._lock:
+			if not keys:
+				self._histories.clear()
+				for stat in self.stats:
+					self.stats[stat] = 0
+				return
+			for key in keys:
+				self._histories.pop(key, None)
+				if self.cache is not None:
+					self.cache.delete(self._cache_key(key))
+
+	def wait(self, *keys):
+		"""Return seconds until the oldest attempt of a throttled key expires"""
+		now = time.time()
+		with self._lock:
+			waits = [
+				history[0] + self.window - now
+				for history in (self._history(key, now) for key in keys)
+				if len(history) >= self.attempts
+			]
+		return max(waits) if waits else None
+
+	def get_stats(self):
+		"""Return counters, throttled attempts are password hashes avoided"""
+		with self._lock:
+			return dict(self.stats, hashes_avoided=self.stats['throttled'])
+
+login_limiter = SlidingWindowRateLimiter(
+	attempts=settings.LOGIN_THROTTLE_ATTEMPTS,
+	window=settings.LOGIN_THROTTLE_WINDOW,
+	cache_alias=settings.LOGIN_THROTTLE_CACHE,
+	max_keys=settings.LOGIN_THROTTLE_MAX_KEYS,
+)
+
+def get_login_keys(request, email):
+	"""
+	Return limiter keys for an attempt: the normalized email and the client IP
+	The IP only comes from X-Forwarded-For when NUM_PROXIES is set, see settings
+	"""
+	keys = [f'email:{email.strip().lower()}']
+	if request is not None:
+		keys.append(f'ip:{BaseThrottle().get_ident(request)}')
+	return keys
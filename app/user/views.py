@@ -1,23 +1,44 @@
-from rest_framework import generics, authentication, permissions
-from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework import generics, permissions
+from rest_framework.authentication import get_authorization_header
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
+from core.authentication import ExpiringTokenAuthentication
+from core.models import ExpiringToken
+from core.replicas import pin_to_primary
 from user.serializers import UserSerializer, AuthTokenSerializer
 
 class CreateUserView(generics.CreateAPIView):
 	"""Create a new user"""
 	serializer_class = UserSerializer
 
-class CreateTokenView(ObtainAuthToken):
-	"""Create a new token for user"""
+class CreateTokenView(generics.GenericAPIView):
+	"""Create a new token for user, replacing the token sent by the device if any"""
 	serializer_class = AuthTokenSerializer
 	renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+	# The token sent by the device is only read to replace it, it may have expired
+	authentication_classes = ()
+
+	def post(self, request, *args, **kwargs):
+		serializer = self.get_serializer(data=request.data)
+		serializer.is_valid(raise_exception=True)
+		token = ExpiringToken.objects.rotate(serializer.validated_data['user'], self.get_replaced_key(request))
+		# Replicas may not have the token yet, the first requests using it read from primary
+		pin_to_primary(token.key)
+		return Response({'token': token.key, 'expires_at': token.expires_at})
+
+	def get_replaced_key(self, request):
+		"""Return the token the device logs in with, it may have expired"""
+		auth = get_authorization_header(request).split()
+		if len(auth) == 2 and auth[0].lower() == b'token':
+			return auth[1].decode('latin1')
+		return None
 
 class ManageUserView(generics.RetrieveUpdateAPIView):
 	"""Manage the authenticated user"""
 	serializer_class = UserSerializer
-	authentication_classes = (authentication.TokenAuthentication,)
+	authentication_classes = (ExpiringTokenAuthentication,)
 	permission_classes = (permissions.IsAuthenticated,)
 
 	def get_object(self):
 		"""Retrieve and return authenticated user"""
-		return self.request.user
\ No newline at end of file
+		return self.request.user
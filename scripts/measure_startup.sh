@@ -0,0 +1,21 @@
+#!/bin/sh
+# Report image size and cold start time of the API service.
+# Cold start is measured from `docker-compose up` until the API answers
+# its first request (401 from an authenticated endpoint counts as up).
+set -e
+
+IMAGE=${IMAGE:-recipe-django-api}
+URL=${URL:-http://localhost:8000/api/user/me}
+
+docker build -q -t "$IMAGE" . > /dev/null
+echo "Image size: $(docker image inspect "$IMAGE" --format '{{.Size}}' | awk '{printf "%.1f MB", $1 / 1000000}')"
+
+docker-compose down -v > /dev/null 2>&1
+start=$(date +%s.%N)
+docker-compose up -d > /dev/null 2>&1
+until curl -s -o /dev/null -w '%{http_code}' "$URL" | grep -qE '^(200|401)$'; do
+	sleep 0.1
+done
+end=$(date +%s.%N)
+echo "Cold start to first request: $(echo "$end - $start" | bc) seconds"
+docker-compose down > /dev/null 2>&1